@@ -0,0 +1,145 @@
+import hashlib
+import json
+import math
+import shutil
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Optional, Set, Tuple
+
+from tarn import HashKeyStorage
+from tarn.utils import value_to_buffer
+
+from .digests import FileCache
+from .exceptions import HashError
+from .hash import Key, is_chunked, strip_chunked
+from .utils import PathOrStr
+
+
+AVERAGE_CHUNK_SIZE = 2 ** 20
+# each byte is mapped to a pseudo-random bit, and the chunks end only after a fixed pattern of these bits,
+# which is found at memory speed. The pattern mixes zeros and ones, so that it's found in text as well.
+# The table and the pattern must never change, otherwise the same files would be split differently
+_BITS = bytes(hashlib.sha256(bytes([i])).digest()[0] & 1 for i in range(256))
+_ANCHOR = bytes([1, 0, 0, 1, 1, 1, 0, 1])
+_WINDOW = 64
+
+
+def iter_chunks(buffer: BinaryIO, average_size: int = AVERAGE_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Split the contents of `buffer` into content-defined chunks of about `average_size` bytes.
+
+    A boundary is placed after an occurrence of a fixed pattern of bits, if the checksum of the last 64 bytes
+    also matches. Both depend only on the bytes right before the boundary, so an insertion or deletion changes
+    only the chunks around it, and the rest of the chunks stay the same.
+    """
+    min_size, max_size = average_size // 4, average_size * 8
+    # the pattern occurs once in `2 ** len(anchor)` bytes, and the checksum filters out the rest of the bits
+    bits = max(1, round(math.log2(max(average_size - min_size, 2))))
+    anchor = _ANCHOR[:bits]
+    mask = 2 ** (bits - len(anchor)) - 1
+
+    data, marks = bytearray(), bytearray()
+    finished = False
+    while True:
+        while not finished and len(data) < max_size:
+            block = buffer.read(max_size)
+            if not block:
+                finished = True
+            data += block
+            marks += block.translate(_BITS)
+
+        if not data:
+            return
+
+        limit = stop = min(len(data), max_size)
+        # the python code runs only for the rare occurrences of the pattern
+        position = marks.find(anchor, max(min_size - len(anchor), 0), limit)
+        while position >= 0:
+            end = position + len(anchor)
+            if not zlib.crc32(data[max(end - _WINDOW, 0):end]) & mask:
+                stop = end
+                break
+            position = marks.find(anchor, position + 1, limit)
+
+        yield bytes(data[:stop])
+        del data[:stop], marks[:stop]
+
+
+def write_chunked(path: PathOrStr, storage: HashKeyStorage, average_size: int = AVERAGE_CHUNK_SIZE) -> Key:
+    """
+    Save the file at `path` as a sequence of content-defined chunks, so that similar files share most of them.
+    Returns the key of the manifest, which lists the chunks alongside the digest of the whole file.
+    """
+    hasher = storage.algorithm()
+    chunks, size = [], 0
+    with open(path, 'rb') as file:
+        for chunk in iter_chunks(file, average_size):
+            hasher.update(chunk)
+            chunks.append([storage.write(chunk).hex(), len(chunk)])
+            size += len(chunk)
+
+    manifest = json.dumps({'digest': hasher.digest().hex(), 'size': size, 'chunks': chunks}).encode()
+    return 'C:' + storage.write(manifest).hex()
+
+
+def read_manifest(key: Key, storage: HashKeyStorage, fetch: Optional[bool] = None) -> dict:
+    return storage.read(_load_manifest, strip_chunked(key), fetch=fetch)
+
+
+def expand_keys(keys: Iterable[Key], storage: HashKeyStorage, fetch: Optional[bool] = None) -> Set[Key]:
+    """ Replace the keys of chunked files by the keys of their manifests and chunks """
+    result = set()
+    for key in keys:
+        if is_chunked(key):
+            result.add(strip_chunked(key))
+            result.update(chunk for chunk, _ in read_manifest(key, storage, fetch)['chunks'])
+        else:
+            result.add(key)
+
+    return result
+
+
+def copy_chunked(key: Key, storage: HashKeyStorage, file: BinaryIO, fetch: Optional[bool] = None):
+    """ Write the contents of the chunked file with a given `key` to `file` """
+    for chunk, _ in read_manifest(key, storage, fetch)['chunks']:
+        storage.read(_copy_value, chunk, file, fetch=fetch)
+
+
+def assemble(key: Key, storage: HashKeyStorage, files: FileCache, fetch: Optional[bool] = None) -> Tuple[Key, Path]:
+    """
+    Assemble the chunked file with a given `key` inside `files`, unless it's already there,
+    and return its digest alongside the path. Only the chunks are fetched from remote, and the storage keeps
+    only the chunks, the assembled copy is removed from `files` once it's among the least recently used ones.
+    """
+    manifest = read_manifest(key, storage, fetch)
+    digest = manifest['digest']
+
+    def write(file):
+        hasher = storage.algorithm()
+        for chunk, _ in manifest['chunks']:
+            storage.read(_copy_value, chunk, _HashingWriter(file, hasher), fetch=fetch)
+
+        written = hasher.hexdigest()
+        if written != digest:
+            raise HashError(f'The chunks of "{key}" are inconsistent: expected "{digest}", got "{written}"')
+
+    return digest, files.get(digest, write)
+
+
+def _load_manifest(value):
+    with value_to_buffer(value) as buffer:
+        return json.load(buffer)
+
+
+def _copy_value(value, file):
+    with value_to_buffer(value) as buffer:
+        shutil.copyfileobj(buffer, file)
+
+
+class _HashingWriter:
+    def __init__(self, file: BinaryIO, hasher):
+        self.file, self.hasher = file, hasher
+
+    def write(self, data):
+        self.hasher.update(data)
+        return self.file.write(data)
@@ -3,13 +3,14 @@ import shutil
 from pathlib import Path
 from typing import List, Optional
 
+import humanfriendly
 import typer
 from rich.progress import track
 from typing_extensions import Annotated
 
 from ..exceptions import HashError
 from ..hash import is_hash, to_hash
-from ..ops import Conflict, gather, load_hash, save_hash
+from ..ops import Conflict, gather, gather_hash, load_hash, save_hash
 from ..utils import PathOrStr
 from .app import app_command
 from .utils import normalize_sources_and_destination
@@ -30,13 +31,25 @@ def add(
         repository: Annotated[Path, typer.Option(
             '--repository', '--repo', help='The bev repository. It is usually detected automatically',
             show_default=False,
-        )] = None
+        )] = None,
+        nested: Annotated[bool, typer.Option(
+            help='Whether to store each folder as a separate tree. '
+                 'This way small changes to large folders create only a few new trees'
+        )] = False,
+        chunk_threshold: Annotated[Optional[str], typer.Option(
+            help='Split the files larger than this size, e.g. 1G, into content-defined chunks. '
+                 'This way small changes to large files store and transfer only the changed chunks',
+            show_default=False,
+        )] = None,
 ):
     """Add files and/or folders to a bev repository"""
     pairs, repo = normalize_sources_and_destination(sources, destination, repository)
     if not pairs:
         return
 
+    if chunk_threshold is not None:
+        chunk_threshold = humanfriendly.parse_size(chunk_threshold)
+
     for source, destination in pairs:
         if not is_hash(destination):
             destination = to_hash(destination)
@@ -45,10 +58,11 @@ def add(
             # TODO: warn
             continue
 
-        _gather_and_write(source, destination, keep, conflict, repo.storage)
+        _gather_and_write(source, destination, keep, conflict, repo, nested, chunk_threshold)
 
 
-def _gather_and_write(source: PathOrStr, destination: PathOrStr, keep: bool, conflict: Conflict, storage):
+def _gather_and_write(source: PathOrStr, destination: PathOrStr, keep: bool, conflict: Conflict, storage,
+                      nested: bool = False, chunk_threshold: Optional[int] = None):
     source, destination = Path(source), Path(destination)
     previous = None
     if destination.exists():
@@ -61,8 +75,10 @@ def _gather_and_write(source: PathOrStr, destination: PathOrStr, keep: bool, con
         if conflict != Conflict.replace:
             previous = load_hash(destination, storage)
 
-    current = gather(source, storage, track)
-    if previous is not None:
+    if previous is None:
+        current = gather_hash(source, storage, track, nested=nested, chunk_threshold=chunk_threshold)
+    else:
+        current = gather(source, storage, track, chunk_threshold=chunk_threshold)
         if isinstance(current, dict):
             if not isinstance(previous, dict):
                 raise HashError(f'The previous version ({destination}) is not a folder')
@@ -89,7 +105,7 @@ def _gather_and_write(source: PathOrStr, destination: PathOrStr, keep: bool, con
                     f'versions do not match, which is required for the "update" conflict resolution'
                 )
 
-    save_hash(current, destination, storage)
+    save_hash(current, destination, storage, nested)
 
     if not keep:
         if source.is_dir():
@@ -5,16 +5,20 @@ import typer
 from tqdm.auto import tqdm
 from typing_extensions import Annotated
 
-from ..hash import from_hash, is_hash
+from ..hash import from_hash, is_hash, is_tree, to_hash
 from ..shortcuts import get_current_repo
 from ..utils import call_git
-from .app import app_command
+from .app import app_command, cli_error
 
 
 @app_command
 def blame(
         path: Annotated[Path, typer.Argument(help='Path to the hash')],
-        relative: Annotated[str, typer.Argument(help='The relative path inside the hashed folder')]
+        relative: Annotated[str, typer.Argument(help='The relative path inside the hashed folder')],
+        bisect: Annotated[bool, typer.Option(
+            help='Use binary search over the history. Much faster for long histories, but assumes that '
+                 'once the value changed, it never went back to the current one'
+        )] = False,
 ):
     """Find the closest version which introduced a change to a value RELATIVE to the PATH"""
 
@@ -25,25 +29,50 @@ def blame(
     folder = path
     if is_hash(folder):
         folder = from_hash(folder)
-    base = repo.get_key(folder, relative, version=repo.latest_version())
+    else:
+        path = to_hash(path)
 
-    idx = 0
-    bar = tqdm()
-    while True:
-        idx += 1
-        output = call_git(f'git log -n 1 --skip {idx} --pretty=format:%H,%ct -- {path}', repo.root, True)
-        if not output:
-            break
+    # only the commits that changed the hash, in a single pass over the history
+    history = list(repo.vc.get_history(str(path)))
+    if not history:
+        raise cli_error(FileNotFoundError, f'The path "{path}" is not present in any commit')
+
+    values = {}
+
+    def get_value(index):
+        commit, time, key = history[index]
+        # the same key always contains the same value
+        if key not in values:
+            values[key] = None
+            if key is not None and is_tree(key):
+                values[key] = repo.get_key(folder, relative, version=commit, error=False)
 
-        commit, time = output.split(',', 1)
         bar.update()
-        bar.set_description_str(str(datetime.fromtimestamp(int(time))))
+        bar.set_description_str(str(datetime.fromtimestamp(time)))
+        return values[key]
+
+    bar = tqdm()
+    base = get_value(0)
+    if base is None:
+        bar.close()
+        raise cli_error(FileNotFoundError, f'The path "{relative}" is missing in the latest "{path}"')
+
+    # the index of the oldest commit that has the same value, as long as all the commits after it do too
+    if bisect:
+        start, stop = 0, len(history)
+        while stop - start > 1:
+            middle = (start + stop) // 2
+            if get_value(middle) == base:
+                start = middle
+            else:
+                stop = middle
+        index = start
 
-        current = repo.load_tree(path, commit)
-        if relative not in current or current[relative] != base:
-            bar.close()
-            print(call_git(f"git log --format='%an <%ae> at %aD' {commit}^!", repo.root, True))
-            return
+    else:
+        index = 0
+        while index + 1 < len(history) and get_value(index + 1) == base:
+            index += 1
 
     bar.close()
-    print(call_git(f"git log -n 1 --format='%an <%ae> at %aD' -- {path}", repo.root, True))
+    commit = history[index][0]
+    print(call_git(f"git log --format='%an <%ae> at %aD' {commit}^!", repo.root, True))
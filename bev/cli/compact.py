@@ -0,0 +1,43 @@
+from pathlib import Path
+
+import humanfriendly
+import typer
+from typing_extensions import Annotated
+
+from ..config import CONFIG, load_config
+from ..config.location import LevelConfig, LocationConfig, PackConfig
+from ..shortcuts import get_current_repo
+from .app import app_command
+
+
+@app_command
+def compact(
+        repository: Annotated[Path, typer.Option(
+            '--repository', '--repo', help='The bev repository. It is usually detected automatically',
+            show_default=False,
+        )] = None,
+):
+    """Free the space occupied by the deleted values in the local pack locations"""
+    repo = get_current_repo('.' if repository is None else repository)
+    config = load_config(repo.root / CONFIG)
+    locations = [config.local.storage.local, config.local.trees]
+    if config.local.cache is not None:
+        locations.append(config.local.cache.storage.local)
+
+    for location in locations:
+        for pack in _find_packs(location):
+            location = pack.build()
+            if location is not None:
+                count, freed = location.compact()
+                print(f'{pack.root}: Kept {count} value(s), freed {humanfriendly.format_size(freed)}')
+
+
+def _find_packs(config):
+    if isinstance(config, PackConfig):
+        yield config
+    elif isinstance(config, (list, tuple)):
+        for entry in config:
+            yield from _find_packs(entry)
+    elif isinstance(config, (LocationConfig, LevelConfig)):
+        for value in vars(config).values():
+            yield from _find_packs(value)
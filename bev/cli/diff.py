@@ -0,0 +1,30 @@
+from pathlib import Path
+from typing import Optional
+
+import typer
+from typing_extensions import Annotated
+
+from ..local import Local
+from ..shortcuts import get_current_repo
+from .app import app_command
+
+
+@app_command
+def diff(
+        path: Annotated[Path, typer.Argument(help='The path to a hashed file or folder')],
+        old: Annotated[str, typer.Argument(help='The commit to compare against')],
+        new: Annotated[Optional[str], typer.Argument(
+            help='The commit to compare. By default the local version is used', show_default=False
+        )] = None,
+):
+    """Show the files inside PATH that were added (A), removed (D) or modified (M) between two versions"""
+    repo = get_current_repo()
+    path = Path(path).resolve().relative_to(repo.root.resolve())
+
+    for change in repo.diff(path, old=old, new=Local if new is None else new):
+        if change.old is None:
+            print('A', change.path, change.new)
+        elif change.new is None:
+            print('D', change.path, change.old)
+        else:
+            print('M', change.path, change.old, '->', change.new)
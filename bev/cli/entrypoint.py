@@ -1,5 +1,8 @@
 # used to trigger commands indexing
-from . import add, blame, fetch, init, pull, storage  # noqa
+from . import (  # noqa
+    add, blame, compact, diff, fetch, gc, init, log, manifest, pack, prune, pull, push, status, storage, sync,
+    verify
+)
 from .app import _app as app
 
 
@@ -1,24 +1,35 @@
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 import typer
 from rich.progress import track
 from typing_extensions import Annotated
 
+from ..chunking import expand_keys
 from ..exceptions import HashError, HashNotFound
-from ..hash import from_hash, is_hash, is_tree, load_key, load_tree, strip_tree, to_hash
+from ..hash import from_hash, is_hash, is_tree, load_key, read_tree, to_hash
 from ..interface import Repository
+from ..local import Local
 from ..shortcuts import get_consistent_repo
 from .app import app_command
 
 
-def _fetch(repo: Repository, path: Path):
-    key = load_key(path)
-    if is_tree(key):
-        key = strip_tree(key)
-        keys = sorted(set(map(bytes.fromhex, repo.storage.read(load_tree, key, fetch=True).values())))
+def _fetch(repo: Repository, path: Path, since: Optional[str] = None):
+    if since is not None:
+        # only the keys that changed since the base version
+        relative = path.resolve().relative_to(repo.root.resolve())
+        keys = {
+            change.new for change in repo.diff(relative, old=since, new=Local, fetch=True) if change.new is not None
+        }
     else:
-        keys = [bytes.fromhex(key)]
+        key = load_key(path)
+        if is_tree(key):
+            keys = set(read_tree(key, repo.trees, fetch=True).values())
+        else:
+            keys = {key}
+
+    # chunked files are fetched chunk by chunk
+    keys = sorted(map(bytes.fromhex, expand_keys(keys, repo.storage, fetch=True)))
 
     desc = str(from_hash(path))
     if len(desc) > 30:
@@ -37,7 +48,12 @@ def fetch(
         repository: Annotated[Path, typer.Option(
             '--repository', '--repo', help='The bev repository. It is usually detected automatically',
             show_default=False,
-        )] = None
+        )] = None,
+        since: Annotated[Optional[str], typer.Option(
+            help='Fetch only the values that changed since this commit. '
+                 'Useful when the values from this commit are already fetched',
+            show_default=False,
+        )] = None,
 ):
     """Fetch the missing values from remote, if possible"""
     paths = paths or [Path('.')]
@@ -47,12 +63,12 @@ def fetch(
     repo = get_consistent_repo([repository, *paths])
     for path in paths:
         if is_hash(path):
-            _fetch(repo, path)
+            _fetch(repo, path, since)
         elif not path.exists():
-            _fetch(repo, to_hash(path))
+            _fetch(repo, to_hash(path), since)
         elif path.is_dir():
             for file in path.glob('**/*'):
                 if file.is_file() and is_hash(file):
-                    _fetch(repo, file)
+                    _fetch(repo, file, since)
         else:
             raise HashError(f'Cannot fetch "{path}" - it is not a hash nor a folder')
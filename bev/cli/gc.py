@@ -0,0 +1,54 @@
+import os
+from pathlib import Path
+from typing import List
+
+import humanfriendly
+import typer
+from typing_extensions import Annotated
+
+from ..local import Local
+from ..ops import collect_garbage
+from ..shortcuts import get_current_repo
+from .app import app_command
+
+
+@app_command
+def gc(
+        refs: Annotated[List[str], typer.Option(
+            '--ref', help='The commits, branches or tags whose values must be kept',
+            show_default='All the branches and tags, as well as HEAD',
+        )] = None,
+        dry_run: Annotated[bool, typer.Option(
+            help='Only report the number of values and bytes that would be removed'
+        )] = False,
+        yes: Annotated[bool, typer.Option(
+            '--yes', '-y', help='Confirm that the local storage is not shared with other repositories',
+        )] = False,
+        workers: Annotated[int, typer.Option(
+            '--workers', '-w', help='The number of threads used for removal'
+        )] = os.cpu_count() or 1,
+        repository: Annotated[Path, typer.Option(
+            '--repository', '--repo', help='The bev repository. It is usually detected automatically',
+            show_default=False,
+        )] = None,
+):
+    """
+    Remove the values from the local storage that are not referenced by any of the REFS or the local hashes.
+    The values of other repositories that share the same storage are removed as well, so this must be confirmed
+    """
+    repo = get_current_repo('.' if repository is None else repository)
+    if not dry_run and not yes:
+        typer.confirm(
+            'All the values not referenced by this repository will be removed, including the values of other '
+            'repositories that share the storage. Continue?', abort=True,
+        )
+
+    if not refs:
+        refs = [*repo.vc.list_refs(), 'HEAD']
+        # there may be no commits yet
+        if repo.vc.get_version('.') is None:
+            refs.remove('HEAD')
+
+    count, size = collect_garbage(repo, [Local, *refs], dry_run=dry_run, workers=workers)
+    action = 'Would remove' if dry_run else 'Removed'
+    print(f'{action} {count} value(s), {humanfriendly.format_size(size)}')
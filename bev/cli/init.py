@@ -46,6 +46,8 @@ def init_config(config, permissions, group):
             raise typer.Exit(255)
 
     local.storage.local.init(meta, permissions, group)
+    if local.trees is not None:
+        local.trees.init(meta, permissions, group)
     if local.cache is not None:
         local.cache.storage.local.init(meta, permissions, group)
         local.cache.index.local.init(meta, permissions, group)
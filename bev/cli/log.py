@@ -0,0 +1,18 @@
+from datetime import datetime
+from pathlib import Path
+
+import typer
+from typing_extensions import Annotated
+
+from ..shortcuts import get_current_repo
+from .app import app_command
+
+
+@app_command
+def log(path: Annotated[Path, typer.Argument(help='The path to a file, possibly inside a hashed folder')]):
+    """Show the commits that changed the key of the file at PATH, most recent first"""
+    repo = get_current_repo()
+    path = Path(path).resolve().relative_to(repo.root.resolve())
+
+    for commit, timestamp, key in repo.history(path):
+        print(commit, datetime.fromtimestamp(timestamp), key or '(removed)')
@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List
+
+import typer
+from tqdm.auto import tqdm
+from typing_extensions import Annotated
+
+from ..config import CONFIG, filter_remotes, load_config
+from ..local import Local
+from ..location import Manifested
+from ..ops import reachable_keys
+from ..shortcuts import get_consistent_repo
+from .app import app_command, cli_error
+
+
+@app_command
+def manifest(
+        paths: Annotated[List[Path], typer.Argument(
+            help='The hashes or folders, whose values might be present in the remotes',
+            show_default='The current directory'
+        )] = None,
+        versions: Annotated[List[str], typer.Option(
+            '--version', '-v', help='The commits to look for', show_default='The local version',
+        )] = None,
+        remotes: Annotated[List[str], typer.Option(
+            '--remote', help='The names of the remotes', show_default='All the remotes with a manifest',
+        )] = None,
+        workers: Annotated[int, typer.Option('--workers', '-w', help='The number of concurrent requests')] = 8,
+        repository: Annotated[Path, typer.Option(
+            '--repository', '--repo', help='The bev repository. It is usually detected automatically',
+            show_default=False,
+        )] = None,
+):
+    """
+    Create the key manifests for the remotes, which are wrapped in a `manifest` location.
+    The values referenced by the hashes are looked up one by one, in addition to the values listed by the remote,
+    if it supports listing. This also merges the keys published by each `bev push` since the last run,
+    so it should be called from time to time, while nobody pushes to the remotes
+    """
+    paths = paths or [Path('.')]
+    if repository is None:
+        repository = '.'
+
+    repo = get_consistent_repo([repository, *paths])
+    config = load_config(repo.root / CONFIG)
+    clusters = config.remotes
+    if remotes:
+        unknown = set(remotes) - {cluster.name for cluster in clusters}
+        if unknown:
+            raise cli_error(ValueError, f'Unknown remotes: {", ".join(sorted(unknown))}')
+        clusters = [cluster for cluster in clusters if cluster.name in remotes]
+
+    locations = {}
+    for cluster in clusters:
+        for location in filter_remotes([cluster.storage]):
+            if isinstance(location, Manifested):
+                locations[cluster.name] = location
+    if not locations:
+        raise cli_error(ValueError, 'No remotes with a manifest found')
+
+    root = repo.root.resolve()
+    relatives = [path.resolve().relative_to(root) for path in paths]
+    keys = set()
+    for version in versions or [Local]:
+        keys.update(reachable_keys(repo, relatives, version, fetch=False))
+    keys = sorted(bytes.fromhex(key) for key in keys)
+
+    for name, location in locations.items():
+        def exists(key):
+            # bypass the current manifest, it might be outdated
+            with location.location.read(key, False) as value:
+                return value is not None
+
+        with ThreadPoolExecutor(workers) as executor:
+            present = [key for key, found in zip(keys, tqdm(executor.map(exists, keys), total=len(keys))) if found]
+        count = location.rebuild(present, repo.storage.digest_size)
+        print(f'{name}: {count} value(s) in the manifest')
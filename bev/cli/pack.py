@@ -0,0 +1,27 @@
+from pathlib import Path
+from typing import Optional
+
+import humanfriendly
+import typer
+from typing_extensions import Annotated
+
+from ..ops import shard_tree
+from ..shortcuts import get_consistent_repo
+from .app import app_command
+
+
+@app_command
+def pack(
+        path: Annotated[Path, typer.Argument(help='The hashed folder to pack', show_default=False)],
+        shard_size: Annotated[str, typer.Option(help='The approximate size of each shard, e.g. 1G')] = '1G',
+        repository: Annotated[Optional[Path], typer.Option(
+            '--repository', '--repo', help='The bev repository. It is usually detected automatically',
+            show_default=False,
+        )] = None,
+):
+    """
+    Pack the values of a hashed folder at PATH into large shards, so that they can be read sequentially.
+    The index of the shards is saved to a `.shards` file alongside the hash, which must be committed as well
+    """
+    repo = get_consistent_repo(['.' if repository is None else repository, path])
+    print(shard_tree(repo, path, humanfriendly.parse_size(shard_size)))
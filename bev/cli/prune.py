@@ -0,0 +1,55 @@
+from pathlib import Path
+from typing import Optional
+
+import humanfriendly
+import typer
+from typing_extensions import Annotated
+
+from ..config import CONFIG, filter_remotes, load_config
+from ..location import Fanout, prune as prune_location
+from ..shortcuts import get_current_repo
+from .app import app_command
+
+
+@app_command
+def prune(
+        max_size: Annotated[str, typer.Option(
+            help='The maximum total size of the local storage, e.g. 500G', show_default=False,
+        )],
+        cache_max_size: Annotated[Optional[str], typer.Option(
+            help='The maximum total size of the local cache storage, e.g. 100G', show_default=False,
+        )] = None,
+        dry_run: Annotated[bool, typer.Option(
+            help='Only report the number of values and bytes that would be removed'
+        )] = False,
+        repository: Annotated[Path, typer.Option(
+            '--repository', '--repo', help='The bev repository. It is usually detected automatically',
+            show_default=False,
+        )] = None,
+):
+    """
+    Remove the least recently used values from the local storage, until it fits into MAX_SIZE.
+    Only the values that can be fetched from remote are removed.
+    """
+    repo = get_current_repo('.' if repository is None else repository)
+    config = load_config(repo.root / CONFIG)
+
+    storages = [('storage', config.local.storage, [remote.storage for remote in config.remotes], max_size)]
+    if cache_max_size is not None and config.local.cache is not None:
+        storages.append((
+            'cache', config.local.cache.storage,
+            [remote.cache.storage for remote in config.remotes if remote.cache is not None], cache_max_size,
+        ))
+
+    action = 'Would remove' if dry_run else 'Removed'
+    for name, local, remotes, size in storages:
+        local = None if local.local is None else local.local.build()
+        if local is None:
+            print(f'{name}: No local location, nothing to remove')
+            continue
+
+        remotes = filter_remotes(remotes)
+        count, removed = prune_location(
+            local, Fanout(*remotes) if remotes else None, humanfriendly.parse_size(size), dry_run
+        )
+        print(f'{name}: {action} {count} value(s), {humanfriendly.format_size(removed)}')
@@ -9,8 +9,9 @@ from rich.progress import track
 from tarn.utils import value_to_buffer
 from typing_extensions import Annotated
 
+from ..chunking import copy_chunked
 from ..exceptions import HashError
-from ..hash import from_hash, is_hash, to_hash
+from ..hash import from_hash, is_chunked, is_hash, to_hash
 from ..ops import load_hash
 from .app import app_command, cli_error
 from .utils import normalize_sources, normalize_sources_and_destination
@@ -95,7 +96,7 @@ def _pull(source, destination, mode, keep, repo, fetch):
             p = to_hash(p)
         return p
 
-    h = load_hash(source, repo.storage, fetch)
+    h = load_hash(source, repo, fetch)
     if isinstance(h, dict):
         if destination.is_file():
             raise cli_error(
@@ -131,12 +132,20 @@ def save_hash(value, file, repo, fetch):
         f.write(value)
 
 
+def copy_file(value, file, repo, fetch):
+    if is_chunked(value):
+        with open(file, 'wb') as dst:
+            copy_chunked(value, repo.storage, dst, fetch)
+    else:
+        repo.storage.read(copy_value, value, file, fetch=fetch)
+
+
 def copy_value(value, file):
     with value_to_buffer(value) as f, open(file, 'wb') as file:
         shutil.copyfileobj(f, file)
 
 
 PULL_MODES = {
-    PullMode.copy: lambda h, dst, repo, fetch: repo.storage.read(copy_value, h, dst, fetch=fetch),
+    PullMode.copy: copy_file,
     PullMode.hash: save_hash,
 }
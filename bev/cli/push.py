@@ -0,0 +1,60 @@
+from pathlib import Path
+from typing import List, Optional
+
+import typer
+from tarn import ReadOnly
+from typing_extensions import Annotated
+
+from ..config import CONFIG, filter_remotes, load_config
+from ..exceptions import HashNotFound
+from ..local import Local
+from ..ops import push_keys, reachable_keys
+from ..shortcuts import get_consistent_repo
+from .app import app_command, cli_error
+
+
+@app_command
+def push(
+        paths: Annotated[List[Path], typer.Argument(
+            help='The hashes or folders to push', show_default='The current directory'
+        )] = None,
+        version: Annotated[Optional[str], typer.Option(
+            '--version', '-v', help='The commit to push. By default the local version is used', show_default=False,
+        )] = None,
+        remotes: Annotated[List[str], typer.Option(
+            '--remote', help='The names of the remotes to push to', show_default='All the writable remotes',
+        )] = None,
+        workers: Annotated[int, typer.Option('--workers', '-w', help='The number of concurrent uploads')] = 8,
+        repository: Annotated[Path, typer.Option(
+            '--repository', '--repo', help='The bev repository. It is usually detected automatically',
+            show_default=False,
+        )] = None,
+):
+    """Upload the values referenced by the hashes to the remotes, where they are missing"""
+    paths = paths or [Path('.')]
+    if repository is None:
+        repository = '.'
+
+    repo = get_consistent_repo([repository, *paths])
+    config = load_config(repo.root / CONFIG)
+    clusters = config.remotes
+    if remotes:
+        unknown = set(remotes) - {cluster.name for cluster in clusters}
+        if unknown:
+            raise cli_error(ValueError, f'Unknown remotes: {", ".join(sorted(unknown))}')
+        clusters = [cluster for cluster in clusters if cluster.name in remotes]
+
+    # e.g. nginx and ssh remotes can't be written to
+    locations = [location for location in filter_remotes([cluster.storage for cluster in clusters])
+                 if not isinstance(location, ReadOnly)]
+    if not locations:
+        raise cli_error(ValueError, 'No writable remotes found')
+
+    root = repo.root.resolve()
+    relatives = [path.resolve().relative_to(root) for path in paths]
+    keys = reachable_keys(repo, relatives, Local if version is None else version, fetch=False)
+    uploaded, present, failed = push_keys(repo, keys, locations, workers, progress=True)
+
+    print(f'Uploaded {len(uploaded)} value(s), {len(present)} already present, {len(failed)} failed')
+    if failed:
+        raise cli_error(HashNotFound, 'Some values could not be uploaded, e.g. they are missing locally')
@@ -0,0 +1,87 @@
+from pathlib import Path
+from typing import List, Optional
+
+import humanfriendly
+import typer
+from typing_extensions import Annotated
+
+from ..exceptions import HashNotFound
+from ..hash import from_hash, is_hash, to_hash
+from ..interface import Repository
+from ..local import Local
+from ..ops import folder_status
+from ..shortcuts import get_consistent_repo
+from .app import app_command, cli_error
+
+
+@app_command
+def status(
+        paths: Annotated[List[Path], typer.Argument(
+            help='The hashes or folders to check', show_default='The current directory'
+        )] = None,
+        missing: Annotated[bool, typer.Option(
+            '--missing', help='Show the values that are missing from the local storage instead',
+        )] = False,
+        version: Annotated[Optional[str], typer.Option(
+            '--version', '-v', help='The commit to check with --missing. By default the local version is used',
+            show_default=False,
+        )] = None,
+        workers: Annotated[int, typer.Option('--workers', '-w', help='The number of threads used for hashing')] = 8,
+        repository: Annotated[Path, typer.Option(
+            '--repository', '--repo', help='The bev repository. It is usually detected automatically',
+            show_default=False,
+        )] = None,
+):
+    """
+    Show the files that were added, removed or modified in the folders, compared to their hashes.
+    The folders without hashes are searched for such folders recursively
+    """
+    paths = paths or [Path('.')]
+    if repository is None:
+        repository = '.'
+
+    repo = get_consistent_repo([repository, *paths])
+    if missing:
+        return _missing(repo, paths, version)
+    if version is not None:
+        raise cli_error(ValueError, 'Only the local version of the folders can be compared with their hashes')
+
+    folders = []
+    for path in paths:
+        if is_hash(path):
+            path = from_hash(path)
+        # the root can't be hashed
+        if path.name and to_hash(path).exists():
+            folders.append(path)
+        elif path.is_dir():
+            folders.extend(from_hash(file) for file in sorted(path.rglob('*.hash')) if from_hash(file).is_dir())
+        else:
+            raise cli_error(HashNotFound, f'Neither "{path}" nor its hash were found')
+
+    clean = True
+    for folder in folders:
+        result = folder_status(repo, folder, workers)
+        for kind, relatives in zip(['added', 'removed', 'modified'], result):
+            for relative in relatives:
+                clean = False
+                print(f'{kind}: {folder / relative}')
+
+    if clean:
+        print('Nothing changed')
+
+
+def _missing(repo: Repository, paths: List[Path], version: Optional[str]):
+    root = repo.root.resolve()
+    relatives = [path.resolve().relative_to(root) for path in paths]
+    result = repo.missing(relatives, Local if version is None else version)
+    for key in sorted(result.keys):
+        print(key)
+
+    summary = f'{len(result.keys)} value(s) missing'
+    if result.size is not None:
+        if result.keys:
+            summary += f', {humanfriendly.format_size(result.size)}'
+    elif result.sizes:
+        known = humanfriendly.format_size(sum(result.sizes.values()))
+        summary += f', {len(result.sizes)} of them with known size: {known}'
+    print(summary)
@@ -0,0 +1,81 @@
+from pathlib import Path
+from typing import List
+
+import typer
+from typing_extensions import Annotated
+
+from ..config import CONFIG, load_config
+from ..exceptions import HashNotFound
+from ..local import Local
+from ..location import present_keys
+from ..ops import copy_keys, reachable_keys
+from ..shortcuts import get_consistent_repo
+from .app import app_command, cli_error
+
+
+@app_command
+def sync(
+        source: Annotated[str, typer.Argument(help='The name of the storage to copy from', show_default=False)],
+        destination: Annotated[str, typer.Argument(help='The name of the storage to copy to', show_default=False)],
+        paths: Annotated[List[Path], typer.Argument(
+            help='The hashes or folders to copy', show_default='The current directory'
+        )] = None,
+        versions: Annotated[List[str], typer.Option(
+            '--version', '-v', help='The commits to copy', show_default='The local version',
+        )] = None,
+        workers: Annotated[int, typer.Option('--workers', '-w', help='The number of concurrent transfers')] = 8,
+        repository: Annotated[Path, typer.Option(
+            '--repository', '--repo', help='The bev repository. It is usually detected automatically',
+            show_default=False,
+        )] = None,
+):
+    """Copy the values referenced by the hashes from the SOURCE storage to the DESTINATION, where they are missing"""
+    paths = paths or [Path('.')]
+    if repository is None:
+        repository = '.'
+
+    repo = get_consistent_repo([repository, *paths])
+    config = load_config(repo.root / CONFIG)
+    (source, source_trees), (destination, destination_trees) = (
+        _build_cluster(config, source), _build_cluster(config, destination)
+    )
+
+    root = repo.root.resolve()
+    relatives = [path.resolve().relative_to(root) for path in paths]
+    keys = set()
+    for version in versions or [Local]:
+        keys.update(reachable_keys(repo, relatives, version))
+
+    # the trees might be kept in a separate location, so they are copied from there
+    trees = set()
+    if source_trees is not None:
+        trees = {key.hex() for key in present_keys(source_trees, [bytes.fromhex(key) for key in keys])}
+    uploaded, present, failed = copy_keys(source, keys - trees, [destination], workers, progress=True)
+    if trees:
+        # the destination might have no location for the trees, then they are stored alongside the values
+        result = copy_keys(source_trees, trees, [destination_trees or destination], workers, progress=True)
+        uploaded, present, failed = uploaded | result.uploaded, present | result.present, failed | result.failed
+
+    print(f'Copied {len(uploaded)} value(s), {len(present)} already present, {len(failed)} failed')
+    if failed:
+        raise cli_error(HashNotFound, 'Some values could not be copied, e.g. they are missing in the source')
+
+
+def _build_cluster(config, name):
+    """ The location of the storage's values and the location of its trees, if it's separate and accessible """
+    clusters = {cluster.name: cluster for cluster in [config.local, *config.remotes]}
+    if name not in clusters:
+        raise cli_error(ValueError, f'Unknown storage "{name}". Available: {", ".join(sorted(clusters))}')
+
+    cluster = clusters[name]
+    trees = None if cluster.trees is None else cluster.trees.build()
+    # the other machines' storage is accessed through its remote configuration, if any
+    storage = cluster.storage
+    configs = [storage.local] if name == config.local.name else [storage.remote, storage.local]
+    for location in configs:
+        if location is not None:
+            location = location.build()
+            if location is not None:
+                return location, trees
+
+    raise cli_error(ValueError, f'The storage "{name}" is not accessible from this machine')
@@ -0,0 +1,60 @@
+import os
+from pathlib import Path
+from typing import List, Optional
+
+import typer
+from typing_extensions import Annotated
+
+from ..exceptions import HashNotFound
+from ..local import Local
+from ..ops import reachable_keys, verify_keys
+from ..shortcuts import get_consistent_repo
+from .app import app_command, cli_error
+
+
+@app_command
+def verify(
+        paths: Annotated[List[Path], typer.Argument(
+            help='The hashes or folders to verify', show_default='The current directory'
+        )] = None,
+        version: Annotated[Optional[str], typer.Option(
+            '--version', '-v', help='The commit to verify. By default the local version is used', show_default=False,
+        )] = None,
+        workers: Annotated[int, typer.Option(
+            '--workers', '-w', help='The number of processes used to compute the digests'
+        )] = os.cpu_count() or 1,
+        fetch: Annotated[bool, typer.Option(
+            help='Whether to fetch the missing and corrupted values from remote, if possible'
+        )] = False,
+        repository: Annotated[Path, typer.Option(
+            '--repository', '--repo', help='The bev repository. It is usually detected automatically',
+            show_default=False,
+        )] = None,
+):
+    """Check that the values referenced by the hashes are present in the local storage and are not corrupted"""
+    paths = paths or [Path('.')]
+    if repository is None:
+        repository = '.'
+
+    repo = get_consistent_repo([repository, *paths])
+    root = repo.root.resolve()
+    relatives = [path.resolve().relative_to(root) for path in paths]
+    keys = reachable_keys(repo, relatives, Local if version is None else version, fetch=fetch)
+    missing, corrupted = verify_keys(repo, keys, workers, progress=True)
+
+    if fetch and (missing or corrupted):
+        for key in corrupted:
+            repo.local.delete(bytes.fromhex(key))
+
+        failed = {key.hex() for key, success in repo.storage.fetch(sorted(map(bytes.fromhex, missing | corrupted)))
+                  if not success}
+        missing, corrupted = missing & failed, corrupted & failed
+
+    for key in sorted(missing):
+        print('missing', key)
+    for key in sorted(corrupted):
+        print('corrupted', key)
+
+    print(f'Verified {len(keys)} key(s): {len(missing)} missing, {len(corrupted)} corrupted')
+    if missing or corrupted:
+        raise cli_error(HashNotFound, 'Some values are missing or corrupted')
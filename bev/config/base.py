@@ -1,5 +1,7 @@
-from typing import Any, Dict, Optional, Sequence
+from typing import Any, Dict, Optional, Sequence, Union
 
+import humanfriendly
+from pytimeparse.timeparse import timeparse
 from tarn.config import HashConfig
 
 from .compat import field_validator, model_validator
@@ -11,13 +13,22 @@ from .location import LocationConfig, NoExtra, from_special
 class StorageConfig(NoExtra):
     local: Optional[LocationConfig] = None
     remote: Optional[LocationConfig] = None
+    # the least recently used local values are removed, if their total size exceeds `max_size` bytes
+    max_size: Optional[int] = None
 
     @model_validator(mode='before')
     def locations(cls, values):
         assert values, 'at least one entry must be provided'
-        if not set(values) <= {'local', 'remote'}:
+        if not isinstance(values, dict) or not set(values) <= {'local', 'remote', 'max_size'} or \
+                not set(values) & {'local', 'remote'}:
             values = {'local': values}
-        return {k: from_special(v) for k, v in values.items()}
+        return {k: v if k == 'max_size' else from_special(v) for k, v in values.items()}
+
+    @field_validator('max_size', mode='before')
+    def parse_size(cls, v):
+        if isinstance(v, str):
+            v = humanfriendly.parse_size(v)
+        return v
 
 
 class CacheConfig(NoExtra):
@@ -38,6 +49,8 @@ class StorageCluster(NoExtra):
     hostname: Sequence[HostName] = ()
     storage: StorageConfig
     cache: Optional[CacheConfig] = None
+    # a fast location, e.g. a local SSD, where the trees are stored separately from the data values
+    trees: Optional[LocationConfig] = None
 
     @field_validator('hostname', mode='before')
     def from_single(cls, v):
@@ -77,6 +90,27 @@ class ConfigMeta(NoExtra):
     hash: Optional[HashConfig] = None
     include: Sequence[Include] = ()
     labels: Optional[Sequence[str]] = None
+    # how often the files verified by `resolve(check=True)` must be re-verified, in seconds.
+    # None means that the files are re-verified only when they change on disk
+    check_interval: Optional[Union[int, float]] = 24 * 60 * 60
+    # the maximal total size of the files, that `resolve` creates for the values not stored as files,
+    # e.g. the values from `pack` locations. None means that the files are never removed
+    files_cache_size: Optional[int] = 10 * 2 ** 30
+
+    @field_validator('check_interval', mode='before')
+    def parse_interval(cls, v):
+        if isinstance(v, str):
+            interval = timeparse(v)
+            if interval is None:
+                raise ValueError(f'The time format could not be parsed: {v}')
+            v = interval
+        return v
+
+    @field_validator('files_cache_size', mode='before')
+    def parse_size(cls, v):
+        if isinstance(v, str):
+            v = humanfriendly.parse_size(v)
+        return v
 
     @field_validator('hash', mode='before')
     def normalize_hash(cls, v):
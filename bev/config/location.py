@@ -8,10 +8,12 @@ import yaml
 from jboc import collect
 from paramiko.config import SSHConfig
 from pytimeparse.timeparse import timeparse
-from tarn import S3, SCP, SFTP, DiskDict, Fanout, Level, Levels, Location, Nginx, RedisLocation, SmallLocation
+from tarn import S3, SCP, SFTP, DiskDict, Level, Location, Nginx, RedisLocation, SmallLocation
 from tarn.config import CONFIG_NAME as STORAGE_CONFIG_NAME, StorageConfig as TarnStorageConfig
 from tarn.utils import mkdir
 
+from ..location import Compressed, Fanout, Levels, Manifested, Memory, Pack
+from ..location.compressed import CODECS
 from .compat import NoExtra, core_schema, field_validator, model_dump, model_validate
 from .registry import RegistryError, add_type, find, register
 
@@ -262,6 +264,107 @@ class SmallConfig(LocationConfig):
         return SmallLocation(self.location.build(), self.max_size)
 
 
+@register('memory')
+class MemoryConfig(LocationConfig):
+    max_size: int
+    max_value_size: Optional[int] = None
+
+    @field_validator('max_size', 'max_value_size', mode='before')
+    def _from_str(cls, v):
+        if isinstance(v, str):
+            return humanfriendly.parse_size(v)
+        return v
+
+    @classmethod
+    def from_special(cls, v):
+        if isinstance(v, (str, int)):
+            return cls(max_size=v)
+
+    def build(self) -> Location:
+        return Memory(self.max_size, self.max_value_size)
+
+
+@register('pack')
+class PackConfig(LocationConfig):
+    root: Path
+    max_pack_size: int = 2 ** 30
+
+    @field_validator('max_pack_size', mode='before')
+    def _from_str(cls, v):
+        if isinstance(v, str):
+            return humanfriendly.parse_size(v)
+        return v
+
+    @classmethod
+    def from_special(cls, v):
+        if isinstance(v, str):
+            return cls(root=v)
+
+    def build(self) -> Optional[Location]:
+        if self.root.exists():
+            return Pack(self.root, self.max_pack_size)
+
+    def init(self, meta, permissions, group):
+        if not self.root.exists():
+            mkdir(self.root, permissions, group, parents=True)
+
+
+@register('compressed')
+class CompressedConfig(LocationConfig):
+    location: LocationConfig
+    codec: str = 'zlib'
+    level: Optional[int] = None
+
+    @field_validator('codec')
+    def _check_codec(cls, v):
+        if v not in CODECS:
+            raise ValueError(f'Unknown codec {v!r}. Available: {", ".join(CODECS)}')
+        return v
+
+    def build(self) -> Optional[Location]:
+        location = self.location.build()
+        if location is not None:
+            return Compressed(location, self.codec, self.level)
+
+    def init(self, meta, permissions, group):
+        self.location.init(meta, permissions, group)
+
+
+@register('manifest')
+class ManifestConfig(LocationConfig):
+    location: LocationConfig
+    capacity: int = 10 ** 6
+    error_rate: float = 0.01
+    max_age: Union[float, str] = 600
+    fallback: bool = False
+
+    @field_validator('location')
+    def _check_writable(cls, v):
+        if isinstance(v, (SSHRemoteConfig, NginxConfig)):
+            raise ValueError(
+                'The manifest is stored inside the location, so it must be writable, e.g. s3 or a disk storage. '
+                'The scp, sftp and nginx locations are read-only'
+            )
+        return v
+
+    @field_validator('max_age')
+    def _from_str(cls, v):
+        if isinstance(v, str):
+            parsed = timeparse(v)
+            if parsed is None:
+                raise ValueError(f'The time format could not be parsed: {v}')
+            v = parsed
+        return v
+
+    def build(self) -> Optional[Location]:
+        location = self.location.build()
+        if location is not None:
+            return Manifested(location, self.capacity, self.error_rate, self.max_age, self.fallback)
+
+    def init(self, meta, permissions, group):
+        self.location.init(meta, permissions, group)
+
+
 @register('scp')
 class SCPConfig(SSHRemoteConfig):
     _location = SCP
@@ -1,13 +1,14 @@
 import importlib
 from pathlib import Path
-from typing import Callable, NamedTuple, Sequence, Tuple
+from typing import Callable, NamedTuple, Optional, Sequence, Tuple
 
 from jboc import collect
-from tarn import HashKeyStorage, Location
+from tarn import HashKeyStorage, Level, Location
 from yaml import safe_load
 
 from ..exceptions import ConfigError
-from .base import ConfigMeta, RepositoryConfig, StorageCluster
+from ..location import Fanout, Levels, Manifested, Pruned
+from .base import ConfigMeta, RepositoryConfig, StorageCluster, StorageConfig
 from .compat import model_copy, model_validate
 from .utils import CONFIG, choose_local, default_choose
 
@@ -23,21 +24,66 @@ def load_config(config: Path) -> RepositoryConfig:
         return parse(Path(config), safe_load(file))
 
 
+class Storages(NamedTuple):
+    storage: HashKeyStorage
+    cache: Optional[CacheStorageIndex]
+    trees: HashKeyStorage
+    # the location of the local copies of the data values and the trees
+    local: Location
+    remote: Sequence[Location]
+
+
 def build_storage(root: Path) -> Tuple[HashKeyStorage, CacheStorageIndex]:
+    storage, index, *_ = build_storages(root)
+    return storage, index
+
+
+def build_trees(root: Path) -> HashKeyStorage:
+    """
+    Build the storage for the trees.
+    If there is no separate location for the trees, this is the same storage as the one for the data values.
+    """
+    return build_storages(root).trees
+
+
+def build_storages(root: Path) -> Storages:
+    """
+    Build the storage for the data values, the cache index, the storage for the trees,
+    the location of all their local values and the remote locations of the data values
+    """
     config = load_config(root / CONFIG)
     meta = config.meta
 
+    remotes = filter_remotes([remote.storage for remote in config.remotes])
+    local = _build_local(config.local.storage, remotes)
+    remotes = data_remotes = _with_fallbacks(remotes)
+    trees_local = None if config.local.trees is None else config.local.trees.build()
     storage = HashKeyStorage(
-        config.local.storage.local.build(),
-        remote=filter_remotes([remote.storage for remote in config.remotes]),
+        # the trees can be read from the main storage as well, e.g. by `push` or `gc`, but they are looked up last,
+        # so that the data values don't pay for an extra request. The trees are never copied to the data location
+        local if trees_local is None else Levels(
+            Level(local, replicate=False), Level(trees_local, write=False, replicate=False)
+        ),
+        remote=remotes,
         labels=meta.labels,
         algorithm=None if meta.hash is None else meta.hash.build()
     )
+    trees = storage
+    if trees_local is not None:
+        trees = HashKeyStorage(
+            # the trees written before the location was added are moved there on first read
+            Levels(trees_local, Level(local, write=False, replicate=False)),
+            remote=remotes,
+            labels=meta.labels,
+            algorithm=storage.algorithm,
+        )
+
     index = None
     if config.local.cache is not None:
+        remotes = filter_remotes([remote.cache.storage for remote in config.remotes if remote.cache is not None])
         cache_storage = HashKeyStorage(
-            config.local.cache.storage.local.build(),
-            remote=filter_remotes([remote.cache.storage for remote in config.remotes if remote.cache is not None]),
+            _build_local(config.local.cache.storage, remotes),
+            remote=_with_fallbacks(remotes),
             labels=meta.labels,
             algorithm=None if meta.hash is None else meta.hash.build()
         )
@@ -46,7 +92,23 @@ def build_storage(root: Path) -> Tuple[HashKeyStorage, CacheStorageIndex]:
             filter_remotes([remote.cache.index for remote in config.remotes if remote.cache is not None]),
             cache_storage,
         )
-    return storage, index
+    return Storages(
+        storage, index, trees, local if trees_local is None else Fanout(local, trees_local), data_remotes
+    )
+
+
+def _build_local(config: StorageConfig, remote: Sequence[Location]):
+    local = None if config.local is None else config.local.build()
+    if local is not None and config.max_size is not None:
+        local = Pruned(local, Fanout(*remote) if remote else None, config.max_size)
+    return local
+
+
+def _with_fallbacks(remotes: Sequence[Location]) -> Sequence[Location]:
+    # if asked, a key missing from a manifest is requested from the location itself, after all the other remotes
+    return (*remotes, *(
+        remote.location for remote in remotes if isinstance(remote, Manifested) and remote.fallback
+    ))
 
 
 @collect
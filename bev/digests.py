@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional
+
+from tarn.digest import digest_value
+
+from .hash import Key
+from .utils import PathOrStr, write_atomic
+
+
+class DigestCache:
+    """
+    Remembers the digests of files, so that they are recomputed only when the files change on disk.
+
+    A file is considered unchanged while its inode, size and modification time stay the same,
+    and, if `interval` (in seconds) is given, the digest was computed less than `interval` seconds ago.
+    The entries are stored as separate files inside `root`, so the cache can be safely shared between processes.
+    If `root` is None, nothing is cached. By default, bev keeps the entries in `cache_root() / "digests"`.
+    """
+
+    def __init__(self, root: Optional[Path], algorithm, interval: Optional[float] = None):
+        self.root, self.algorithm, self.interval = root, algorithm, interval
+
+    def get(self, path: PathOrStr) -> Key:
+        """ Get the digest of the file at `path` """
+        path = Path(path).resolve()
+        stat = path.stat()
+        mark = self._mark(path)
+        entry = {'path': str(path), 'inode': stat.st_ino, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+        if mark is not None:
+            try:
+                with open(mark, 'r') as file:
+                    cached = json.load(file)
+                if all(cached.get(k) == v for k, v in entry.items()) and self._is_fresh(cached['time']):
+                    return cached['digest']
+            except (OSError, ValueError, KeyError):
+                pass
+
+        entry['digest'] = digest = digest_value(path, self.algorithm).hex()
+        entry['time'] = time.time()
+        if mark is not None:
+            try:
+                self._save(mark, entry)
+            except OSError:
+                # e.g. the storage is read-only for us
+                pass
+
+        return digest
+
+    def _is_fresh(self, timestamp):
+        return self.interval is None or time.time() - timestamp < self.interval
+
+    def _mark(self, path: Path) -> Optional[Path]:
+        if self.root is None:
+            return None
+        name = hashlib.sha1(os.fsencode(path)).hexdigest()
+        return self.root / name[:2] / name[2:]
+
+    def _save(self, mark: Path, entry: dict):
+        write_atomic(mark, lambda file: file.write(json.dumps(entry).encode()))
+
+
+class FileCache:
+    """
+    Keeps the copies of the values, that must be available as files, but are not stored as files,
+    e.g. the values from `pack` or `memory` locations. The files are stored inside `root` by their keys.
+
+    Once the total size exceeds `max_size` bytes, the least recently used files are removed,
+    except for the one that was just requested. If `max_size` is None, the files are never removed.
+    """
+
+    def __init__(self, root: Path, max_size: Optional[int] = None):
+        self.root, self.max_size = root, max_size
+
+    def get(self, key: Key, write: Callable[[BinaryIO], None]) -> Path:
+        """ Get the file with the value of `key`, which is created by `write`, if it's missing """
+        path = self.root / key[:2] / key[2:]
+        if path.exists():
+            try:
+                # the modification time marks the last usage
+                os.utime(path)
+                return path
+            except FileNotFoundError:
+                # removed by another process in the meantime
+                pass
+
+        write_atomic(path, write)
+        self._trim(path)
+        return path
+
+    def _trim(self, keep: Path):
+        if self.max_size is None:
+            return
+
+        entries = []
+        # the temporary files of the concurrent writers are not keys
+        for path in self.root.glob('*/[!t]*'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def cache_root() -> Path:
+    """ The folder with bev's own caches of the current user. Follows `XDG_CACHE_HOME`, if it's set """
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'bev'
@@ -1,9 +1,9 @@
 import json
 import os
+import re
 import tempfile
-from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, NamedTuple, Union
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple, Union
 
 from tarn import HashKeyStorage
 from tarn.utils import value_to_buffer
@@ -15,6 +15,8 @@ from .utils import PathOrStr
 Key = str
 Tree = Dict[PathOrStr, Union[Key, Dict]]
 HashType = Union[Key, Tree]
+# matches the paths, joined by \0, that `pathlib` would change: empty or "." parts, leading and trailing slashes
+_DENORMALIZED = re.compile(r'[/\0]\.?[/\0]')
 
 
 def is_hash(path: PathOrStr):
@@ -35,10 +37,31 @@ def from_hash(path: PathOrStr):
     return path.with_name(path.stem)
 
 
+def is_shards(path: PathOrStr):
+    return Path(path).name.endswith('.shards')
+
+
+def to_shards(path: PathOrStr):
+    """ The path of the file that references the shards of the hashed folder at `path` """
+    path = Path(path)
+    if is_hash(path):
+        path = from_hash(path)
+    return path.with_name(f'{path.name}.shards')
+
+
 def is_tree(key: Key):
     return key.startswith('T:')
 
 
+def is_chunked(key: Key):
+    return key.startswith('C:')
+
+
+def is_value(value, digest_size: int):
+    """ Whether `value` is a valid tree entry: a file's digest or the key of a chunked file """
+    return len(value) == digest_size * 2 or (len(value) == digest_size * 2 + 2 and is_chunked(value))
+
+
 def load_key(path: PathOrStr):
     with open(path, 'r') as file:
         return file.read().strip()
@@ -55,26 +78,141 @@ def strip_tree(key):
     return key
 
 
-def tree_to_hash(tree: Tree, storage: HashKeyStorage):
+def strip_chunked(key):
+    if key.startswith('C:'):
+        key = key[2:]
+    return key
+
+
+def read_tree(key: Key, storage: HashKeyStorage, fetch: Optional[bool] = None) -> Dict[str, Key]:
+    """
+    Load the flat view of the tree given its `key`.
+    The entries of nested trees, i.e. the ones that point to other trees, are recursively expanded.
+    """
+    tree = storage.read(load_tree, strip_tree(key), fetch=fetch)
+    # the values of flat trees are just the files' digests
+    if set(map(len, tree.values())) <= {storage.digest_size * 2}:
+        return tree
+
+    result = {}
+    for path, value in tree.items():
+        if is_tree(value):
+            for relative, inside in read_tree(value, storage, fetch).items():
+                result[os.path.join(path, relative)] = inside
+        else:
+            result[path] = value
+
+    return result
+
+
+def tree_to_hash(tree: Tree, storage: HashKeyStorage, nested: bool = False):
     tree = normalize_tree(tree, storage.digest_size)
     # making sure that each time the same string will be saved
-    tree = OrderedDict((k, tree[k]) for k in sorted(map(os.fspath, tree)))
+    return entries_to_hash(sorted(tree.items()), storage, nested)
+
+
+def entries_to_hash(entries: Iterable[Tuple[str, Key]], storage: HashKeyStorage, nested: bool = False):
+    """
+    Save a tree given as a stream of `entries`, already normalized and sorted by path, without keeping it in memory.
+    The result is exactly the same as the one produced by `tree_to_hash`.
+
+    If `nested` is True, each folder is saved as a separate tree, and its parent only references it by key.
+    This way, a small change only creates new trees along the path to the changed file.
+    """
+    entries = _validate_entries(entries, storage.digest_size)
+    if nested:
+        return _entries_to_nested(entries, storage)
+    return _write_tree(_check_names(entries), storage)
+
+
+def _validate_entries(entries, digest_size):
+    for path, key in entries:
+        if not is_value(key, digest_size):
+            raise ValueError(key)
+        yield path, key
+
+
+def _check_names(entries):
+    # same as in `_entries_to_nested`, but only the names of the open folders' children are kept
+    stack = [(None, set())]
+    for path, key in entries:
+        *parents, name = path.split(os.sep)
+        common = 0
+        while common < min(len(parents), len(stack) - 1) and stack[common + 1][0] == parents[common]:
+            common += 1
+        del stack[common + 1:]
+        for parent in parents[common:]:
+            _add_name(stack[-1][1], parent)
+            stack.append((parent, set()))
+
+        _add_name(stack[-1][1], name)
+        yield path, key
+
+
+def _add_name(names, name):
+    if name in names:
+        raise HashError(f'The name "{name}" is used both by a file and a folder')
+    names.add(name)
+
+
+def _entries_to_nested(entries, storage):
+    def add(name, value):
+        children = stack[-1][1]
+        if name in children:
+            raise HashError(f'The name "{name}" is used both by a file and a folder')
+        children[name] = value
+
+    def close():
+        name, children = stack.pop()
+        add(name, _write_tree(sorted(children.items()), storage))
+
+    # the open folders: their names and children
+    stack = [(None, {})]
+    for path, key in entries:
+        *parents, name = path.split(os.sep)
+        common = 0
+        while common < min(len(parents), len(stack) - 1) and stack[common + 1][0] == parents[common]:
+            common += 1
+        # the entries are sorted, so the folders that are not among the parents will never be visited again
+        while len(stack) - 1 > common:
+            close()
+        for parent in parents[common:]:
+            stack.append((parent, {}))
+
+        add(name, key)
+
+    while len(stack) > 1:
+        close()
+    return _write_tree(sorted(stack[0][1].items()), storage)
+
+
+def _write_tree(entries, storage):
     with tempfile.TemporaryDirectory() as tmp:
         tree_path = Path(tmp, 'hash')
         # TODO: storage should allow writing directly from memory
         with open(tree_path, 'w') as file:
-            json.dump(tree, file)
+            # same format as `json.dump`
+            file.write('{')
+            separator = ''
+            for path, key in entries:
+                file.write(f'{separator}{json.dumps(path)}: {json.dumps(key)}')
+                separator = ', '
+            file.write('}')
 
         return 'T:' + storage.write(tree_path).hex()
 
 
 def normalize_tree(tree: Tree, digest_size: int):
+    # the most common case: a flat tree with normalized paths, e.g. the one loaded from storage
+    if _is_normalized(tree, digest_size):
+        return dict(tree)
+
     def flatten(x):
         for key, value in x.items():
             key = Path(os.fspath(key))
 
             if isinstance(value, str):
-                if len(value) != digest_size * 2:
+                if not is_value(value, digest_size):
                     # TODO
                     raise ValueError(value)
 
@@ -103,6 +241,24 @@ def normalize_tree(tree: Tree, digest_size: int):
     return result
 
 
+def _is_normalized(tree: Tree, digest_size: int):
+    if os.sep != '/':
+        return False
+
+    values = tree.values()
+    if set(map(type, values)) != {str}:
+        return False
+    if set(map(len, values)) != {digest_size * 2} and not all(is_value(value, digest_size) for value in values):
+        return False
+
+    # a single scan over all the paths is much faster than checking them one by one
+    try:
+        paths = '\0'.join(tree)
+    except TypeError:
+        return False
+    return _DENORMALIZED.search(f'\0{paths}\0') is None
+
+
 class FileHash(NamedTuple):
     key: Key
     path: Path
@@ -1,17 +1,28 @@
 import inspect
 import os
+import shutil
 from functools import lru_cache
+from io import BytesIO
 from pathlib import Path
-from typing import Optional, Sequence, Union
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional, Sequence, Set, Tuple, Union
 
-from tarn.digest import digest_value
+from tarn import DiskDict, HashKeyStorage, Location, ReadError
+from tarn.utils import value_to_buffer
 from wcmatch.glob import GLOBSTAR
 
+from .chunking import assemble, copy_chunked, read_manifest
 from .compat import cached_property
-from .config import CONFIG, build_storage, find_vcs_root
+from .config import CONFIG, build_storages, find_vcs_root, load_config
+from .digests import DigestCache, FileCache, cache_root
 from .exceptions import HashNotFound, InconsistentHash, InconsistentRepositories, NameConflict, RepositoryNotFound
-from .hash import Key, is_hash, is_tree, load_key, load_tree, strip_tree, to_hash
+from .hash import (
+    Key, from_hash, is_chunked, is_hash, is_shards, is_tree, load_key, load_tree, strip_chunked, strip_tree, to_hash,
+    to_shards
+)
 from .local import Local
+from .location import Fanout, Levels, Pruned, present_keys
+from .shards import is_shards_key, iter_shard, read_shards
+from .tree import TreeChange, TreeEntry, TreeNode, diff_trees
 from .utils import PathOrStr
 from .vc import VC, CommittedVersion, SubprocessGit, Version
 from .wc import BevLocalGlob, BevVCGlob
@@ -20,6 +31,19 @@ from .wc import BevLocalGlob, BevVCGlob
 _NoArg = object()
 
 
+class MissingValues(NamedTuple):
+    keys: Set[Key]
+    # the trees don't store the sizes, so only the sizes of the chunks of large files and of the shards are known
+    sizes: Dict[Key, int]
+
+    @property
+    def size(self) -> Optional[int]:
+        """ The total size of the missing values, or None if some of the sizes are unknown """
+        if set(self.keys) - set(self.sizes):
+            return None
+        return sum(self.sizes.values())
+
+
 class Repository:
     """
     Interface that represents a `bev` repository.
@@ -49,11 +73,21 @@ class Repository:
 
     @property
     def storage(self):
-        return self._built[0]
+        return self._built.storage
 
     @property
     def cache(self):
-        return self._built[1]
+        return self._built.cache
+
+    @property
+    def trees(self):
+        """ The storage for the trees. Same as `storage`, unless a separate location for trees is configured """
+        return self._built.trees
+
+    @property
+    def local(self) -> Location:
+        """ The location of the local copies of the values, including the trees """
+        return self._built.local
 
     def copy(self, fetch: bool = _NoArg, version: Optional[Version] = _NoArg, check: bool = _NoArg,
              prefix: PathOrStr = _NoArg, cache: dict = _NoArg):
@@ -109,6 +143,82 @@ class Repository:
 
         return version
 
+    def latest_versions(self, paths: Iterable[PathOrStr], *,
+                        default=inspect.Parameter.empty) -> Dict[PathOrStr, CommittedVersion]:
+        """
+        Get the last commit for each of the relative `paths`.
+        Same as calling `latest_version` for each path, but the history is traversed only once.
+        """
+        relatives = {}
+        for path in paths:
+            relative = self._resolve_relative(path)
+            if not (self.root / relative).exists() and not is_hash(relative):
+                relative = to_hash(relative)
+            relatives[path] = str(relative)
+
+        versions = self.vc.get_versions(list(set(relatives.values())))
+        result = {}
+        for path, relative in relatives.items():
+            version = versions[relative]
+            if version is None:
+                if default is inspect.Parameter.empty:
+                    raise FileNotFoundError(f'The path "{relative}" is not present in any commit')
+
+                version = default
+
+            result[path] = version
+
+        return result
+
+    def history(self, *parts: PathOrStr, fetch: Optional[bool] = None
+                ) -> Iterator[Tuple[CommittedVersion, int, Union[Key, None]]]:
+        """
+        Iterate over the commits that changed the key of a file in reverse chronological order.
+        Yields the commit, its timestamp and the file's key at this commit or None, if the file was removed.
+
+        The file is looked up in whichever enclosing hash exists at each commit, and each distinct tree
+        is loaded only once.
+        """
+        path = self._resolve_relative(*parts)
+        if is_hash(path):
+            path = from_hash(path)
+        # the enclosing hash can be any of the parents, same as in `_split`
+        candidates = [
+            (str(to_hash(parent)), str(path.relative_to(parent))) for parent in list(reversed(path.parents))[1:]
+        ]
+        candidates.append((str(to_hash(path)), '.'))
+        relatives = dict(candidates)
+        keys = {}
+
+        def get_key(hash_path, commit, content):
+            relative = relatives[hash_path]
+            if relative == '.':
+                return content
+
+            if (relative, content) not in keys:
+                key = None
+                if is_tree(content):
+                    key = self._get_tree(content, commit, fetch).get(relative)
+                    if isinstance(key, TreeNode):
+                        key = None
+
+                keys[relative, content] = key
+
+            return keys[relative, content]
+
+        # replay the changes chronologically, so that the enclosing hash is known at each commit
+        contents, changes, previous = {}, [], None
+        for commit, timestamp, changed in reversed(list(self.vc.get_changes(list(relatives)))):
+            contents.update(changed)
+            # the shallowest existing hash wins
+            hash_path = next((hash_path for hash_path, _ in candidates if contents.get(hash_path) is not None), None)
+            key = None if hash_path is None else get_key(hash_path, commit, contents[hash_path])
+            if key != previous:
+                changes.append((commit, timestamp, key))
+            previous = key
+
+        yield from reversed(changes)
+
     def resolve(self, *parts: PathOrStr, version: Optional[Version] = None, fetch: Optional[bool] = None,
                 check: Optional[bool] = None) -> Path:
         """
@@ -125,11 +235,21 @@ class Repository:
             means that the local (possibly uncommitted) version of the files will be used
         check: bool
             if True - the file's hash will be additionally checked for consistency
+
+        Notes
+        -----
+        The values that are read from outside the file system, e.g. from `memory` or `pack` locations, are taken
+        from a local disk location, if it has a copy, or are copied to `cache_root() / "values"` on first access,
+        because the result must be a file. The chunked files are assembled from their chunks in the same folder,
+        so that the storage keeps only the chunks. The least recently used copies are removed, once their total
+        size exceeds `files_cache_size` from the config's `meta`, which is 10 GiB by default.
         """
 
-        def _resolve(path):
+        def _resolve(value):
+            path = value if isinstance(value, Path) else _to_file(key, value, self.local, self._files)
             if check:
-                digest = digest_value(path, self.storage.algorithm).hex()
+                # the verified files are trusted until they change or `check_interval` passes
+                digest = DigestCache(cache_root() / 'digests', self.storage.algorithm, self._check_interval).get(path)
                 if digest != key:
                     raise InconsistentHash(
                         f'The path "{Path(*parts)}" has a wrong hash: expected "{key}", actual "{digest}"'
@@ -149,6 +269,10 @@ class Repository:
             return absolute.resolve()
 
         key = self.get_key(*parts, version=version, fetch=fetch)
+        if is_chunked(key):
+            # only the missing chunks are fetched, and the file is assembled from them outside the storage
+            key, path = assemble(key, self.storage, self._files, fetch)
+            return _resolve(path)
         return self.storage.read(_resolve, key, fetch=fetch)
 
     def glob(self, *parts: PathOrStr, version: Optional[Version] = None,
@@ -171,10 +295,13 @@ class Repository:
         pattern = os.path.join(*parts)
 
         if version == Local:
-            glob = BevLocalGlob(pattern, self.root, self.prefix, self.storage, fetch, GLOBSTAR)
+            glob = BevLocalGlob(
+                pattern, self.root, self.prefix, lambda key: self._get_tree(key, version, fetch), GLOBSTAR
+            )
         else:
             glob = BevVCGlob(
-                pattern, self.root, self.prefix, version, self._cache, self.vc, self.storage, fetch, GLOBSTAR
+                pattern, self.root, self.prefix, version, self._cache, self.vc,
+                lambda key: self._get_tree(key, version, fetch), GLOBSTAR
             )
 
         return list(map(Path, glob.glob()))
@@ -198,16 +325,98 @@ class Repository:
         if relative == '.':
             raise HashNotFound(f'"{path}" is a hashed folder')
 
-        tree = self._get_tree(h, version, fetch)
-        if relative not in tree:
-            if relative in self._expand_folders(tree):
-                raise HashNotFound(f'"{path}" is a folder inside a tree hash')
-
+        entry = self._get_tree(h, version, fetch).get(relative)
+        if entry is None:
             if error:
                 raise HashNotFound(str(path))
             return None
 
-        return tree[relative]
+        if isinstance(entry, TreeNode):
+            raise HashNotFound(f'"{path}" is a folder inside a tree hash')
+
+        return entry
+
+    def diff(self, *parts: PathOrStr, old: Version, new: Version,
+             fetch: Optional[bool] = None) -> Iterator[TreeChange]:
+        """
+        Iterate over the files that changed between the `old` and `new` versions of a hashed file or folder.
+        The paths are relative to the one given by `parts`.
+
+        Parameters
+        ----------
+        parts: str, Path
+            the path to a hashed file or folder, possibly inside another hashed folder
+        old, new: str, Local
+            the data versions to compare
+        fetch: bool
+            whether to fetch the trees from remote locations when needed
+        """
+        path = self._resolve_relative(*parts)
+        if is_hash(path):
+            path = from_hash(path)
+        old = self._resolve_version(old)
+        new = self._resolve_version(new)
+
+        old_hash, new_hash = self._split_or_none(path, old), self._split_or_none(path, new)
+        # same hash - nothing to load
+        if old_hash == new_hash:
+            return
+
+        yield from diff_trees(self._get_entry(old_hash, old, fetch), self._get_entry(new_hash, new, fetch))
+
+    def iter_files(self, *parts: PathOrStr, version: Optional[Version] = None, fetch: Optional[bool] = None,
+                   keep_shards: bool = True) -> Iterator[Tuple[str, bytes]]:
+        """
+        Iterate over the files inside a hashed folder, yielding their paths, relative to the folder, and contents.
+
+        If the folder was packed by `bev pack`, its shards are read sequentially, one by one, which is much faster
+        than reading lots of small files. Otherwise, the files are read one by one, in tree order.
+        The shards fetched from remote are copied to the local storage as a whole, same as any other value,
+        which speeds up the next iterations, unless `keep_shards` is False, in which case they are streamed.
+
+        Parameters
+        ----------
+        parts: str, Path
+            the path to a hashed folder, possibly inside another hashed folder
+        fetch: bool
+            whether to fetch the values from remote locations when needed
+        version: str, Local
+            the data version
+        keep_shards: bool
+            whether to copy the shards fetched from remote to the local storage
+        """
+        path = self._resolve_relative(*parts)
+        if is_hash(path):
+            path = from_hash(path)
+        version = self._resolve_version(version)
+        fetch = self._resolve_fetch(fetch)
+
+        h = self._split_or_none(path, version)
+        node = self._get_entry(h, version, fetch)
+        if not isinstance(node, TreeNode):
+            raise HashNotFound(f'"{path}" is not a hashed folder')
+
+        key, relative = h
+        prefix = '' if relative == '.' else relative + os.sep
+        root = path.parents[len(Path(relative).parts) - 1] if prefix else path
+        shards = self._get_hash(to_shards(root), version)
+        index = None if shards is None else read_shards(shards, self.trees, fetch)
+        # the folder might have changed after it was packed
+        if index is None or index['tree'] != strip_tree(key):
+            for name, value in node.flat():
+                yield name, self._read_bytes(value, fetch)
+            return
+
+        storage = self.storage
+        if fetch and not keep_shards and self._built.remote:
+            # the remote values are read directly, so nothing is replicated
+            storage = HashKeyStorage(Fanout(self.local, *self._built.remote), algorithm=self.storage.algorithm)
+        for shard in index['shards']:
+            files = [
+                (name[len(prefix):], offset, size) for name, offset, size in shard['files'] if name.startswith(prefix)
+            ]
+            if files:
+                yield from iter_shard(shard['key'], files, storage, fetch)
 
     def load_tree(self, path: PathOrStr, version: Optional[Version] = None, fetch: Optional[bool] = None) -> dict:
         path = self._resolve_relative(path)
@@ -216,8 +425,84 @@ class Repository:
         if key is None:
             raise HashNotFound(path)
 
-        key = strip_tree(key)
-        return self._get_tree(key, version, fetch)
+        return self._load_flat_tree(strip_tree(key), fetch)
+
+    def missing(self, paths: Iterable[PathOrStr] = ('.',), version: Optional[Version] = None,
+                fetch: Optional[bool] = None) -> MissingValues:
+        """
+        Find the values referenced by `paths` that are missing from the local storage, e.g. to decide whether
+        they should be fetched in advance. The trees and the manifests of large files are loaded as usual,
+        and the values are looked up in bulk, so that each storage folder is listed only once.
+
+        The keys of the trees and manifests that couldn't be loaded are returned as well,
+        because the keys they reference are unknown.
+
+        Parameters
+        ----------
+        paths: str, Path
+            hashed files and folders, paths inside hashed folders,
+            or regular folders, which are searched for hashes recursively
+        version: str, Local
+            the data version
+        fetch: bool
+            whether to fetch the trees and manifests from remote locations when needed
+        """
+        version = self._resolve_version(version)
+        fetch = self._resolve_fetch(fetch)
+        missing, sizes, values, chunked = set(), {}, set(), {}
+
+        def visit(key):
+            if is_shards_key(key):
+                try:
+                    index = read_shards(key, self.trees, fetch)
+                except ReadError:
+                    missing.add(key[2:])
+                    return
+
+                for shard in index['shards']:
+                    values.add(shard['key'])
+                    sizes[shard['key']] = sum(size for _, _, size in shard['files'])
+            elif is_chunked(key):
+                chunked[strip_chunked(key)] = None
+            elif not is_tree(key):
+                values.add(key)
+            else:
+                key = strip_tree(key)
+                try:
+                    tree = self._load(load_tree, key, fetch)
+                except ReadError:
+                    missing.add(key)
+                    return
+
+                for value in tree.values():
+                    visit(value)
+
+        for path in paths:
+            for key in self._hash_keys(self._resolve_relative(path), version, fetch):
+                visit(key)
+
+        for key in chunked:
+            try:
+                manifest = read_manifest(key, self.storage, fetch)
+            except ReadError:
+                missing.add(key)
+                continue
+
+            # either the whole file or all its chunks are needed
+            chunked[key] = manifest
+            values.add(manifest['digest'])
+            values.update(chunk for chunk, _ in manifest['chunks'])
+
+        present = {key.hex() for key in present_keys(self.local, {bytes.fromhex(key) for key in values})}
+        for manifest in chunked.values():
+            if manifest is not None and manifest['digest'] in present:
+                values.difference_update(chunk for chunk, _ in manifest['chunks'])
+            elif manifest is not None:
+                values.discard(manifest['digest'])
+                sizes.update((chunk, size) for chunk, size in manifest['chunks'] if chunk not in present)
+
+        missing.update(values - present)
+        return MissingValues(missing, {key: size for key, size in sizes.items() if key in missing})
 
     # navigation
 
@@ -237,17 +522,29 @@ class Repository:
 
     @cached_property
     def _built(self):
-        return build_storage(self.root)
+        return build_storages(self.root)
 
-    def _get_tree(self, key, version, fetch):
-        # we need the version here, because we want to cache only a committed tree
-        if version == Local:
-            return self._load(load_tree, key, fetch)
-        return self._load_cached_tree(key, fetch)
+    @cached_property
+    def _check_interval(self):
+        return load_config(self.root / CONFIG).meta.check_interval
+
+    @cached_property
+    def _files(self):
+        return FileCache(cache_root() / 'values', load_config(self.root / CONFIG).meta.files_cache_size)
+
+    def _get_tree(self, key, version, fetch) -> TreeNode:
+        # the keys are content hashes, so the trees are cached regardless of the version
+        return self._load_cached_tree(strip_tree(key), fetch)
 
     @lru_cache(None)
     def _load_cached_tree(self, key, fetch):
-        return self._load(load_tree, key, fetch=fetch)
+        return TreeNode.from_flat(
+            self._load(load_tree, key, fetch=fetch), lambda k: self._load_cached_tree(strip_tree(k), fetch), key
+        )
+
+    @lru_cache(None)
+    def _load_flat_tree(self, key, fetch):
+        return self._load_cached_tree(key, fetch).to_flat()
 
     def _get_hash(self, relative: PathOrStr, version: Version):
         if version == Local:
@@ -262,7 +559,36 @@ class Repository:
 
     def _load(self, func, key, fetch):
         fetch = self._resolve_fetch(fetch)
-        return self.storage.read(func, key, fetch=fetch)
+        return self.trees.read(func, key, fetch=fetch)
+
+    def _read_bytes(self, key: Key, fetch: Optional[bool]) -> bytes:
+        if is_chunked(key):
+            buffer = BytesIO()
+            copy_chunked(key, self.storage, buffer, fetch)
+            return buffer.getvalue()
+
+        return self.storage.read(_read_value, key, fetch=fetch)
+
+    def _hash_keys(self, path: Path, version: Version, fetch: bool) -> Iterator[Key]:
+        """ The keys referenced by a path, possibly inside a hashed folder, or by all the hashes in a folder """
+        if is_hash(path):
+            path = from_hash(path)
+        # the root itself can't be hashed
+        h = self._split_or_none(path, version) if path.name else None
+        if h is None or isinstance(h, Key) or h[1] == '.':
+            yield from hash_contents(self, path, version)
+            return
+
+        try:
+            entry = self._get_entry(h, version, fetch)
+        except ReadError:
+            # the folder's contents are unknown
+            yield 'T:' + h[0]
+            return
+
+        if entry is None:
+            raise HashNotFound(path)
+        yield from [value for _, value in entry.flat()] if isinstance(entry, TreeNode) else [entry]
 
     def _split(self, path: Path, version: Version):
         # TODO: use bin-search?
@@ -283,6 +609,22 @@ class Repository:
 
         return key
 
+    def _split_or_none(self, path: Path, version: Version):
+        try:
+            return self._split(path, version)
+        except HashNotFound:
+            return None
+
+    def _get_entry(self, h, version: Version, fetch: Optional[bool]) -> Optional[TreeEntry]:
+        if h is None or isinstance(h, Key):
+            return h
+
+        h, relative = h
+        tree = self._get_tree(h, version, fetch)
+        if relative == '.':
+            return tree
+        return tree.get(relative)
+
     def _resolve_check(self, check):
         if check is None:
             return self.check
@@ -305,12 +647,83 @@ class Repository:
             return self.prefix
         return self.prefix / Path(*parts)
 
-    @staticmethod
-    def _expand_folders(tree) -> set:
-        result = set(tree)
-        for file in tree:
-            result.update(map(str, list(Path(file).parents)[:-1]))
-        return result
+
+def hash_contents(repo: Repository, relative: Path, version: Version) -> Iterator[Key]:
+    """
+    The contents of the hash and shards files of `relative`,
+    or of all such files inside the folder `relative`, if it's not hashed itself
+    """
+    if version == Local:
+        absolute = repo.root / relative
+        if absolute.is_dir():
+            for pattern in ['*.hash', '*.shards']:
+                for file in absolute.rglob(pattern):
+                    if file.is_file():
+                        yield load_key(file)
+            return
+
+        if not is_hash(relative):
+            relative = to_hash(relative)
+        if not (repo.root / relative).exists():
+            raise HashNotFound(relative)
+        yield load_key(repo.root / relative)
+        if (repo.root / to_shards(relative)).exists():
+            yield load_key(repo.root / to_shards(relative))
+        return
+
+    def walk(folder):
+        for entry in repo.vc.list_dir(str(folder), version):
+            child = folder / entry.name
+            if entry.is_dir:
+                yield from walk(child)
+            elif is_hash(child) or is_shards(child):
+                yield repo.vc.read(str(child), version)
+
+    if relative != Path('.'):
+        key = repo.vc.read(str(relative if is_hash(relative) else to_hash(relative)), version)
+        if key is not None:
+            yield key
+            shards = repo.vc.read(str(to_shards(relative)), version)
+            if shards is not None:
+                yield shards
+            return
+        if is_hash(relative):
+            raise HashNotFound(relative)
+
+    try:
+        yield from walk(relative)
+    except FileNotFoundError:
+        raise HashNotFound(relative) from None
+
+
+def _read_value(value):
+    with value_to_buffer(value) as buffer:
+        return buffer.read()
+
+
+def _to_file(key: Key, value, local: Location, files: FileCache) -> Path:
+    # e.g. a `memory` level on top of a disk location
+    for leaf in _plain_disk_locations(local):
+        with leaf.read(bytes.fromhex(key), False) as path:
+            if path is not None:
+                return path
+
+    def write(file):
+        with value_to_buffer(value) as buffer:
+            shutil.copyfileobj(buffer, file)
+
+    return files.get(key, write)
+
+
+def _plain_disk_locations(location: Location) -> Iterator[DiskDict]:
+    """ The disk locations, whose files hold the values as is, e.g. not the ones inside `compressed` """
+    if isinstance(location, DiskDict):
+        yield location
+    elif isinstance(location, (Levels, Fanout)):
+        for child in location.locations:
+            yield from _plain_disk_locations(child)
+    elif isinstance(location, Pruned):
+        yield from _plain_disk_locations(location.location)
 
 
 def _resolve_arg(x, y):
@@ -0,0 +1,7 @@
+from .composite import Fanout, Levels
+from .compressed import Compressed
+from .manifest import BloomFilter, Manifested
+from .memory import Memory, MemoryStats
+from .pack import Pack
+from .presence import disk_path, exists, leaf_locations, present_keys
+from .pruned import Pruned, prune
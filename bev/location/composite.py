@@ -0,0 +1,22 @@
+from typing import Sequence, Union
+
+import tarn
+from tarn import Level, Location
+
+
+class Levels(tarn.Levels):
+    """ Same as `tarn.Levels`, but exposes its `locations`, from the highest priority to the lowest """
+
+    def __init__(self, *levels: Union[Level, Location]):
+        super().__init__(*levels)
+        self.locations: Sequence[Location] = tuple(
+            level.location if isinstance(level, Level) else level for level in levels
+        )
+
+
+class Fanout(tarn.Fanout):
+    """ Same as `tarn.Fanout`, but exposes its `locations` """
+
+    def __init__(self, *locations: Location):
+        super().__init__(*locations)
+        self.locations: Sequence[Location] = locations
@@ -0,0 +1,116 @@
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import ContextManager, Iterable, Optional, Tuple
+
+from tarn import Location
+from tarn.interface import Key, MaybeLabels, MaybeValue, Meta, Value
+from tarn.utils import value_to_buffer
+
+
+# a value starts with the magic, followed by the codec's id. The other values are stored as is
+MAGIC = b'\x89bev\x1a'
+CODECS = {
+    # the mtime is fixed, so that the same value is always compressed into the same bytes
+    'zlib': (b'z', lambda file, level: gzip.GzipFile(fileobj=file, mode='wb', compresslevel=level, mtime=0),
+             lambda file: gzip.GzipFile(fileobj=file, mode='rb'), 6),
+    'bz2': (b'b', lambda file, level: bz2.BZ2File(file, 'wb', compresslevel=level),
+            lambda file: bz2.BZ2File(file, 'rb'), 9),
+    'lzma': (b'x', lambda file, level: lzma.LZMAFile(file, 'wb', preset=level),
+             lambda file: lzma.LZMAFile(file, 'rb'), 6),
+}
+_READERS = {tag: reader for tag, _, reader, _ in CODECS.values()}
+
+
+class Compressed(Location):
+    """
+    Compresses the values on write and decompresses them on read, while the keys stay the digests of the
+    original values. The values that don't get smaller are stored as is, so are the ones written before
+    the compression was enabled.
+
+    The values are read as decompressed streams, so the compressed locations are best suited for remotes and
+    the lower levels of `levels`, from which the values are replicated to an uncompressed level.
+    """
+
+    def __init__(self, location: Location, codec: str = 'zlib', level: Optional[int] = None):
+        if codec not in CODECS:
+            raise ValueError(f'Unknown codec {codec!r}. Available: {", ".join(CODECS)}')
+        self.location, self.codec = location, codec
+        self._tag, self._writer, _, default = CODECS[codec]
+        self.level = default if level is None else level
+        # used by tarn to detect the hashing algorithm
+        self.hash = getattr(location, 'hash', None)
+
+    @contextmanager
+    def read(self, key: Key, return_labels: bool):
+        with self.location.read(key, return_labels) as value:
+            if value is None:
+                yield None
+                return
+
+            if return_labels:
+                value, labels = value
+            with _decompress(value) as value:
+                yield (value, labels) if return_labels else value
+
+    def contents(self) -> Iterable[Tuple[Key, Location, Meta]]:
+        return self.location.contents()
+
+    @contextmanager
+    def write(self, key: Key, value: Value, labels: MaybeLabels) -> ContextManager[MaybeValue]:
+        with tempfile.TemporaryFile() as compressed:
+            with value_to_buffer(value) as buffer:
+                start = buffer.tell() if buffer.seekable() else None
+                compressed.write(MAGIC + self._tag)
+                with self._writer(compressed, self.level) as file:
+                    shutil.copyfileobj(buffer, file)
+
+                # not worth it, e.g. the value is already compressed
+                if start is not None and compressed.tell() >= buffer.tell() - start:
+                    buffer.seek(start)
+                    with self.location.write(key, buffer, labels) as written:
+                        yield written
+                    return
+
+            compressed.seek(0)
+            with self.location.write(key, compressed, labels) as written:
+                if written is None:
+                    yield None
+                    return
+
+                with _decompress(written) as written:
+                    yield written
+
+    def delete(self, key: Key) -> bool:
+        return self.location.delete(key)
+
+    def touch(self, key: Key) -> bool:
+        return self.location.touch(key)
+
+
+@contextmanager
+def _decompress(value: Value):
+    with value_to_buffer(value) as buffer:
+        header = buffer.read(len(MAGIC) + 1)
+        reader = _READERS.get(header[len(MAGIC):]) if header[:len(MAGIC)] == MAGIC else None
+        if reader is not None:
+            with reader(buffer) as file:
+                yield file
+            return
+
+        # the value is stored as is
+        if isinstance(value, (str, os.PathLike)):
+            yield value
+        elif buffer.seekable():
+            buffer.seek(-len(header), os.SEEK_CUR)
+            yield buffer
+        else:
+            with tempfile.TemporaryFile() as file:
+                file.write(header)
+                shutil.copyfileobj(buffer, file)
+                file.seek(0)
+                yield file
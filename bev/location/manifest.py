@@ -0,0 +1,253 @@
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from io import BytesIO
+from typing import ContextManager, Iterable, List, NamedTuple, Optional, Tuple
+
+from tarn import Location
+from tarn.exceptions import CollisionError
+from tarn.interface import Key, MaybeLabels, MaybeValue, Meta, Value
+from tarn.utils import value_to_buffer
+
+
+# the magic, followed by the number of bits and hash functions
+_HEADER = struct.Struct('<8sQB')
+_MAGIC = b'bevbloom'
+
+
+class BloomFilter:
+    """
+    A set of keys that can only answer whether a key is *likely* present: there are no false negatives, and
+    the false positives happen with probability of about `error_rate`, as long as there are at most `capacity` keys.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.bits, self.hashes = bits, max(1, round(bits / max(capacity, 1) * math.log(2)))
+        self._data = bytearray((bits + 7) // 8)
+
+    def add(self, key: Key):
+        for position in self._positions(key):
+            self._data[position >> 3] |= 1 << (position & 7)
+
+    def update(self, keys: Iterable[Key]):
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key: Key) -> bool:
+        return all(self._data[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def to_bytes(self) -> bytes:
+        return _HEADER.pack(_MAGIC, self.bits, self.hashes) + self._data
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'BloomFilter':
+        magic, bits, hashes = _HEADER.unpack_from(data)
+        if magic != _MAGIC or len(data) != _HEADER.size + (bits + 7) // 8:
+            raise ValueError('The data is not a valid bloom filter')
+
+        result = cls.__new__(cls)
+        result.bits, result.hashes, result._data = bits, hashes, bytearray(data[_HEADER.size:])
+        return result
+
+    def _positions(self, key: Key):
+        # the keys are digests, so their bytes are already uniformly distributed
+        if len(key) < 16:
+            key = hashlib.sha256(key).digest()
+        first, second = int.from_bytes(key[:8], 'little'), int.from_bytes(key[8:16], 'little') | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+
+class Manifested(Location):
+    """
+    Keeps a bloom filter of the keys stored in `location` inside the location itself, so that the clients can
+    download it once and skip the requests for the keys that are definitely missing, e.g. on a remote where
+    each request is a network round-trip.
+
+    The manifest must be created once by `rebuild`, e.g. by `bev manifest`. Until then, as well as when the manifest
+    is missing, all the requests are sent as usual. The keys written through this location are published by calling
+    `publish`, e.g. at the end of `bev push`. Each call stores a separate small filter in the next free slot, so
+    concurrent publishers never overwrite each other's keys, and the clients union all the filters.
+    If another client might have published new keys, the new slots are downloaded after `max_age` seconds,
+    but only on a miss. `rebuild` merges all the slots into a single filter again.
+
+    All the clients that write to `location` should use this wrapper, otherwise their keys will be reported missing.
+    The manifest is stored under reserved keys, that start with zeros, so `location` must be writable, e.g. S3
+    or a disk storage. If some writers can't be trusted to publish their keys, set `fallback`: the storages built
+    from the config will then look up the keys in the unwrapped location as well, after all the other locations,
+    so a key that is missing from the filters is never lost, but each missing key costs a request again.
+    """
+
+    def __init__(self, location: Location, capacity: int = 10 ** 6, error_rate: float = 0.01, max_age: float = 600,
+                 fallback: bool = False):
+        self.location, self.capacity, self.error_rate, self.max_age = location, capacity, error_rate, max_age
+        self.fallback = fallback
+        self._filters: List[BloomFilter] = []
+        self._ids = set()
+        # the id of the loaded base filter and the next slot to look at
+        self._base, self._next = None, 1
+        self._loaded = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        # used by tarn to detect the hashing algorithm
+        self.hash = getattr(location, 'hash', None)
+
+    def likely_contains(self, key: Key) -> bool:
+        """ Whether the `key` might be present in the location. False means it's definitely missing """
+        with self._lock:
+            if self._loaded is None:
+                self._load(len(key))
+            if self._contains(key):
+                return True
+            if time.monotonic() - self._loaded < self.max_age:
+                return False
+
+            # the key might have been published by another client since
+            self._load(len(key))
+            return self._contains(key)
+
+    def read(self, key: Key, return_labels: bool):
+        if not _is_manifest(key) and not self.likely_contains(key):
+            return nullcontext(None)
+        return self.location.read(key, return_labels)
+
+    def contents(self) -> Iterable[Tuple[Key, Location, Meta]]:
+        for key, location, meta in self.location.contents():
+            if not _is_manifest(key):
+                yield key, location, meta
+
+    @contextmanager
+    def write(self, key: Key, value: Value, labels: MaybeLabels) -> ContextManager[MaybeValue]:
+        with self.location.write(key, value, labels) as written:
+            yield written
+
+        if written is not None:
+            with self._lock:
+                self._pending.add(key)
+
+    def delete(self, key: Key) -> bool:
+        # the key stays in the filter, which only means one extra request
+        return self.location.delete(key)
+
+    def touch(self, key: Key) -> bool:
+        return self.likely_contains(key) and self.location.touch(key)
+
+    def publish(self) -> bool:
+        """
+        Publish the keys written since the last call as a new slot of the manifest.
+        Returns False if there is no manifest yet, or it can't be written.
+        """
+        with self._lock:
+            if not self._pending:
+                return True
+
+            size = len(next(iter(self._pending)))
+            self._load(size)
+            if self._base is None:
+                return False
+
+            delta = BloomFilter(len(self._pending), self.error_rate)
+            delta.update(self._pending)
+            entry = _Entry(os.urandom(16), delta)
+            while True:
+                base, index = self._base, self._next
+                try:
+                    if not self._upload(_slot(size, index), entry):
+                        return False
+                # a concurrent publisher took the slot first
+                except CollisionError:
+                    pass
+
+                # the slot is verified, because two writes that happen at the same time might both succeed
+                self._load(size)
+                if entry.id in self._ids:
+                    break
+                # the manifest was removed, or the slot can't be read back
+                if self._base is None or (self._base == base and self._next <= index):
+                    return False
+
+            self._pending.clear()
+            return True
+
+    def rebuild(self, keys: Iterable[Key], digest_size: int) -> int:
+        """
+        Publish a new manifest with `keys` and the keys listed by the location's `contents`, if it supports listing,
+        and remove all the previous slots. The `keys` must contain all the other keys stored in the location,
+        or they will be reported as missing.
+        Returns the number of keys in the manifest.
+        """
+        keys = set(keys)
+        keys.update(key for key, _, _ in self.contents())
+        with self._lock:
+            keys.update(self._pending)
+            bloom = BloomFilter(max(self.capacity, len(keys)), self.error_rate)
+            bloom.update(keys)
+
+            # the clients that come in between simply don't use the manifest
+            self.location.delete(_slot(digest_size, 0))
+            index = 1
+            while self._exists(_slot(digest_size, index)):
+                self.location.delete(_slot(digest_size, index))
+                index += 1
+            entry = _Entry(os.urandom(16), bloom)
+            if not self._upload(_slot(digest_size, 0), entry):
+                raise ValueError('The manifest could not be written')
+
+            self._filters, self._ids, self._base, self._next = [bloom], {entry.id}, entry.id, 1
+            self._loaded = time.monotonic()
+            self._pending.clear()
+            return len(keys)
+
+    def _contains(self, key: Key) -> bool:
+        return self._base is None or key in self._pending or any(key in bloom for bloom in self._filters)
+
+    def _load(self, size: int):
+        base = self._download(_slot(size, 0))
+        if base is None:
+            self._filters, self._ids, self._base = [], set(), None
+        elif base.id != self._base:
+            self._filters, self._ids, self._base, self._next = [base.bloom], {base.id}, base.id, 1
+
+        # the slots are never changed, so only the new ones are downloaded
+        while self._base is not None:
+            entry = self._download(_slot(size, self._next))
+            if entry is None:
+                break
+            self._filters.append(entry.bloom)
+            self._ids.add(entry.id)
+            self._next += 1
+
+        self._loaded = time.monotonic()
+
+    def _exists(self, key: Key) -> bool:
+        with self.location.read(key, False) as value:
+            return value is not None
+
+    def _download(self, key: Key) -> Optional['_Entry']:
+        with self.location.read(key, False) as value:
+            if value is None:
+                return None
+            with value_to_buffer(value) as buffer:
+                data = buffer.read()
+                return _Entry(data[:16], BloomFilter.from_bytes(data[16:]))
+
+    def _upload(self, key: Key, entry: '_Entry') -> bool:
+        with self.location.write(key, BytesIO(entry.id + entry.bloom.to_bytes()), None) as written:
+            return written is not None
+
+
+class _Entry(NamedTuple):
+    id: bytes
+    bloom: BloomFilter
+
+
+def _slot(size: int, index: int) -> Key:
+    return bytes(size - 8) + index.to_bytes(8, 'big')
+
+
+def _is_manifest(key: Key) -> bool:
+    return len(key) > 8 and not key[:-8].strip(b'\x00')
@@ -0,0 +1,145 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from io import BytesIO
+from typing import ContextManager, Iterable, NamedTuple, Optional, Tuple
+
+from tarn import Location
+from tarn.interface import Key, MaybeLabels, MaybeValue, Meta, Value
+from tarn.utils import value_to_buffer
+
+
+class MemoryStats(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    count: int
+    size: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class MemoryMeta(Meta):
+    def __init__(self, labels: MaybeLabels):
+        self.last_used, self.labels = None, labels
+
+
+class Memory(Location):
+    """
+    Keeps the recently used values in memory, as long as their total size fits into `max_size` bytes.
+    The values larger than `max_value_size` bytes are never kept.
+
+    Meant to be the first level of `levels` with `write: false`, so that the new values are written
+    to the lower levels, and the values read from them are replicated into memory.
+    The values are read as in-memory buffers.
+    """
+
+    def __init__(self, max_size: int, max_value_size: Optional[int] = None):
+        if max_value_size is None:
+            max_value_size = max_size // 8
+        self.max_size, self.max_value_size = max_size, min(max_size, max_value_size)
+        self._values = OrderedDict()
+        self._size = self._hits = self._misses = self._evictions = 0
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> MemoryStats:
+        with self._lock:
+            return MemoryStats(self._hits, self._misses, self._evictions, len(self._values), self._size)
+
+    def read(self, key: Key, return_labels: bool):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                self._misses += 1
+                return nullcontext(None)
+
+            self._hits += 1
+            self._values.move_to_end(key)
+
+        value, labels = entry
+        value = BytesIO(value)
+        return nullcontext((value, labels) if return_labels else value)
+
+    def contents(self) -> Iterable[Tuple[Key, Location, Meta]]:
+        with self._lock:
+            entries = [(key, labels) for key, (_, labels) in self._values.items()]
+
+        for key, labels in entries:
+            yield key, self, MemoryMeta(labels)
+
+    @contextmanager
+    def write(self, key: Key, value: Value, labels: MaybeLabels) -> ContextManager[MaybeValue]:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None:
+                self._values[key] = entry = entry[0], _merge_labels(entry[1], labels)
+                self._values.move_to_end(key)
+
+        if entry is not None:
+            yield BytesIO(entry[0])
+            return
+
+        data = _read_at_most(value, self.max_value_size)
+        if data is None:
+            yield None
+            return
+
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = data, labels
+                self._size += len(data)
+                while self._size > self.max_size:
+                    _, (evicted, _) = self._values.popitem(last=False)
+                    self._size -= len(evicted)
+                    self._evictions += 1
+
+        yield BytesIO(data)
+
+    def delete(self, key: Key) -> bool:
+        with self._lock:
+            entry = self._values.pop(key, None)
+            if entry is None:
+                return False
+
+            self._size -= len(entry[0])
+            return True
+
+    def touch(self, key: Key) -> bool:
+        with self._lock:
+            if key not in self._values:
+                return False
+
+            self._values.move_to_end(key)
+            return True
+
+
+def _read_at_most(value: Value, size: int) -> Optional[bytes]:
+    # don't load large files just to find out they don't fit
+    if isinstance(value, (str, os.PathLike)) and os.path.getsize(value) > size:
+        return None
+
+    data = bytearray()
+    with value_to_buffer(value) as buffer:
+        # streams may return fewer bytes than requested
+        while len(data) <= size:
+            chunk = buffer.read(size + 1 - len(data))
+            if not chunk:
+                break
+            data += chunk
+
+    if len(data) > size:
+        return None
+    return bytes(data)
+
+
+def _merge_labels(old: MaybeLabels, new: MaybeLabels) -> MaybeLabels:
+    if not new:
+        return old
+    if not old:
+        return new
+    return sorted(set(old) | set(new))
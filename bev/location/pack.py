@@ -0,0 +1,266 @@
+import os
+import struct
+import threading
+from contextlib import contextmanager, nullcontext
+from io import BytesIO
+from pathlib import Path
+from typing import ContextManager, Dict, Iterable, NamedTuple, Optional, Tuple
+
+from tarn import Location
+from tarn.compat import get_path_group, set_path_attrs
+from tarn.interface import Key, MaybeLabels, MaybeValue, Meta, Value
+from tarn.utils import value_to_buffer
+
+from ..utils import PathOrStr
+
+
+# key length, pack number, offset, size. A negative size marks a deleted key
+_RECORD = struct.Struct('<BIQq')
+
+
+class PackEntry(NamedTuple):
+    pack: int
+    offset: int
+    size: int
+
+
+class PackMeta(Meta):
+    def __init__(self):
+        self.last_used = self.labels = None
+
+
+class Pack(Location):
+    """
+    Stores small values by appending them to large pack files, so that millions of values don't occupy
+    millions of inodes, and reading them doesn't hit the filesystem's metadata.
+
+    The positions of the values are kept in an append-only index, which is read incrementally,
+    so any number of processes can read concurrently, while the writers are serialized by a file lock.
+    The deleted values still occupy space until `compact` is called. The other processes notice the deletions
+    only when they reload the index on a miss, which is harmless, because the values never change.
+
+    The values are kept in memory while being read or written, so large values are better kept elsewhere,
+    e.g. by wrapping the pack into a `small` location. The labels and usage times are not stored.
+    """
+
+    def __init__(self, root: PathOrStr, max_pack_size: int = 2 ** 30):
+        self.root, self.max_pack_size = Path(root), max_pack_size
+        self._generation = self._position = None
+        self._index: Dict[Key, PackEntry] = {}
+        self._last_pack = 0
+        self._files = {}
+        self._lock = threading.RLock()
+
+    def read(self, key: Key, return_labels: bool):
+        value = self._read(key)
+        if value is not None:
+            value = BytesIO(value)
+            if return_labels:
+                value = value, None
+
+        return nullcontext(value)
+
+    def contents(self) -> Iterable[Tuple[Key, Location, Meta]]:
+        with self._lock:
+            self._refresh()
+            keys = list(self._index)
+
+        for key in keys:
+            yield key, self, PackMeta()
+
+    @contextmanager
+    def write(self, key: Key, value: Value, labels: MaybeLabels) -> ContextManager[MaybeValue]:
+        existing = self._read(key)
+        if existing is None:
+            with value_to_buffer(value) as buffer:
+                existing = buffer.read()
+
+            with self._write_lock():
+                if key not in self._index:
+                    pack = self._last_pack
+                    path = self._pack_path(self._generation, pack)
+                    offset = path.stat().st_size if path.exists() else 0
+                    if offset and offset + len(existing) > self.max_pack_size:
+                        pack, offset = pack + 1, 0
+                        path = self._pack_path(self._generation, pack)
+
+                    with self._create(path, 'ab') as file:
+                        file.write(existing)
+                    # the value is fully written before it becomes visible to the readers
+                    self._append(key, PackEntry(pack, offset, len(existing)))
+
+        yield BytesIO(existing)
+
+    def delete(self, key: Key) -> bool:
+        with self._write_lock():
+            if key not in self._index:
+                return False
+
+            self._append(key, PackEntry(0, 0, -1))
+            return True
+
+    def touch(self, key: Key) -> bool:
+        return self._lookup(key)[1] is not None
+
+    def compact(self) -> Tuple[int, int]:
+        """
+        Rewrite the values that are still present into new pack files, and remove the old ones.
+        Returns the number of kept values and the number of freed bytes.
+        """
+        with self._write_lock():
+            generation = self._generation
+            entries = sorted(self._index.items(), key=lambda entry: entry[1])
+            old_size = sum(path.stat().st_size for path in self.root.glob(f'{generation}-*.pack'))
+
+            new = generation + 1
+            pack, offset, records = 0, 0, []
+            file = self._create(self._pack_path(new, pack), 'wb')
+            try:
+                for key, entry in entries:
+                    value = self._read_entry(generation, entry)
+                    if offset and offset + len(value) > self.max_pack_size:
+                        file.close()
+                        pack, offset = pack + 1, 0
+                        file = self._create(self._pack_path(new, pack), 'wb')
+
+                    file.write(value)
+                    records.append(_pack_record(key, PackEntry(pack, offset, len(value))))
+                    offset += len(value)
+            finally:
+                file.close()
+
+            with self._create(self._index_path(new), 'wb') as file:
+                file.write(b''.join(records))
+            # the switch is atomic, the readers will notice it on the next miss
+            with self._create(self.root / 'current.tmp', 'w') as file:
+                file.write(str(new))
+            os.replace(self.root / 'current.tmp', self.root / 'current')
+
+            self._refresh()
+            new_size = sum(path.stat().st_size for path in self.root.glob(f'{new}-*.pack'))
+            for path in [self._index_path(generation), *self.root.glob(f'{generation}-*.pack')]:
+                path.unlink()
+
+        return len(entries), old_size - new_size
+
+    def _lookup(self, key: Key) -> Tuple[int, Optional[PackEntry]]:
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                # the key might have been added by another process
+                self._refresh()
+                entry = self._index.get(key)
+
+            return self._generation, entry
+
+    def _read(self, key: Key) -> Optional[bytes]:
+        generation, entry = self._lookup(key)
+        if entry is None:
+            return None
+
+        try:
+            return self._read_entry(generation, entry)
+        except FileNotFoundError:
+            # the packs were compacted by another process
+            with self._lock:
+                self._refresh()
+            generation, entry = self._lookup(key)
+            if entry is None:
+                return None
+            return self._read_entry(generation, entry)
+
+    def _read_entry(self, generation: int, entry: PackEntry) -> bytes:
+        # `pread` doesn't move the file position, so the same descriptor is shared between threads.
+        # The descriptors of the old generation are closed after the switch, so they are used under the lock
+        with self._lock:
+            fd = self._files.get((generation, entry.pack))
+            if fd is None:
+                fd = os.open(self._pack_path(generation, entry.pack), os.O_RDONLY)
+                if generation != self._generation:
+                    # the packs are about to be removed, so the descriptor is not kept
+                    try:
+                        return os.pread(fd, entry.size, entry.offset)
+                    finally:
+                        os.close(fd)
+
+                self._files[generation, entry.pack] = fd
+
+            return os.pread(fd, entry.size, entry.offset)
+
+    def _refresh(self):
+        try:
+            generation = int((self.root / 'current').read_text())
+        except FileNotFoundError:
+            generation = 0
+
+        if generation != self._generation:
+            # the old packs are removed after compaction, and their space is freed only when they are closed
+            for key in [key for key in self._files if key[0] != generation]:
+                os.close(self._files.pop(key))
+            self._index.clear()
+            self._generation, self._position, self._last_pack = generation, 0, 0
+
+        try:
+            with open(self._index_path(generation), 'rb') as file:
+                file.seek(self._position)
+                data = file.read()
+        except FileNotFoundError:
+            return
+
+        # a concurrent writer might have not finished the last record yet
+        position = 0
+        while position + _RECORD.size <= len(data):
+            length, pack, offset, size = _RECORD.unpack_from(data, position)
+            stop = position + _RECORD.size + length
+            if stop > len(data):
+                break
+
+            key = data[position + _RECORD.size:stop]
+            if size < 0:
+                self._index.pop(key, None)
+            else:
+                self._index[key] = PackEntry(pack, offset, size)
+                self._last_pack = max(self._last_pack, pack)
+            position = stop
+
+        self._position += position
+
+    def _append(self, key: Key, entry: PackEntry):
+        path = self._index_path(self._generation)
+        with self._create(path, 'ab') as file:
+            file.write(_pack_record(key, entry))
+        self._refresh()
+
+    @contextmanager
+    def _write_lock(self):
+        # not available on Windows
+        import fcntl
+
+        with self._lock, self._create(self.root / 'lock', 'ab') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _create(self, path: Path, mode: str):
+        exists = path.exists()
+        file = open(path, mode)
+        if not exists:
+            set_path_attrs(path, 0o666, get_path_group(self.root))
+        return file
+
+    def _pack_path(self, generation: int, pack: int) -> Path:
+        return self.root / f'{generation}-{pack}.pack'
+
+    def _index_path(self, generation: int) -> Path:
+        return self.root / f'{generation}.index'
+
+    def __del__(self):
+        for fd in getattr(self, '_files', {}).values():
+            os.close(fd)
+
+
+def _pack_record(key: Key, entry: PackEntry) -> bytes:
+    return _RECORD.pack(len(key), *entry) + key
@@ -0,0 +1,83 @@
+import os
+from collections import defaultdict
+from pathlib import Path
+from typing import Collection, Iterator, Optional, Set
+
+from tarn import SCP, SFTP, DiskDict, Location
+from tarn.digest import key_to_relative
+from tarn.interface import Key
+
+
+def present_keys(location: Location, keys: Collection[Key]) -> Set[Key]:
+    """
+    Find the `keys` that are present in `location`. The disk locations are checked by listing each of their
+    folders once, instead of looking up each key separately, the other locations are checked key by key.
+    """
+    keys, present = set(keys), set()
+    for leaf in leaf_locations(location):
+        if not keys:
+            break
+
+        if isinstance(leaf, DiskDict):
+            found = _present_on_disk(leaf, keys)
+        else:
+            found = {key for key in keys if _exists(leaf, key)}
+        present.update(found)
+        keys -= found
+
+    return present
+
+
+def exists(location: Location, key: Key) -> bool:
+    """
+    Whether `key` is present in `location`, as far as it can be checked without downloading the value.
+    The ssh remotes copy the whole value on read, so they are never checked, and their keys are reported missing.
+    """
+    return any(_exists(leaf, key) for leaf in leaf_locations(location) if not isinstance(leaf, (SCP, SFTP)))
+
+
+def disk_path(location: DiskDict, key: Key) -> Optional[Path]:
+    """ The file with the value of `key` in `location` or None, if it's missing. Unlike `read`, it's not a usage """
+    path = location.root / key_to_relative(key, location.levels)
+    # the older storages keep the value inside a folder
+    if path.is_dir():
+        path = path / 'data'
+    if path.exists():
+        return path
+
+
+def leaf_locations(location: Location) -> Iterator[Location]:
+    """ Iterate over the locations that actually store the values, e.g. the levels of `levels` """
+    # `levels` and `fanout` expose their children
+    if isinstance(getattr(location, 'locations', None), (list, tuple)):
+        for child in location.locations:
+            yield from leaf_locations(child)
+    # e.g. `pruned`, `small` or `compressed` keep the values in the wrapped location
+    elif isinstance(getattr(location, 'location', None), Location):
+        yield from leaf_locations(location.location)
+    else:
+        yield location
+
+
+def _present_on_disk(location: DiskDict, keys: Collection[Key]) -> Set[Key]:
+    folders = defaultdict(list)
+    for key in keys:
+        relative = key_to_relative(key, location.levels)
+        folders[os.path.dirname(relative)].append((key, os.path.basename(relative)))
+
+    present = set()
+    for folder, entries in folders.items():
+        try:
+            names = set(os.listdir(location.root / folder))
+        except FileNotFoundError:
+            continue
+        present.update(key for key, name in entries if name in names)
+    return present
+
+
+def _exists(location: Location, key: Key) -> bool:
+    if isinstance(location, DiskDict):
+        return disk_path(location, key) is not None
+    # the value is not consumed, so most locations don't need to download it
+    with location.read(key, False) as value:
+        return value is not None
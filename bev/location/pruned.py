@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import ContextManager, Iterable, Optional, Tuple
+
+from tarn import DiskDict, Location
+from tarn.interface import Key, Keys, MaybeLabels, MaybeValue, Meta, Value
+
+from ..digests import cache_root
+from ..utils import write_atomic
+from .presence import disk_path, exists, leaf_locations
+
+
+class Pruned(Location):
+    """
+    Keeps the total size of the values stored in the disk locations inside `location` below `max_size` bytes.
+
+    After each write, the least recently used values are removed, but only the ones that can be read from `remote`.
+    The total size is computed by scanning the disk locations, and the result is shared with the other processes
+    through bev's cache folder, so that each of them doesn't rescan the storage on its first write.
+    The storage is rescanned when the shared result is older than `rescan_interval` seconds.
+    """
+
+    def __init__(self, location: Location, remote: Optional[Location], max_size: int, rescan_interval: float = 3600):
+        self.location, self.remote, self.max_size, self.rescan_interval = location, remote, max_size, rescan_interval
+        self._size = self._threshold = None
+        self._lock = threading.Lock()
+        # used by tarn to detect the hashing algorithm
+        self.hash = getattr(location, 'hash', None)
+
+    def read(self, key: Key, return_labels: bool):
+        return self.location.read(key, return_labels)
+
+    def read_batch(self, keys: Keys):
+        return self.location.read_batch(keys)
+
+    def contents(self) -> Iterable[Tuple[Key, Location, Meta]]:
+        return self.location.contents()
+
+    @contextmanager
+    def write(self, key: Key, value: Value, labels: MaybeLabels) -> ContextManager[MaybeValue]:
+        with self.location.write(key, value, labels) as written:
+            yield written
+
+        if written is not None:
+            with self._lock:
+                if self._size is None:
+                    self._update(self._load_size())
+                if self._size is not None and isinstance(written, (str, os.PathLike)):
+                    self._size += os.path.getsize(written)
+
+                # the total size is computed only when it's unknown, after that - it's just updated
+                if self._size is None or self._size > self._threshold:
+                    # free a bit more space, so that the next writes don't trigger pruning right away
+                    self._update(_prune(self.location, self.remote, self.max_size * 9 // 10, False)[2])
+                    self._save_size()
+
+    def delete(self, key: Key) -> bool:
+        return self.location.delete(key)
+
+    def touch(self, key: Key) -> bool:
+        return self.location.touch(key)
+
+    def _update(self, size: Optional[int]):
+        self._size = size
+        if size is not None:
+            self._threshold = max(self.max_size, size + self.max_size // 10)
+
+    def _load_size(self) -> Optional[int]:
+        try:
+            with open(self._size_file, 'r') as file:
+                entry = json.load(file)
+            if time.time() - entry['time'] < self.rescan_interval:
+                return entry['size']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save_size(self):
+        try:
+            write_atomic(
+                self._size_file, lambda file: file.write(json.dumps({'size': self._size, 'time': time.time()}).encode())
+            )
+        except OSError:
+            # the size will simply be recomputed by the other processes
+            pass
+
+    @property
+    def _size_file(self):
+        roots = sorted(str(leaf.root.resolve()) for leaf in leaf_locations(self.location) if isinstance(leaf, DiskDict))
+        return cache_root() / 'pruned' / f'{hashlib.sha1(json.dumps(roots).encode()).hexdigest()}.json'
+
+
+def prune(location: Location, remote: Optional[Location], max_size: int, dry_run: bool = False) -> Tuple[int, int]:
+    """
+    Remove the least recently used values from the disk locations inside `location`,
+    until their total size is at most `max_size` bytes. Only the values that can be read from `remote` are removed.
+
+    Returns the number of removed values and their total size.
+    If `dry_run` is True, nothing is removed, but the same statistics are returned.
+    """
+    count, size, _ = _prune(location, remote, max_size, dry_run)
+    return count, size
+
+
+def _prune(location, remote, max_size, dry_run):
+    entries = list(_disk_entries(location))
+    total = sum(size for _, size, _, _ in entries)
+    count = removed = 0
+    if total <= max_size or remote is None:
+        return count, removed, total
+
+    entries.sort(key=lambda entry: entry[0])
+    for _, size, key, disk in entries:
+        if total <= max_size:
+            break
+        if not exists(remote, key):
+            continue
+
+        if dry_run or disk.delete(key):
+            total -= size
+            removed += size
+            count += 1
+
+    return count, removed, total
+
+
+def _disk_entries(location: Location):
+    for key, disk, meta in location.contents():
+        # other locations don't occupy local disk space
+        if not isinstance(disk, DiskDict):
+            continue
+
+        # reading the value would update its usage time, so we locate the file directly
+        path = disk_path(disk, key)
+        if path is None:
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+
+        last_used = meta.last_used
+        if last_used is None:
+            last_used = datetime.fromtimestamp(max(stat.st_atime, stat.st_mtime))
+        yield last_used, stat.st_size, key, disk
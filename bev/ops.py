@@ -1,13 +1,31 @@
+import heapq
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from enum import Enum
+from itertools import islice, repeat
 from pathlib import Path
-from typing import Callable, Optional, Union
+from typing import Callable, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
 
-from tarn import HashKeyStorage
+from tarn import DiskDict, HashKeyStorage, Location, ReadError
+from tarn.digest import digest_value
+from tqdm.auto import tqdm
 
+from .chunking import expand_keys, read_manifest, write_chunked
 from .config.utils import identity
-from .hash import HashType, from_hash, is_hash, is_tree, load_key, load_tree, normalize_tree, strip_tree, tree_to_hash
-from .interface import Repository
+from .digests import DigestCache, cache_root
+from .exceptions import HashError, HashNotFound
+from .hash import (
+    HashType, Key, entries_to_hash, from_hash, is_chunked, is_hash, is_tree, load_key, load_tree,
+    normalize_tree, read_tree, strip_chunked, strip_tree, to_hash, to_shards, tree_to_hash
+)
+from .interface import Repository, hash_contents
+from .local import Local
+from .location import Manifested, leaf_locations, present_keys
+from .shards import is_shards_key, read_shards, shards_keys, write_shards
 from .utils import PathOrStr
+from .vc import Version
 
 
 class Conflict(Enum):
@@ -26,7 +44,56 @@ class Conflict(Enum):
 
 
 def gather(source: PathOrStr, storage: Union[HashKeyStorage, Repository], progressbar: Callable = identity,
-           fetch: Optional[bool] = None) -> HashType:
+           fetch: Optional[bool] = None, chunk_threshold: Optional[int] = None) -> HashType:
+    """
+    Save the file or folder at `source` into the storage and return its key or its tree.
+
+    If `chunk_threshold` is given, the files of at least `chunk_threshold` bytes are split into content-defined chunks,
+    so that different versions of a large file share most of the stored data.
+    """
+    source, storage, fetch = _prepare_gather(source, storage, fetch)
+
+    if is_hash(source):
+        key = load_key(source)
+        if is_tree(key):
+            gathered = normalize_tree(read_tree(key, storage, fetch), storage.digest_size)
+        else:
+            gathered = key
+
+    else:
+        if source.is_dir():
+            # same as in `gather_hash`: the colliding entries must have the same key
+            entries = sorted(_gather_entries(source, storage, progressbar, fetch, chunk_threshold))
+            gathered = normalize_tree(dict(_unique_entries(entries)), storage.digest_size)
+
+        else:
+            assert source.is_file()
+            gathered = _write_file(source, storage, chunk_threshold)
+
+    return gathered
+
+
+def gather_hash(source: PathOrStr, storage: Union[HashKeyStorage, Repository], progressbar: Callable = identity,
+                fetch: Optional[bool] = None, chunk_size: int = 1_000_000, nested: bool = False,
+                chunk_threshold: Optional[int] = None) -> Key:
+    """
+    Same as `save_hash(gather(...))`, but the tree is never fully loaded into memory: the gathered entries are
+    spilled to disk in sorted chunks of at most `chunk_size` entries, which are then merged and streamed directly
+    into the stored tree.
+    """
+    trees = _get_trees(storage)
+    source, storage, fetch = _prepare_gather(source, storage, fetch)
+    if is_hash(source) or not source.is_dir():
+        gathered = gather(source, storage, progressbar, fetch, chunk_threshold)
+        if isinstance(gathered, dict):
+            gathered = tree_to_hash(gathered, trees, nested)
+        return gathered
+
+    entries = _external_sort(_gather_entries(source, storage, progressbar, fetch, chunk_threshold), chunk_size)
+    return entries_to_hash(_unique_entries(entries), trees, nested)
+
+
+def _prepare_gather(source, storage, fetch):
     source = Path(source)
     if not source.exists():
         # TODO
@@ -37,51 +104,465 @@ def gather(source: PathOrStr, storage: Union[HashKeyStorage, Repository], progre
             fetch = storage.fetch
         storage = storage.storage
 
-    if is_hash(source):
-        key = load_key(source)
-        if is_tree(key):
-            gathered = normalize_tree(storage.read(load_tree, strip_tree(key), fetch=fetch), storage.digest_size)
+    return source, storage, fetch
+
+
+def _get_trees(storage: Union[HashKeyStorage, Repository]) -> HashKeyStorage:
+    if isinstance(storage, Repository):
+        return storage.trees
+    return storage
+
+
+def _gather_entries(source: Path, storage: HashKeyStorage, progressbar: Callable, fetch: Optional[bool],
+                    chunk_threshold: Optional[int] = None):
+    for path, relative in progressbar(_walk_files(os.fspath(source), '')):
+        if is_hash(relative):
+            yield from _hash_entries(path, relative, storage, fetch)
         else:
-            gathered = key
+            yield relative, _write_file(path, storage, chunk_threshold)
 
+
+def _hash_entries(path, relative, storage: HashKeyStorage, fetch: Optional[bool]):
+    relative = os.fspath(from_hash(relative))
+    key = load_key(path)
+    if is_tree(key):
+        tree = normalize_tree(read_tree(key, storage, fetch), storage.digest_size)
+        for inside, value in tree.items():
+            yield os.path.join(relative, inside), value
     else:
-        if source.is_dir():
-            gathered = {}
-            for child in progressbar(source.glob('**/*')):
-                relative = child.relative_to(source)
-                if not child.is_dir():
-                    if is_hash(child):
-                        key = load_key(child)
-                        if is_tree(key):
-                            key = storage.read(load_tree, strip_tree(key), fetch=fetch)
+        yield relative, key
 
-                        gathered[from_hash(relative)] = key
 
-                    else:
-                        gathered[relative] = storage.write(child).hex()
+def _write_file(path, storage: HashKeyStorage, chunk_threshold: Optional[int]) -> Key:
+    if chunk_threshold is not None and os.path.getsize(path) >= chunk_threshold:
+        return write_chunked(path, storage)
+    return storage.write(path).hex()
 
-            gathered = normalize_tree(gathered, storage.digest_size)
 
-        else:
-            assert source.is_file()
-            gathered = storage.write(source).hex()
+def _walk_files(root: str, relative: str):
+    with os.scandir(root) as entries:
+        for entry in entries:
+            # the symlinks to folders are skipped, so there are no cycles
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk_files(entry.path, relative + entry.name + os.sep)
+            elif not entry.is_dir():
+                yield entry.path, relative + entry.name
 
-    return gathered
+
+def _external_sort(entries: Iterable[Tuple[str, Key]], chunk_size: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        files = []
+        try:
+            for chunk in _chunks(entries, chunk_size):
+                chunk.sort()
+                # everything fits into memory
+                if not files and len(chunk) < chunk_size:
+                    yield from chunk
+                    return
+
+                # TODO: fewer open files, if needed, by merging the runs in several passes
+                file = open(Path(tmp, str(len(files))), 'w+')
+                files.append(file)
+                for entry in chunk:
+                    file.write(json.dumps(entry) + '\n')
+                file.seek(0)
+
+            yield from heapq.merge(*(map(json.loads, file) for file in files))
+
+        finally:
+            for file in files:
+                file.close()
 
 
-def load_hash(path: PathOrStr, storage, fetch: bool = False) -> HashType:
+def _chunks(iterable, size):
+    iterable = iter(iterable)
+    while True:
+        chunk = list(islice(iterable, size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def _unique_entries(entries):
+    previous_path = previous_key = None
+    for path, key in entries:
+        if path == previous_path:
+            if key != previous_key:
+                # TODO
+                raise ValueError(path)
+            continue
+
+        yield path, key
+        previous_path, previous_key = path, key
+
+
+def load_hash(path: PathOrStr, storage: Union[HashKeyStorage, Repository], fetch: bool = False) -> HashType:
+    storage = _get_trees(storage)
     key = load_key(path)
     if is_tree(key):
-        return normalize_tree(storage.read(load_tree, strip_tree(key), fetch=fetch), storage.digest_size)
+        return normalize_tree(read_tree(key, storage, fetch), storage.digest_size)
     return key
 
 
-def save_hash(tree: HashType, path: PathOrStr, storage: Union[HashKeyStorage, Repository]):
-    if isinstance(storage, Repository):
-        storage = storage.storage
+def save_hash(tree: HashType, path: PathOrStr, storage: Union[HashKeyStorage, Repository], nested: bool = False):
+    storage = _get_trees(storage)
     if isinstance(tree, dict):
-        tree = tree_to_hash(tree, storage)
+        tree = tree_to_hash(tree, storage, nested)
 
     with open(path, 'w') as file:
         file.write(tree)
     return tree
+
+
+def shard_tree(repo: Repository, path: PathOrStr, shard_size: int, fetch: Optional[bool] = None) -> Key:
+    """
+    Pack the values of the hashed folder at `path` into large shards, so that they can be read sequentially
+    by `Repository.iter_files`. The key of the shards' index is saved alongside the hash, in a `.shards` file.
+    """
+    path = Path(path)
+    if not is_hash(path):
+        path = to_hash(path)
+    key = load_key(path)
+    if not is_tree(key):
+        raise HashError(f'The hash "{path}" is not a folder')
+    if fetch is None:
+        fetch = repo.fetch
+
+    tree = read_tree(key, repo.trees, fetch)
+    # same order as in the trees: component by component
+    entries = sorted(tree.items(), key=lambda entry: entry[0].split(os.sep))
+    index = write_shards(key, entries, repo.storage, repo.trees, shard_size, fetch)
+    with open(to_shards(path), 'w') as file:
+        file.write(index)
+    return index
+
+
+class PushResult(NamedTuple):
+    uploaded: Set[Key]
+    present: Set[Key]
+    failed: Set[Key]
+
+
+class VerifyResult(NamedTuple):
+    missing: Set[Key]
+    corrupted: Set[Key]
+
+
+class FolderStatus(NamedTuple):
+    added: List[str]
+    removed: List[str]
+    modified: List[str]
+
+
+def folder_status(repo: Repository, path: PathOrStr, workers: int = 8, fetch: Optional[bool] = None) -> FolderStatus:
+    """
+    Compare the files inside the folder at `path` with the tree in its hash, without adding them to the storage.
+    The paths are relative to the folder.
+
+    A file whose size differs from the stored value's size is modified. Otherwise, its digest is computed by
+    `workers` concurrent threads and cached alongside the local storage, so a file is hashed again only after
+    its inode, size or modification time change.
+    """
+    path = Path(path)
+    if is_hash(path):
+        path = from_hash(path)
+    if fetch is None:
+        fetch = repo.fetch
+    if not to_hash(path).exists():
+        raise HashNotFound(to_hash(path))
+    if not path.is_dir():
+        raise HashError(f'"{path}" is not a folder')
+    expected = load_hash(to_hash(path), repo, fetch)
+    if not isinstance(expected, dict):
+        raise HashError(f'The hash "{to_hash(path)}" is not a folder')
+
+    storage = repo.storage
+    cache = DigestCache(cache_root() / 'digests', storage.algorithm)
+
+    def is_modified(entry):
+        file, key = entry
+        if is_chunked(key):
+            manifest = read_manifest(key, storage, fetch)
+            key, size = manifest['digest'], manifest['size']
+        else:
+            size = storage.read(_value_size, key, fetch=False, error=False)
+
+        if size is not None and size != os.path.getsize(file):
+            return True
+        return cache.get(file) != key
+
+    # the nested hashes are compared by their keys
+    files, actual = {}, {}
+    for file, relative in _walk_files(os.fspath(path), ''):
+        if is_hash(relative):
+            actual.update(_hash_entries(file, relative, repo.trees, fetch))
+        else:
+            files[relative] = file
+
+    modified = [relative for relative, key in actual.items() if relative in expected and expected[relative] != key]
+    common = sorted(set(files) & set(expected))
+    with ThreadPoolExecutor(workers) as executor:
+        changes = executor.map(is_modified, [(files[relative], expected[relative]) for relative in common])
+        modified.extend(relative for relative, changed in zip(common, changes) if changed)
+
+    actual.update(files)
+    return FolderStatus(
+        sorted(set(actual) - set(expected)), sorted(set(expected) - set(actual)), sorted(modified),
+    )
+
+
+def reachable_keys(repo: Repository, paths: Sequence[PathOrStr] = ('.',), version: Optional[Version] = None,
+                   fetch: Optional[bool] = None) -> Set[Key]:
+    """
+    Collect all the keys referenced by the hashes at `paths`, relative to the repository: the keys of the files,
+    as well as the keys of the trees and the nested trees. The folders are searched for hashes recursively.
+
+    The contents of the trees that can't be loaded are skipped, but their keys are still returned.
+    """
+    if version is None:
+        version = repo.version
+    if version is None:
+        raise ValueError('The argument `version` must be provided')
+    if fetch is None:
+        fetch = repo.fetch
+
+    keys = set()
+    for path in paths:
+        _add_reachable(repo.storage, hash_contents(repo, repo.prefix / path, version), fetch, keys, strict=False)
+    return keys
+
+
+def collect_garbage(repo: Repository, versions: Sequence[Version], dry_run: bool = False, workers: int = 1,
+                    fetch: Optional[bool] = None) -> Tuple[int, int]:
+    """
+    Remove the values from the local storage that are not reachable from any hash at any of the `versions`.
+    Returns the number of removed values and their total size in bytes.
+    The values are removed by `workers` threads.
+
+    Warning: the values of the other repositories that share the same local storage are removed as well.
+
+    If `dry_run` is True, nothing is removed, but the same statistics are returned.
+    """
+    if fetch is None:
+        fetch = repo.fetch
+
+    keys = set()
+    for version in versions:
+        if version == Local:
+            contents = [
+                load_key(file) for pattern in ['*.hash', '*.shards'] for file in repo.root.rglob(pattern)
+                if file.is_file()
+            ]
+        else:
+            contents = [
+                *repo.vc.read_files(version, '.hash').values(), *repo.vc.read_files(version, '.shards').values()
+            ]
+        # if a tree can't be loaded, we don't know which values it references, so it's not safe to continue
+        _add_reachable(repo.storage, contents, fetch, keys, strict=True)
+
+    garbage = [(key, location) for key, location, _ in repo.local.contents() if key.hex() not in keys]
+    size = sum(_get_value_size(key, location) for key, location in garbage)
+    if not dry_run and garbage:
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(lambda entry: entry[1].delete(entry[0]), garbage))
+
+    return len(garbage), size
+
+
+def _add_reachable(storage: HashKeyStorage, contents: Iterable[Key], fetch: bool, keys: Set[Key], strict: bool):
+    def visit(key):
+        if is_shards_key(key):
+            keys.add(key[2:])
+            try:
+                keys.update(shards_keys(read_shards(key, storage, fetch)))
+            except ReadError:
+                if strict:
+                    raise HashNotFound(
+                        f'The shards index {key} is missing, so the shards it references are unknown'
+                    ) from None
+            return
+
+        if is_chunked(key):
+            if strip_chunked(key) in keys:
+                return
+            try:
+                keys.update(expand_keys([key], storage, fetch))
+            except ReadError:
+                if strict:
+                    raise HashNotFound(
+                        f'The manifest {key} is missing, so the chunks it references are unknown'
+                    ) from None
+                keys.add(strip_chunked(key))
+            return
+
+        if not is_tree(key):
+            keys.add(key)
+            return
+
+        key = strip_tree(key)
+        if key in keys:
+            return
+        keys.add(key)
+        try:
+            tree = storage.read(load_tree, key, fetch=fetch)
+        except ReadError:
+            if strict:
+                raise HashNotFound(f'The tree {key} is missing, so the values it references are unknown') from None
+            return
+
+        for value in tree.values():
+            visit(value)
+
+    for content in contents:
+        visit(content)
+
+
+def _value_size(value):
+    if isinstance(value, (str, os.PathLike)):
+        return _get_size(value)
+
+
+def _get_value_size(key, location):
+    with location.read(key, False) as value:
+        if isinstance(value, (str, os.PathLike)):
+            return _get_size(value)
+        return 0
+
+
+def verify_keys(storage: Union[HashKeyStorage, Repository], keys: Iterable[Key], workers: int = 1,
+                progress: bool = False) -> VerifyResult:
+    """
+    Check that the values of `keys` are present in the local storage and their digests match the keys.
+    The values are hashed in parallel by `workers` processes.
+    """
+    if isinstance(storage, Repository):
+        storage = storage.storage
+
+    missing, corrupted, files = set(), set(), []
+    for key in keys:
+        with storage.read(key, fetch=False, error=False) as value:
+            if value is None:
+                missing.add(key)
+            elif isinstance(value, (str, os.PathLike)):
+                files.append((key, os.fspath(value)))
+            elif digest_value(value, storage.algorithm).hex() != key:
+                corrupted.add(key)
+
+    sizes = [_get_size(path) for _, path in files]
+    paths = [path for _, path in files]
+    with tqdm(total=sum(sizes), unit='B', unit_scale=True, unit_divisor=1024, disable=not progress) as bar:
+        if workers > 1:
+            with ProcessPoolExecutor(workers) as executor:
+                digests = executor.map(_digest_file, paths, repeat(storage.algorithm), chunksize=16)
+                _check_digests(files, sizes, digests, missing, corrupted, bar)
+        else:
+            digests = map(_digest_file, paths, repeat(storage.algorithm))
+            _check_digests(files, sizes, digests, missing, corrupted, bar)
+
+    return VerifyResult(missing, corrupted)
+
+
+def _check_digests(files, sizes, digests, missing, corrupted, bar):
+    for (key, _), size, digest in zip(files, sizes, digests):
+        bar.update(size)
+        if digest is None:
+            missing.add(key)
+        elif digest != key:
+            corrupted.add(key)
+
+
+def _get_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _digest_file(path, algorithm):
+    try:
+        return digest_value(path, algorithm).hex()
+    except FileNotFoundError:
+        return None
+
+
+def push_keys(storage: Union[HashKeyStorage, Repository], keys: Iterable[Key], remotes: Sequence[Location],
+              workers: int = 8, progress: bool = False) -> PushResult:
+    """
+    Upload the values of `keys` from the local storage to each of the `remotes`, where they are missing.
+    The uploads are made by `workers` concurrent threads.
+
+    The values that are already present in a remote are skipped, so an interrupted push can be simply restarted.
+    The disk remotes are checked by listing their folders, and the keys missing from a remote's manifest
+    are uploaded without a check.
+    """
+    if isinstance(storage, Repository):
+        storage = storage.storage
+
+    return _copy_values(
+        lambda key: storage.read(key, fetch=False, error=False), keys, remotes, storage.labels, workers, progress
+    )
+
+
+def copy_keys(source: Location, keys: Iterable[Key], destinations: Sequence[Location], workers: int = 8,
+              progress: bool = False) -> PushResult:
+    """
+    Same as `push_keys`, but the values are copied directly from the `source` location to the `destinations`.
+    """
+    return _copy_values(lambda key: source.read(bytes.fromhex(key), False), keys, destinations, None, workers, progress)
+
+
+def _copy_values(read, keys, destinations, labels, workers, progress):
+    def copy(task):
+        key, destination, check = task
+        if check:
+            with destination.read(bytes.fromhex(key), False) as value:
+                if value is not None:
+                    return None
+
+        with read(key) as value:
+            if value is None:
+                return False
+            with destination.write(bytes.fromhex(key), value, labels) as written:
+                return written is not None
+
+    # the keys that can be checked in bulk are not requested one by one
+    keys, tasks, present = set(keys), [], set()
+    for destination in destinations:
+        found, missing = _find_present(destination, keys)
+        present.update(found)
+        tasks.extend((key, destination, key not in missing) for key in keys - found)
+
+    uploaded, failed = set(), set()
+    with ThreadPoolExecutor(workers) as executor:
+        results = executor.map(copy, tasks)
+        for (key, _, _), success in tqdm(zip(tasks, results), total=len(tasks), disable=not progress):
+            if success is None:
+                present.add(key)
+            elif success:
+                uploaded.add(key)
+            else:
+                failed.add(key)
+
+    # make the new values visible to the other clients, that use the same manifest
+    for destination in destinations:
+        if isinstance(destination, Manifested):
+            destination.publish()
+
+    # a key counts as present only if it's present in all the destinations
+    present -= uploaded | failed
+    uploaded -= failed
+    return PushResult(uploaded, present, failed)
+
+
+def _find_present(location: Location, keys: Set[Key]) -> Tuple[Set[Key], Set[Key]]:
+    """ The `keys` known to be present in `location` and the ones known to be missing, without reading each key """
+    keys, missing, present = {bytes.fromhex(key) for key in keys}, set(), set()
+    # a manifest can only tell that a key is missing
+    if isinstance(location, Manifested):
+        missing = {key for key in keys if not location.likely_contains(key)}
+        keys -= missing
+    # the disk locations are listed folder by folder
+    if all(isinstance(leaf, DiskDict) for leaf in leaf_locations(location)):
+        present = present_keys(location, keys)
+        missing |= keys - present
+    return {key.hex() for key in present}, {key.hex() for key in missing}
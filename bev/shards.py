@@ -0,0 +1,84 @@
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Optional, Set, Tuple
+
+from tarn import HashKeyStorage
+from tarn.utils import value_to_buffer
+
+from .chunking import copy_chunked
+from .hash import Key, is_chunked, strip_tree
+
+
+def is_shards_key(key: Key):
+    return key.startswith('S:')
+
+
+def write_shards(tree_key: Key, entries: Iterable[Tuple[str, Key]], storage: HashKeyStorage, trees: HashKeyStorage,
+                 shard_size: int, fetch: Optional[bool] = None) -> Key:
+    """
+    Concatenate the values of `entries`, in the given order, into shards of about `shard_size` bytes.
+    Returns the key of the index, which references the tree with `tree_key` and the position of each file inside
+    the shards. The shards are saved to `storage`, and the index - to `trees`.
+    """
+    shards = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp, 'shard')
+
+        def flush():
+            if files:
+                shards.append({'key': storage.write(path).hex(), 'files': files})
+
+        files, file = [], open(path, 'wb')
+        try:
+            for relative, key in entries:
+                offset = file.tell()
+                _copy_value(key, storage, file, fetch)
+                files.append([relative, offset, file.tell() - offset])
+
+                if file.tell() >= shard_size:
+                    file.close()
+                    flush()
+                    files, file = [], open(path, 'wb')
+
+            file.close()
+            flush()
+        finally:
+            file.close()
+
+    index = json.dumps({'tree': strip_tree(tree_key), 'shards': shards}).encode()
+    return 'S:' + trees.write(index).hex()
+
+
+def read_shards(key: Key, storage: HashKeyStorage, fetch: Optional[bool] = None) -> dict:
+    return storage.read(_load_index, key[2:] if is_shards_key(key) else key, fetch=fetch)
+
+
+def shards_keys(index: dict) -> Set[Key]:
+    return {shard['key'] for shard in index['shards']}
+
+
+def iter_shard(key: Key, files: Iterable[Tuple[str, int, int]], storage: HashKeyStorage,
+               fetch: Optional[bool] = None) -> Iterator[Tuple[str, bytes]]:
+    """ Read the `files` from the shard with a given `key` in a single sequential pass """
+    with storage.read(key, fetch=fetch) as value, value_to_buffer(value) as buffer:
+        position = 0
+        for relative, offset, size in sorted(files, key=lambda file: file[1]):
+            if offset != position:
+                buffer.seek(offset)
+            yield relative, buffer.read(size)
+            position = offset + size
+
+
+def _copy_value(key: Key, storage: HashKeyStorage, file: BinaryIO, fetch: Optional[bool]):
+    if is_chunked(key):
+        copy_chunked(key, storage, file, fetch)
+    else:
+        with storage.read(key, fetch=fetch) as value, value_to_buffer(value) as buffer:
+            shutil.copyfileobj(buffer, file)
+
+
+def _load_index(value):
+    with value_to_buffer(value) as buffer:
+        return json.load(buffer)
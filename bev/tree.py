@@ -0,0 +1,225 @@
+import os
+from bisect import bisect_left
+from heapq import merge
+from sys import intern
+from typing import Callable, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple, Union
+
+from .exceptions import HashError
+from .hash import Key, Tree, is_chunked, is_tree, strip_chunked, strip_tree
+
+
+TreeEntry = Union['TreeNode', Key]
+
+
+class TreeChange(NamedTuple):
+    """ A file that was added (`old` is None), removed (`new` is None) or modified """
+    path: str
+    old: Optional[Key]
+    new: Optional[Key]
+
+
+class TreeNode:
+    """
+    A compact in-memory representation of a hashed folder.
+
+    Each node is a folder that stores the sorted names of its files alongside a single buffer with their digests,
+    and a mapping from names to nested folders. The names are interned, so that the same component
+    is stored only once across all the trees. The names of the chunked files are kept separately.
+
+    Folders that are stored as separate trees are loaded lazily, only when their contents are accessed.
+    """
+    __slots__ = '_names', '_digests', '_digest_size', '_chunked', '_folders', '_key', '_load'
+
+    def __init__(self, key: Optional[Key] = None, load: Optional[Callable[[Key], 'TreeNode']] = None):
+        self._names = []
+        self._digests = []
+        self._digest_size = 0
+        self._chunked = set()
+        self._folders: Dict[str, TreeNode] = {}
+        self._key, self._load = key, load
+
+    @classmethod
+    def from_flat(cls, tree: Tree, load: Optional[Callable[[Key], 'TreeNode']] = None,
+                  key: Optional[Key] = None) -> 'TreeNode':
+        """
+        Build a node from a normalized flat `tree`.
+        The entries that point to other trees will be loaded by `load` when needed.
+        """
+        root = cls(None if key is None else strip_tree(key), load)
+        # the trees are usually sorted, so consecutive files often share the same folder
+        last_folder, last_node = '', root
+        for path, value in tree.items():
+            folder, _, name = path.rpartition(os.sep)
+            if folder != last_folder:
+                last_folder, last_node = folder, root._make_folders(folder)
+
+            if is_tree(value):
+                if load is None:
+                    raise HashError(f'The path "{path}" points to a tree, but no way to load it was provided')
+                last_node._folders[intern(name)] = cls._lazy(strip_tree(value), load)
+            else:
+                name = intern(name)
+                if is_chunked(value):
+                    last_node._chunked.add(name)
+                last_node._names.append(name)
+                last_node._digests.append(bytes.fromhex(strip_chunked(value)))
+
+        root._freeze()
+        return root
+
+    @property
+    def key(self) -> Optional[Key]:
+        """ The key of the tree this node was loaded from, if any """
+        return self._key
+
+    def get(self, relative: str) -> Optional[TreeEntry]:
+        """
+        Get the entry located at the `relative` path: a nested node for folders, a key for files
+        and None if the path is missing.
+        """
+        *parents, name = relative.split(os.sep)
+        node = self
+        for parent in parents:
+            node = node._get_folders().get(parent)
+            if node is None:
+                return None
+
+        # the older trees might have both a file and a folder with the same name, the file takes precedence there
+        key = node._get_file(name)
+        if key is not None:
+            return key
+        return node._get_folders().get(name)
+
+    def items(self) -> Iterator[Tuple[str, TreeEntry]]:
+        """ Iterate over the direct children of the node in sorted order """
+        folders = self._get_folders()
+        files = ((name, self._get_key(index, name)) for index, name in enumerate(self._names))
+        yield from merge(files, folders.items(), key=lambda x: x[0])
+
+    def flat(self) -> Iterator[Tuple[str, Key]]:
+        """ Iterate over all the files inside the node, as well as inside the nested nodes """
+        for name, value in self.items():
+            if isinstance(value, TreeNode):
+                for relative, key in value.flat():
+                    yield name + os.sep + relative, key
+            else:
+                yield name, value
+
+    def to_flat(self) -> Dict[str, Key]:
+        return dict(self.flat())
+
+    @classmethod
+    def _lazy(cls, key: Key, load: Callable[[Key], 'TreeNode']) -> 'TreeNode':
+        node = cls(key, load)
+        node._names = None
+        return node
+
+    def _get_folders(self) -> Dict[str, 'TreeNode']:
+        if self._names is None:
+            # nodes with the same key are interchangeable, so we can just share the contents
+            loaded = self._load(self._key)
+            self._digests, self._digest_size, self._folders = loaded._digests, loaded._digest_size, loaded._folders
+            self._chunked = loaded._chunked
+            self._names = loaded._get_names()
+
+        return self._folders
+
+    def _get_names(self):
+        self._get_folders()
+        return self._names
+
+    def _get_file(self, name: str) -> Optional[Key]:
+        names = self._get_names()
+        index = bisect_left(names, name)
+        if index < len(names) and names[index] == name:
+            return self._get_key(index, name)
+
+    def _get_key(self, index: int, name: str) -> Key:
+        key = self._get_digest(index).hex()
+        if name in self._chunked:
+            key = 'C:' + key
+        return key
+
+    def _get_digest(self, index: int) -> bytes:
+        start = index * self._digest_size
+        return self._digests[start:start + self._digest_size]
+
+    def _make_folders(self, relative: str) -> 'TreeNode':
+        node = self
+        if not relative:
+            return node
+
+        for part in relative.split(os.sep):
+            child = node._folders.get(part)
+            if child is None:
+                child = node._folders[intern(part)] = TreeNode(load=self._load)
+            elif child._names is None:
+                raise HashError(f'The path "{relative}" is both a tree and a folder')
+            node = child
+
+        return node
+
+    def _freeze(self):
+        # turn the lists into compact sorted arrays
+        pairs = sorted(zip(self._names, self._digests))
+        self._names = tuple(name for name, _ in pairs)
+        self._digests = b''.join(digest for _, digest in pairs)
+        self._digest_size = len(pairs[0][1]) if pairs else 0
+        self._chunked = frozenset(self._chunked)
+
+        self._folders = {name: self._folders[name] for name in sorted(self._folders)}
+        for folder in self._folders.values():
+            # lazy nodes are frozen when loaded
+            if folder._names is not None:
+                folder._freeze()
+
+    def __len__(self):
+        return len(self._get_names()) + len(self._folders)
+
+
+def diff_trees(old: Optional[TreeEntry], new: Optional[TreeEntry], relative: str = '') -> Iterator[TreeChange]:
+    """
+    Iterate over the changed files between two entries, in sorted order.
+    The folders with the same key are skipped without loading them.
+    """
+    if isinstance(old, TreeNode) and isinstance(new, TreeNode):
+        if old.key is not None and old.key == new.key:
+            return
+
+        for name, old_child, new_child in _merge_items(old.items(), new.items()):
+            yield from diff_trees(old_child, new_child, os.path.join(relative, name))
+        return
+
+    if old == new:
+        return
+
+    # a folder was replaced by a file or vice versa
+    if isinstance(old, TreeNode):
+        for path, key in old.flat():
+            yield TreeChange(os.path.join(relative, path), key, None)
+        old = None
+    elif old is not None and isinstance(new, TreeNode):
+        yield TreeChange(relative or '.', old, None)
+        old = None
+    if isinstance(new, TreeNode):
+        for path, key in new.flat():
+            yield TreeChange(os.path.join(relative, path), None, key)
+        new = None
+
+    if old != new:
+        yield TreeChange(relative or '.', old, new)
+
+
+def _merge_items(old: Iterable[Tuple[str, TreeEntry]], new: Iterable[Tuple[str, TreeEntry]]):
+    old, new = iter(old), iter(new)
+    left, right = next(old, None), next(new, None)
+    while left is not None or right is not None:
+        if right is None or (left is not None and left[0] < right[0]):
+            yield left[0], left[1], None
+            left = next(old, None)
+        elif left is None or right[0] < left[0]:
+            yield right[0], None, right[1]
+            right = next(new, None)
+        else:
+            yield left[0], left[1], right[1]
+            left, right = next(old, None), next(new, None)
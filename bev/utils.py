@@ -1,7 +1,10 @@
+import os
 import shlex
 import subprocess
+import tempfile
 from os import PathLike
-from typing import Union
+from pathlib import Path
+from typing import BinaryIO, Callable, Union
 
 
 PathOrStr = Union[str, PathLike]
@@ -11,9 +14,22 @@ PathOrStr = Union[str, PathLike]
 def call_git(command: str, cwd=None, wrap=False) -> str:
     try:
         return subprocess.check_output(
-            shlex.split(command), cwd=cwd, stderr=subprocess.STD_ERROR_HANDLE if wrap else subprocess.DEVNULL
+            shlex.split(command), cwd=cwd, stderr=subprocess.PIPE if wrap else subprocess.DEVNULL
         ).decode('utf-8').strip()
     except subprocess.CalledProcessError as e:
         if wrap:
             raise RuntimeError(e.stderr or e.stdout) from e
         raise
+
+
+def write_atomic(path: Path, write: Callable[[BinaryIO], None]):
+    """ Create the file at `path` with `write`, so that concurrent readers never see a partial file """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent)
+    try:
+        with open(fd, 'wb') as file:
+            write(file)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
@@ -1,11 +1,13 @@
+import heapq
 import os
 import shlex
 import subprocess
 from abc import abstractmethod
 from contextlib import suppress
 from functools import lru_cache
+from itertools import islice
 from pathlib import Path
-from typing import NamedTuple, Sequence, Union
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple, Union
 
 from .config import find_vcs_root
 from .local import LocalVersion
@@ -41,15 +43,75 @@ class VC:
         E.g. for n=0 - this will be the most recent version.
         """
 
+    @abstractmethod
+    def get_history(self, relative: str) -> Iterator[Tuple[CommittedVersion, int, Union[str, None]]]:
+        """
+        Iterate over the versions that changed the file `relative` to the root in reverse chronological order.
+        Yields the version, its timestamp and the contents of the file at this version or None, if it was deleted.
+        """
+
+    def get_changes(self, relatives: Sequence[str]
+                    ) -> Iterator[Tuple[CommittedVersion, int, Dict[str, Union[str, None]]]]:
+        """
+        Iterate over the versions that changed any of the files `relative` to the root in reverse chronological order.
+        Yields the version, its timestamp and the new contents of the files changed at this version.
+        """
+        histories = [
+            ((commit, timestamp, {relative: content}) for commit, timestamp, content in self.get_history(relative))
+            for relative in relatives
+        ]
+        previous = None
+        for commit, timestamp, contents in heapq.merge(*histories, key=lambda entry: -entry[1]):
+            if previous is not None and previous[0] != commit:
+                yield previous
+                previous = None
+            if previous is None:
+                previous = commit, timestamp, {}
+            previous[2].update(contents)
+
+        if previous is not None:
+            yield previous
+
+    def get_versions(self, relatives: Sequence[str]) -> Dict[str, Union[str, None]]:
+        """
+        Get the most recent version for each of the files `relative` to the root
+        or None, if the file doesn't exist.
+        """
+        return {relative: self.get_version(relative) for relative in relatives}
+
     @abstractmethod
     def list_dir(self, relative: str, version: CommittedVersion) -> Sequence[TreeEntry]:
         """ Get the contents of a directory `relative` to the root given `version` """
 
+    @abstractmethod
+    def list_refs(self) -> Sequence[CommittedVersion]:
+        """ Get all the named versions, e.g. branches and tags """
+
+    def read_files(self, version: CommittedVersion, suffix: str = '') -> Dict[str, str]:
+        """
+        Get the contents of all the files, whose names end with `suffix`, at a given `version`.
+        The paths are relative to the root.
+        """
+        result = {}
+
+        def walk(folder):
+            for entry in self.list_dir(folder, version):
+                relative = entry.name if folder == '.' else os.path.join(folder, entry.name)
+                if entry.is_dir:
+                    walk(relative)
+                elif relative.endswith(suffix):
+                    result[relative] = self.read(relative, version)
+
+        walk('.')
+        return result
+
 
 class SubprocessGit(VC):
     def __init__(self, root: Path):
         super().__init__(root)
         self._git_root = None
+        # the blobs never change, so their contents can be cached
+        self._blobs: Dict[str, str] = {}
 
     @lru_cache(None)
     def read(self, relative: str, version: CommittedVersion) -> Union[str, None]:
@@ -71,6 +133,50 @@ class SubprocessGit(VC):
         with suppress(subprocess.CalledProcessError):
             return self._call_git(f'git log -n 1 {n} --pretty=format:%H -- {relative}', self.root) or None
 
+    def get_versions(self, relatives: Sequence[str]) -> Dict[str, Union[str, None]]:
+        result = dict.fromkeys(relatives)
+        remaining = {}
+        for relative in relatives:
+            remaining.setdefault(os.path.normpath(relative), []).append(relative)
+        if not remaining:
+            return result
+
+        # a single pass over the history, which stops as soon as all the paths are found
+        for commit, names in self._log('--name-only', '--', '.'):
+            for name in names:
+                # the folders are changed together with the files they contain
+                while remaining:
+                    for relative in remaining.pop(name or '.', ()):
+                        result[relative] = commit
+                    if not name:
+                        break
+                    name = os.path.dirname(name)
+
+            if not remaining:
+                break
+
+        return result
+
+    def get_history(self, relative: str) -> Iterator[Tuple[CommittedVersion, int, Union[str, None]]]:
+        relative = os.path.normpath(relative)
+        for commit, timestamp, contents in self.get_changes([relative]):
+            yield commit, timestamp, contents[relative]
+
+    def get_changes(self, relatives: Sequence[str]
+                    ) -> Iterator[Tuple[CommittedVersion, int, Dict[str, Union[str, None]]]]:
+        entries = self._get_blobs(list(map(os.path.normpath, relatives)))
+        while True:
+            # read the contents in batches, so that the history can be consumed lazily
+            chunk = list(islice(entries, 1000))
+            if not chunk:
+                break
+
+            contents = self._read_blobs({blob for *_, blobs in chunk for blob in blobs.values() if blob is not None})
+            for commit, timestamp, blobs in chunk:
+                yield commit, timestamp, {
+                    name: None if blob is None else contents[blob] for name, blob in blobs.items()
+                }
+
     @lru_cache(None)
     def list_dir(self, relative: str, version: CommittedVersion) -> Sequence[TreeEntry]:
         if self._git_root is None:
@@ -95,6 +201,104 @@ class SubprocessGit(VC):
 
         return result
 
+    def list_refs(self) -> Sequence[CommittedVersion]:
+        return self._call_git('git for-each-ref --format=%(refname)', self.root).split()
+
+    def read_files(self, version: CommittedVersion, suffix: str = '') -> Dict[str, str]:
+        output = subprocess.check_output(
+            ['git', 'ls-tree', '-r', '-z', version, '--', '.'], cwd=self.root, stderr=subprocess.DEVNULL
+        )
+        # each entry is "<mode> <type> <blob>\t<path>"
+        blobs = {}
+        for entry in output.split(b'\0'):
+            if entry:
+                info, name = entry.split(b'\t', 1)
+                _, kind, blob = info.decode().split()
+                name = os.fsdecode(name)
+                if kind == 'blob' and name.endswith(suffix):
+                    blobs[name] = blob
+
+        self._blobs.update(self._read_blobs(set(blobs.values()) - set(self._blobs)))
+        return {name: self._blobs[blob] for name, blob in blobs.items()}
+
+    def _log(self, *args: str, header: str = '%H') -> Iterator[Tuple[str, List[str]]]:
+        """
+        Stream the commits printed by `git log`: the `header` of each commit along with the following tokens,
+        e.g. the paths relative to the root.
+        """
+        # the leading \0 makes sure that each commit is preceded by an empty token
+        command = ['git', 'log', '-z', '--relative', '--no-renames', f'--format=%x00{header}', *args]
+        with subprocess.Popen(command, cwd=self.root, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+            try:
+                commit, tokens = None, []
+                for token in _split_stream(process.stdout, b'\0'):
+                    if not token:
+                        if commit is not None:
+                            yield commit, tokens
+                        commit, tokens = None, []
+
+                    elif commit is None:
+                        commit = token.decode()
+
+                    else:
+                        token = os.fsdecode(token)
+                        # the first token is separated from the header by a newline
+                        if not tokens and token.startswith('\n'):
+                            token = token[1:]
+                        tokens.append(token)
+
+                if commit is not None:
+                    yield commit, tokens
+
+            finally:
+                process.kill()
+
+    def _get_blobs(self, relatives: Sequence[str]):
+        for header, tokens in self._log('--raw', '--no-abbrev', '--', *relatives, header='%H %ct'):
+            commit, timestamp = header.split()
+            blobs = {}
+            # each change is a pair: ":<old mode> <new mode> <old blob> <new blob> <status>" and the path
+            for change, name in zip(tokens[::2], tokens[1::2]):
+                if name in relatives:
+                    blob = change.split()[3]
+                    blobs[name] = None if set(blob) == {'0'} else blob
+            if blobs:
+                yield commit, int(timestamp), blobs
+
+    def _read_blobs(self, blobs: Iterable[str]) -> Dict[str, str]:
+        blobs = list(blobs)
+        if not blobs:
+            return {}
+
+        output = subprocess.run(
+            ['git', 'cat-file', '--batch'], input=''.join(f'{blob}\n' for blob in blobs).encode(), cwd=self.root,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+        ).stdout
+        # each object is printed as "<blob> blob <size>\n<contents>\n"
+        result, start = {}, 0
+        for blob in blobs:
+            end = output.index(b'\n', start)
+            size = int(output[start:end].split()[2])
+            start = end + 1 + size
+            result[blob] = output[end + 1:start].decode('utf-8').strip()
+            start += 1
+
+        return result
+
     @staticmethod
     def _call_git(command: str, cwd) -> str:
         return subprocess.check_output(shlex.split(command), cwd=cwd, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+
+
+def _split_stream(stream, separator: bytes, chunk_size: int = 2 ** 16) -> Iterator[bytes]:
+    buffer = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+
+        *parts, buffer = (buffer + chunk).split(separator)
+        yield from parts
+
+    if buffer:
+        yield buffer
@@ -1,10 +1,11 @@
 from pathlib import Path
-from typing import AnyStr, Iterator, NamedTuple, Optional, Sequence, Tuple
+from typing import AnyStr, Callable, Iterator, NamedTuple, Optional, Sequence, Tuple
 
 from wcmatch.glob import Glob
 
 from .exceptions import NameConflict
-from .hash import from_hash, is_hash, is_tree, load_key, load_tree, strip_tree, to_hash
+from .hash import Key, from_hash, is_hash, is_tree, load_key, strip_tree, to_hash
+from .tree import TreeNode
 from .vc import VC, TreeEntry
 
 
@@ -36,13 +37,13 @@ class BaseGlob(Glob):
 
 
 class BevGlob(BaseGlob):
-    def __init__(self, pattern, repo_root, relative, version, cache: dict, storage, fetch, flags: int):
+    def __init__(self, pattern, repo_root, relative, version, cache: dict, load_tree: Callable[[Key], TreeNode],
+                 flags: int):
         super().__init__(pattern, flags, Path(repo_root, relative))
         self._cache = cache
         self._version = version
         self._repo_root = Path(repo_root)
-        self._storage = storage
-        self._fetch = fetch
+        self._load_tree = load_tree
 
     def _list_dir(self, relative: Path) -> Sequence[Path]:
         """ Return the contents of a directory `relative` to `self._repo_root` """
@@ -61,8 +62,8 @@ class BevGlob(BaseGlob):
             if (self._version, parent) in self._cache:
                 cache = self._cache[self._version, parent]
                 for part in relative.relative_to(parent).parts:
-                    assert part in cache, (part, relative)
-                    cache = cache[part]
+                    cache = cache.get(part)
+                    assert cache is not None, (part, relative)
 
                 return cache
 
@@ -72,19 +73,6 @@ class BevGlob(BaseGlob):
     def _set_cached(self, relative: Path, value):
         self._cache[self._version, relative] = value
 
-    @staticmethod
-    def _normalize_tree(raw: dict):
-        tree = {}
-        for path, value in raw.items():
-            *parents, name = Path(path).parts
-            subtree = tree
-            for parent in parents:
-                subtree = subtree.setdefault(parent, {})
-
-            subtree[name] = value
-
-        return tree
-
     def _lexists(self, path: AnyStr) -> bool:
         relative = Path(self.root_dir, path).relative_to(self._repo_root)
         return (
@@ -107,14 +95,14 @@ class BevGlob(BaseGlob):
                 assert not self._exists(relative), relative
                 assert is_tree(key), (key, relative)
 
-                cached = self._normalize_tree(self._storage.read(load_tree, strip_tree(key), fetch=self._fetch))
+                cached = self._load_tree(strip_tree(key))
                 self._set_cached(relative, cached)
 
         # is it a hashed folder?
         if cached:
-            assert isinstance(cached, dict), cached
+            assert isinstance(cached, TreeNode), cached
             for name, value in cached.items():
-                yield DirEntry(name, isinstance(value, dict), self._is_hidden(name), False)
+                yield DirEntry(name, isinstance(value, TreeNode), self._is_hidden(name), False)
 
         else:
             # it's a real folder
@@ -131,8 +119,7 @@ class BevGlob(BaseGlob):
                     assert key is not None, relative_path
                     is_dir = is_tree(key)
                     if is_dir:
-                        cached = self._normalize_tree(self._storage.read(load_tree, strip_tree(key), fetch=self._fetch))
-                        self._set_cached(relative_plain, cached)
+                        self._set_cached(relative_plain, self._load_tree(strip_tree(key)))
                     else:
                         self._set_cached(relative_plain, key)
 
@@ -143,8 +130,8 @@ class BevGlob(BaseGlob):
 
 
 class BevLocalGlob(BevGlob):
-    def __init__(self, pattern, repo_root, relative, storage, fetch, flags: int):
-        super().__init__(pattern, repo_root, relative, None, {}, storage, fetch, flags)
+    def __init__(self, pattern, repo_root, relative, load_tree: Callable[[Key], TreeNode], flags: int):
+        super().__init__(pattern, repo_root, relative, None, {}, load_tree, flags)
 
     def _list_dir(self, relative: Path):
         return [
@@ -162,8 +149,9 @@ class BevLocalGlob(BevGlob):
 
 
 class BevVCGlob(BevGlob):
-    def __init__(self, pattern, repo_root, relative, version, cache, vc: VC, storage, fetch, flags: int):
-        super().__init__(pattern, repo_root, relative, version, cache, storage, fetch, flags)
+    def __init__(self, pattern, repo_root, relative, version, cache, vc: VC, load_tree: Callable[[Key], TreeNode],
+                 flags: int):
+        super().__init__(pattern, repo_root, relative, version, cache, load_tree, flags)
         self._vc = vc
 
     def _list_dir(self, relative: Path):
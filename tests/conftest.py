@@ -13,6 +13,14 @@ from bev.ops import Conflict
 from bev.testing import create_structure
 
 
+@pytest.fixture(autouse=True)
+def cache_root(monkeypatch):
+    # keep bev's caches away from the user's home
+    with tempfile.TemporaryDirectory() as root:
+        monkeypatch.setenv('XDG_CACHE_HOME', root)
+        yield Path(root) / 'bev'
+
+
 @pytest.fixture
 def tests_root():
     return Path(__file__).parent
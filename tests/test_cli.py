@@ -1,16 +1,22 @@
 import grp
+import hashlib
 import os
 import shutil
+import subprocess
+from io import BytesIO
 from pathlib import Path
 
 import pytest
-from tarn.config import load_config as load_storage_config, root_params
+from tarn import DiskDict, HashKeyStorage
+from tarn.config import StorageConfig, init_storage, load_config as load_storage_config, root_params
 from typer.testing import CliRunner
 
-from bev import Repository
+from bev import Local, Repository
 from bev.cli.entrypoint import app
-from bev.config import load_config
+from bev.config import build_storage, build_trees, load_config
 from bev.hash import to_hash, tree_to_hash
+from bev.location import Manifested
+from bev.shards import read_shards
 from bev.testing import TempDir, create_structure
 
 
@@ -44,6 +50,329 @@ def test_fetch(temp_repo, chdir):
         assert result.exit_code == 0, result.output
 
 
+def commit_trees(temp_repo, storage, sha256empty):
+    other = '1' * 64
+    subprocess.check_call(['git', 'init'], cwd=temp_repo)
+    for author, tree in [
+        ('first', {'a': sha256empty, 'b': sha256empty}),
+        ('second', {'a': sha256empty, 'b': other}),
+        ('third', {'a': other, 'b': other}),
+        ('fourth', {'a': other, 'b': other, 'c': sha256empty}),
+    ]:
+        create_structure(temp_repo, {'data.hash': tree_to_hash(tree, storage)})
+        subprocess.check_call(['git', 'add', '.'], cwd=temp_repo)
+        subprocess.check_call(['git', 'commit', '-m', author, f'--author={author} <{author}@x>'], cwd=temp_repo)
+
+    return other
+
+
+@pytest.mark.parametrize('bisect', [False, True])
+def test_blame(temp_repo, chdir, sha256empty, bisect):
+    commit_trees(temp_repo, Repository(temp_repo).storage, sha256empty)
+    options = ['--bisect'] if bisect else []
+    with chdir(temp_repo):
+        for relative, author in [('a', 'third'), ('b', 'second'), ('c', 'fourth')]:
+            result = runner.invoke(app, ['blame', 'data.hash', relative, *options])
+            assert result.exit_code == 0, result.output
+            assert f'{author} <{author}@x>' in result.output
+
+        result = runner.invoke(app, ['blame', 'data', 'missing', *options])
+        assert result.exit_code == 255
+
+
+def test_log(temp_repo, chdir, sha256empty):
+    other = commit_trees(temp_repo, Repository(temp_repo).storage, sha256empty)
+    with chdir(temp_repo):
+        result = runner.invoke(app, ['log', 'data/b'])
+        assert result.exit_code == 0, result.output
+        lines = result.output.splitlines()
+        assert len(lines) == 2
+        assert lines[0].endswith(other) and lines[1].endswith(sha256empty)
+
+
+def test_diff(temp_repo, chdir, sha256empty):
+    other = commit_trees(temp_repo, Repository(temp_repo).storage, sha256empty)
+    with chdir(temp_repo):
+        result = runner.invoke(app, ['diff', 'data', 'HEAD~2', 'HEAD'])
+        assert result.exit_code == 0, result.output
+        assert result.output.splitlines() == [f'M a {sha256empty} -> {other}', f'A c {sha256empty}']
+        result = runner.invoke(app, ['diff', 'data.hash', 'HEAD'])
+        assert result.exit_code == 0, result.output
+        assert result.output == ''
+
+
+def test_fetch_since(temp_repo, chdir):
+    storage = Repository(temp_repo).storage
+    missing, present = '1' * 64, storage.write(__file__).hex()
+    subprocess.check_call(['git', 'init'], cwd=temp_repo)
+    create_structure(temp_repo, {'data.hash': tree_to_hash({'a': missing}, storage)})
+    subprocess.check_call(['git', 'add', '.'], cwd=temp_repo)
+    subprocess.check_call(['git', 'commit', '-m', 'first'], cwd=temp_repo)
+    create_structure(temp_repo, {'data.hash': tree_to_hash({'a': missing, 'b': present}, storage)})
+
+    with chdir(temp_repo):
+        result = runner.invoke(app, ['fetch', 'data'])
+        assert result.exit_code == 255
+        result = runner.invoke(app, ['fetch', 'data', '--since', 'HEAD'])
+        assert result.exit_code == 0, result.output
+        result = runner.invoke(app, ['fetch', '.', '--since', 'HEAD'])
+        assert result.exit_code == 0, result.output
+
+
+def test_verify(temp_repo, chdir, sha256empty):
+    storage = Repository(temp_repo).storage
+    create_structure(temp_repo, {'file.hash': storage.write(__file__).hex()})
+    with chdir(temp_repo):
+        result = runner.invoke(app, ['verify', '--workers', '1'])
+        assert result.exit_code == 0, result.output
+
+        create_structure(temp_repo, {'data.hash': tree_to_hash({'a': sha256empty}, storage)})
+        result = runner.invoke(app, ['verify', 'data', '--workers', '1', '--fetch'])
+        assert result.exit_code == 255
+        assert f'missing {sha256empty}' in result.output
+
+
+def test_gc(temp_repo, chdir, tests_root):
+    def git(*args):
+        subprocess.check_call(['git', *args], cwd=temp_repo)
+
+    def exists(key):
+        return storage.read(lambda x: x is not None, key, fetch=False, error=False)
+
+    storage = Repository(temp_repo).storage
+    a, b, c, d = [storage.write(tests_root / name).hex() for name in [
+        'conftest.py', 'requirements.txt', 'test_ops.py', 'test_vc.py',
+    ]]
+    git('init')
+    create_structure(temp_repo, {'data.hash': tree_to_hash({'x': a}, storage)})
+    git('add', '.')
+    git('commit', '-m', 'first')
+    git('checkout', '-b', 'experiment')
+    create_structure(temp_repo, {'data.hash': tree_to_hash({'x': d}, storage)})
+    git('commit', '-am', 'experiment')
+    git('checkout', '-')
+    create_structure(temp_repo, {'other.hash': b})
+
+    with chdir(temp_repo):
+        result = runner.invoke(app, ['gc', '--dry-run'])
+        assert result.exit_code == 0, result.output
+        assert result.output.startswith('Would remove 1 value(s)')
+        assert all(exists(key) for key in [a, b, c, d])
+
+        # the removal must be confirmed
+        result = runner.invoke(app, ['gc'], input='n\n')
+        assert result.exit_code != 0, result.output
+        assert exists(c)
+        result = runner.invoke(app, ['gc'], input='y\n')
+        assert result.exit_code == 0, result.output
+        assert 'Removed 1 value(s)' in result.output
+        assert not exists(c)
+
+        # the experiment's tree is removed as well
+        result = runner.invoke(app, ['gc', '--ref', 'HEAD', '--yes'])
+        assert result.exit_code == 0, result.output
+        assert result.output.startswith('Removed 2 value(s)')
+        assert not exists(d)
+        assert all(exists(key) for key in [a, b])
+        assert Repository(temp_repo, version='HEAD').resolve('data/x').exists()
+
+
+def test_prune(temp_repo, chdir):
+    create_structure(temp_repo, {'file.hash': Repository(temp_repo).storage.write(__file__).hex()})
+    with chdir(temp_repo):
+        # there are no remotes, so nothing can be removed
+        result = runner.invoke(app, ['prune', '--max-size', '0'])
+        assert result.exit_code == 0, result.output
+        assert result.output == 'storage: Removed 0 value(s), 0 bytes\n'
+        assert Repository(temp_repo, version=Local).resolve('file').exists()
+
+
+def test_prune_remote_only(temp_dir, chdir):
+    (temp_dir / 'remote').mkdir()
+    (temp_dir / '.bev.yml').write_text(f'main: {{storage: {{remote: {temp_dir / "remote"}}}}}')
+    with chdir(temp_dir):
+        result = runner.invoke(app, ['prune', '--max-size', '0'])
+        assert result.exit_code == 0, result.output
+        assert result.output == 'storage: No local location, nothing to remove\n'
+
+
+def test_sync(temp_dir, chdir):
+    main, backup = temp_dir / 'main', temp_dir / 'backup'
+    for storage in [main, backup]:
+        init_storage(StorageConfig(hash='sha256', levels=[1, 31]), storage)
+    repo = temp_dir / 'repo'
+    repo.mkdir()
+    with open(repo / '.bev.yml', 'w') as file:
+        file.write(f'main: {{storage: {main}}}\nbackup: {{storage: {backup}}}\nmeta: {{fallback: main}}')
+
+    storage = Repository(repo).storage
+    create_structure(repo, {'file.hash': storage.write(__file__).hex()})
+    with chdir(repo):
+        result = runner.invoke(app, ['sync', 'main', 'backup'])
+        assert result.exit_code == 0, result.output
+        assert 'Copied 1 value(s), 0 already present, 0 failed' in result.output
+        result = runner.invoke(app, ['sync', 'main', 'backup', 'file.hash'])
+        assert result.exit_code == 0, result.output
+        assert 'Copied 0 value(s), 1 already present, 0 failed' in result.output
+        result = runner.invoke(app, ['sync', 'main', 'missing'])
+        assert result.exit_code == 255
+
+
+def test_sync_trees(temp_dir, chdir):
+    roots = {name: temp_dir / name for name in ['main', 'main-trees', 'backup', 'backup-trees']}
+    for storage in roots.values():
+        init_storage(StorageConfig(hash='sha256', levels=[1, 31]), storage)
+    repo = temp_dir / 'repo'
+    repo.mkdir()
+    with open(repo / '.bev.yml', 'w') as file:
+        file.write(
+            f'main: {{storage: {roots["main"]}, trees: {roots["main-trees"]}}}\n'
+            f'backup: {{storage: {roots["backup"]}, trees: {roots["backup-trees"]}}}\n'
+            'meta: {fallback: main}'
+        )
+
+    create_structure(repo, {'folder/a.txt': 'a content', 'folder/b.txt': 'b content'})
+    with chdir(repo):
+        result = runner.invoke(app, ['add', 'folder'])
+        assert result.exit_code == 0, result.output
+        result = runner.invoke(app, ['sync', 'main', 'backup'])
+        assert result.exit_code == 0, result.output
+        assert 'Copied 3 value(s), 0 already present, 0 failed' in result.output
+
+    def exists(root, key):
+        return HashKeyStorage(DiskDict(root)).read(lambda x: x is not None, key, fetch=False, error=False)
+
+    key = (repo / 'folder.hash').read_text()[2:]
+    assert exists(roots['backup-trees'], key) and not exists(roots['backup'], key)
+    repository = Repository(repo, version=Local)
+    assert exists(roots['backup'], repository.get_key('folder/a.txt'))
+
+
+def test_manifest(temp_dir, chdir):
+    main, remote = temp_dir / 'main', temp_dir / 'remote'
+    for storage in [main, remote]:
+        init_storage(StorageConfig(hash='sha256', levels=[1, 31]), storage)
+    repo = temp_dir / 'repo'
+    repo.mkdir()
+    with open(repo / '.bev.yml', 'w') as file:
+        file.write(
+            f'main: {{storage: {main}}}\n'
+            f'backup: {{storage: {{remote: {{manifest: {{location: {remote}, max_age: 0}}}}}}}}\n'
+            'meta: {fallback: main}'
+        )
+
+    storage = Repository(repo).storage
+    first = storage.write(b'first').hex()
+    create_structure(repo, {'first.hash': first})
+    with chdir(repo):
+        result = runner.invoke(app, ['push', 'first.hash'])
+        assert result.exit_code == 0, result.output
+        result = runner.invoke(app, ['manifest'])
+        assert result.exit_code == 0, result.output
+        assert 'backup: 1 value(s) in the manifest' in result.output
+
+        second = storage.write(b'second').hex()
+        create_structure(repo, {'second.hash': second})
+        result = runner.invoke(app, ['push', 'second.hash'])
+        assert result.exit_code == 0, result.output
+
+    location = Manifested(DiskDict(remote))
+    third = hashlib.sha256(b'third').digest()
+    assert location.likely_contains(bytes.fromhex(first)) and location.likely_contains(bytes.fromhex(second))
+    assert not location.likely_contains(third)
+
+    # the values written without the manifest are found only if the fallback is enabled
+    with DiskDict(remote).write(third, BytesIO(b'third'), None):
+        pass
+    assert not location.likely_contains(third)
+    assert not Repository(repo).storage.read(lambda x: x is not None, third.hex(), fetch=True, error=False)
+    with open(repo / '.bev.yml', 'w') as file:
+        file.write(
+            f'main: {{storage: {main}}}\n'
+            f'backup: {{storage: {{remote: {{manifest: {{location: {remote}, max_age: 0, fallback: true}}}}}}}}\n'
+            'meta: {fallback: main}'
+        )
+    assert Repository(repo).storage.read(lambda x: x is not None, third.hex(), fetch=True)
+
+
+def test_status(temp_repo, chdir):
+    create_structure(temp_repo, {'data/folder/a.txt': 'a', 'data/folder/b.txt': 'b'})
+    with chdir(temp_repo):
+        result = runner.invoke(app, ['add', 'data/folder', '--keep'])
+        assert result.exit_code == 0, result.output
+        result = runner.invoke(app, ['status'])
+        assert result.exit_code == 0, result.output
+        assert result.output == 'Nothing changed\n'
+
+        (temp_repo / 'data/folder/b.txt').write_text('B')
+        (temp_repo / 'data/folder/c.txt').write_text('c')
+        result = runner.invoke(app, ['status', 'data'])
+        assert result.exit_code == 0, result.output
+        assert result.output == 'added: data/folder/c.txt\nmodified: data/folder/b.txt\n'
+        result = runner.invoke(app, ['status', 'missing'])
+        assert result.exit_code == 255
+
+
+def test_status_missing(temp_repo, chdir, sha256empty):
+    storage = Repository(temp_repo).storage
+    create_structure(temp_repo, {
+        'present.hash': storage.write(b'present').hex(),
+        'folder/missing.hash': sha256empty,
+    })
+    with chdir(temp_repo):
+        result = runner.invoke(app, ['status', '--missing'])
+        assert result.exit_code == 0, result.output
+        assert result.output == f'{sha256empty}\n1 value(s) missing\n'
+        result = runner.invoke(app, ['status', '--missing', 'present.hash'])
+        assert result.exit_code == 0, result.output
+        assert result.output == '0 value(s) missing\n'
+
+
+def test_compact(temp_dir, chdir):
+    (temp_dir / 'pack').mkdir()
+    repo = temp_dir / 'repo'
+    repo.mkdir()
+    with open(repo / '.bev.yml', 'w') as file:
+        file.write(f'main: {{storage: {{pack: {temp_dir / "pack"}}}}}\nmeta: {{hash: sha256}}')
+
+    storage = Repository(repo).storage
+    keys = [storage.write(value).hex() for value in [b'first', b'second']]
+    Repository(repo).local.delete(bytes.fromhex(keys[0]))
+    with chdir(repo):
+        result = runner.invoke(app, ['compact'])
+        assert result.exit_code == 0, result.output
+        assert result.output == f'{temp_dir / "pack"}: Kept 1 value(s), freed 5 bytes\n'
+
+
+def test_trees_location(temp_dir, chdir):
+    main, trees = temp_dir / 'main', temp_dir / 'trees'
+    for storage in [main, trees]:
+        init_storage(StorageConfig(hash='sha256', levels=[1, 31]), storage)
+    repo = temp_dir / 'repo'
+    repo.mkdir()
+    with open(repo / '.bev.yml', 'w') as file:
+        file.write(f'main: {{storage: {main}, trees: {trees}}}')
+
+    create_structure(repo, {'folder/a.txt': 'a content', 'folder/b.txt': 'b content'})
+    with chdir(repo):
+        result = runner.invoke(app, ['add', 'folder'])
+        assert result.exit_code == 0, result.output
+
+    def exists(storage, key):
+        return storage.read(lambda x: x is not None, key, fetch=False, error=False)
+
+    key = (repo / 'folder.hash').read_text()[2:]
+    repository = Repository(repo, version=Local)
+    assert exists(repository.storage, key) and exists(repository.trees, key)
+    # the tree is stored only in its own location
+    assert not exists(HashKeyStorage(DiskDict(main)), key)
+    assert not exists(HashKeyStorage(DiskDict(trees)), repository.get_key('folder/a.txt'))
+    assert repository.resolve('folder/a.txt').read_text() == 'a content'
+
+    storage, _ = build_storage(repo)
+    assert exists(storage, key) and exists(build_trees(repo), key)
+
+
 def test_fetch_missing(temp_repo, sha256empty):
     create_structure(temp_repo, {
         'a.hash': sha256empty,
@@ -86,6 +415,78 @@ def test_pull(temp_repo, chdir, mode):
         assert {x.name for x in temp_repo.iterdir()} == {'.bev.yml', 'file.npy.hash', 'folder.hash'}
 
 
+def test_add_nested(temp_repo, chdir):
+    structure = {
+        'folder/a.txt': 'a content',
+        'folder/nested/b.txt': 'b content',
+        'folder/nested/deep/c.txt': 'c content',
+    }
+    create_structure(temp_repo, structure)
+    with chdir(temp_repo):
+        result = runner.invoke(app, ['add', 'folder', '--nested'])
+        assert result.exit_code == 0, result.output
+        repo = Repository(temp_repo)
+        assert repo.load_tree('folder.hash', version=Local) == {
+            os.path.relpath(k, 'folder'): repo.storage.write(v.encode()).hex() for k, v in structure.items()
+        }
+
+        result = runner.invoke(app, ['pull', 'folder.hash', '--mode', 'copy'])
+        assert result.exit_code == 0, result.output
+        for file, content in structure.items():
+            with open(file, 'r') as fd:
+                assert fd.read() == content
+
+
+def test_add_chunked(temp_repo, chdir):
+    create_structure(temp_repo, {'folder/small.txt': 'small content'})
+    data = os.urandom(2 ** 20)
+    (temp_repo / 'folder/large.bin').write_bytes(data)
+    with chdir(temp_repo):
+        result = runner.invoke(app, ['add', 'folder', '--chunk-threshold', '100K'])
+        assert result.exit_code == 0, result.output
+        tree = Repository(temp_repo).load_tree('folder.hash', version=Local)
+        assert tree['large.bin'].startswith('C:')
+        assert len(tree['small.txt']) == 64
+
+        result = runner.invoke(app, ['fetch', 'folder'])
+        assert result.exit_code == 0, result.output
+        result = runner.invoke(app, ['pull', 'folder.hash', '--mode', 'copy'])
+        assert result.exit_code == 0, result.output
+        assert (temp_repo / 'folder/large.bin').read_bytes() == data
+        assert (temp_repo / 'folder/small.txt').read_text() == 'small content'
+
+
+def test_pack(temp_repo, chdir):
+    files = {f'folder/{i}/{j}.txt': f'content {i} {j}' * 10 for i in range(3) for j in range(5)}
+    create_structure(temp_repo, files)
+    with chdir(temp_repo):
+        result = runner.invoke(app, ['add', 'folder'])
+        assert result.exit_code == 0, result.output
+        result = runner.invoke(app, ['pack', 'folder.hash', '--shard-size', '300'])
+        assert result.exit_code == 0, result.output
+        assert (temp_repo / 'folder.shards').read_text().startswith('S:')
+
+        repo = Repository(temp_repo)
+        expected = {k[len('folder/'):]: v.encode() for k, v in files.items()}
+        assert dict(repo.iter_files('folder', version=Local)) == expected
+        assert dict(repo.iter_files('folder/1', version=Local)) == {
+            k[2:]: v for k, v in expected.items() if k.startswith('1/')
+        }
+        shards = read_shards((temp_repo / 'folder.shards').read_text(), repo.trees)['shards']
+        assert len(shards) > 1
+
+        # the shards are referenced by the folder as well
+        repo.local.delete(bytes.fromhex(shards[0]['key']))
+        size = sum(size for *_, size in shards[0]['files'])
+        assert repo.missing(['folder'], version=Local) == ({shards[0]['key']}, {shards[0]['key']: size})
+
+        # a stale index is ignored
+        create_structure(temp_repo, {'folder/new.txt': 'new'})
+        result = runner.invoke(app, ['add', 'folder', '--conflict', 'update'])
+        assert result.exit_code == 0, result.output
+        assert dict(repo.iter_files('folder', version=Local)) == {**expected, 'new.txt': b'new'}
+
+
 def test_init(tests_root, chdir):
     folders = ['one', 'two', 'nested/folders', 'cache']
 
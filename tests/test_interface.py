@@ -1,14 +1,25 @@
+import hashlib
 import os
 import shutil
+import subprocess
+from io import BytesIO
 from pathlib import Path
 
 import cloudpickle
 import pytest
 import tarn.pickler
+from tarn import DiskDict, HashKeyStorage
+from tarn.config import StorageConfig, init_storage
 from tarn.pickler.interface import PickleError
 
+import bev.digests
 from bev import Local, Repository
+from bev.chunking import read_manifest, write_chunked
+from bev.digests import DigestCache
 from bev.exceptions import HashNotFound, InconsistentHash
+from bev.hash import load_key, tree_to_hash
+from bev.location import Pack, present_keys
+from bev.shards import read_shards, write_shards
 from bev.testing import create_structure
 
 
@@ -139,7 +150,7 @@ def test_glob(git_repository):
 
 def test_resolve(git_repository):
     repo = Repository(git_repository / 'bev-repo')
-    storage = repo.storage._local.root
+    storage = repo.local.root
     for local in [
         'just-a-file.txt',
         'images/one.png',
@@ -174,6 +185,123 @@ def test_resolve(git_repository):
         repo.resolve('folder/nested', version='v3')
 
 
+def test_latest_versions(git_repository):
+    repo = Repository(git_repository / 'bev-repo')
+    paths = ['just-a-file.txt', 'another.file', 'folder', 'folder/nested', 'images/one.png', 'images', '.', 'missing']
+    expected = {path: repo.latest_version(path, default=None) for path in paths}
+    assert expected['missing'] is None
+    assert repo.latest_versions(paths, default=None) == expected
+    assert (repo / 'folder').latest_versions(['nested']) == {'nested': expected['folder/nested']}
+
+    with pytest.raises(FileNotFoundError):
+        repo.latest_versions(paths)
+
+
+def test_history(git_repository):
+    def rev_parse(tag):
+        return subprocess.check_output(['git', 'rev-parse', tag], cwd=git_repository).decode().strip()
+
+    repo = Repository(git_repository / 'bev-repo')
+    key = repo.get_key('another.file', version='v2')
+    assert [(commit, key) for commit, _, key in repo.history('another.file')] == [
+        (rev_parse('v3'), None), (rev_parse('v2'), key),
+    ]
+    # the file was stored under `folder/nested.hash` before `folder.hash` replaced it, but its key stayed the same
+    assert [(commit, key) for commit, _, key in repo.history('folder/nested/a.npy')] == [
+        (rev_parse('v2'), repo.get_key('folder/nested/a.npy', version='v4')),
+    ]
+    assert [commit for commit, _, _ in repo.history('folder.hash')] == [rev_parse('v4')]
+    assert list(repo.history('folder/missing.npy')) == []
+    assert list(repo.history('missing')) == []
+
+
+def test_diff(git_repository):
+    repo = Repository(git_repository / 'bev-repo')
+    key = repo.get_key('folder/nested/a.npy', version='v4')
+    assert list(repo.diff('folder/nested', old='v3', new='v4')) == []
+    assert list(repo.diff('folder', old='v4', new=Local)) == []
+    assert list(repo.diff('folder/nested', old='v2', new='v3')) == [
+        (name, None, key) for name in ['a.npy', 'b.npy', 'c.npy']
+    ]
+    assert list(repo.diff('folder.hash', old='v4', new='v3')) == [
+        (name, key, None) for name in ['file.txt', 'nested/a.npy', 'nested/b.npy', 'nested/c.npy']
+    ]
+    assert list(repo.diff('another.file', old='v2', new='v3')) == [
+        ('.', repo.get_key('another.file', version='v2'), None)
+    ]
+
+
+def test_get_key_folders(git_repository):
+    repo = Repository(git_repository / 'bev-repo', version='v4')
+    assert repo.get_key('folder/nested/a.npy') == repo.get_key('folder/nested/b.npy')
+
+    for folder in ['folder', 'folder/nested']:
+        with pytest.raises(HashNotFound, match='folder'):
+            repo.get_key(folder)
+    with pytest.raises(HashNotFound, match='is a folder inside a tree hash'):
+        repo.get_key('folder/nested', error=False)
+
+    assert repo.get_key('folder/missing.npy', error=False) is None
+    assert repo.get_key('folder/nested/missing.npy', error=False) is None
+    with pytest.raises(HashNotFound):
+        repo.get_key('folder/nested/a.npy/missing')
+
+
+def test_nested_tree(temp_repo, sha256empty):
+    repo = Repository(temp_repo, version=Local)
+    tree = {
+        'a.txt': sha256empty,
+        'folder/b.txt': sha256empty,
+        'folder/nested/c.txt': sha256empty,
+    }
+    create_structure(temp_repo, {'data.hash': tree_to_hash(tree, repo.storage, nested=True)})
+
+    assert repo.load_tree('data.hash') == tree
+    # the trees are loaded once, even for the local version
+    assert repo.load_tree('data.hash') is repo.load_tree('data.hash')
+    key = load_key(temp_repo / 'data.hash')
+    assert repo._get_tree(key, Local, None) is repo._get_tree(key, Local, None)
+    assert repo.get_key('data/folder/nested/c.txt') == sha256empty
+    assert repo.get_key('data/folder/missing.txt', error=False) is None
+    with pytest.raises(HashNotFound, match='is a folder inside a tree hash'):
+        repo.get_key('data/folder/nested')
+    assert set(repo.glob('data/**/*.txt')) == {Path('data', x) for x in tree}
+
+
+def test_missing(temp_repo, temp_dir):
+    repo = Repository(temp_repo, version=Local)
+    present = repo.storage.write(b'present').hex()
+    absent = hashlib.sha256(b'absent').hexdigest()
+    large = temp_dir / 'large.bin'
+    large.write_bytes(os.urandom(2 ** 16))
+    chunked = write_chunked(large, repo.storage, 2 ** 12)
+    (chunk, size), *_ = read_manifest(chunked, repo.storage)['chunks']
+    repo.local.delete(bytes.fromhex(chunk))
+
+    tree = {'a.txt': present, 'folder/b.txt': absent, 'folder/large.bin': chunked}
+    create_structure(temp_repo, {
+        'data.hash': tree_to_hash(tree, repo.storage, nested=True),
+        'other/file.hash': absent,
+        'other/present.hash': present,
+    })
+
+    assert repo.missing(['data/a.txt']) == (set(), {})
+    assert repo.missing(['data/a.txt']).size == 0
+    result = repo.missing(['data/folder'])
+    assert result.keys == {absent, chunk}
+    # the size of `absent` is unknown
+    assert result.sizes == {chunk: size} and result.size is None
+    assert repo.missing(['data/folder/large.bin']).size == size
+    assert repo.missing(['data']).keys == {absent, chunk}
+    assert repo.missing(['other']).keys == {absent}
+
+    # the whole file is enough
+    repo.storage.write(large)
+    assert repo.missing(['data.hash']).keys == {absent}
+    with pytest.raises(HashNotFound):
+        repo.missing(['data/missing.txt'])
+
+
 def test_from_here(temp_repo_factory):
     root = Path(__file__).resolve().parent.parent / 'some-repo'
     root.mkdir()
@@ -215,6 +343,125 @@ def test_hash_consistency(temp_repo):
         temp_repo.resolve(file, version=Local)
 
 
+def test_check_cache(temp_repo, monkeypatch, cache_root):
+    calls = []
+
+    def digest_value(path, algorithm):
+        calls.append(path)
+        return original(path, algorithm)
+
+    original = bev.digests.digest_value
+    monkeypatch.setattr(bev.digests, 'digest_value', digest_value)
+    repo = Repository(temp_repo, version=Local, check=True)
+    create_structure(temp_repo, {'file.hash': repo.storage.write(__file__).hex()})
+
+    path = repo.resolve('file')
+    assert repo.resolve('file') == path
+    assert Repository(temp_repo, version=Local, check=True).resolve('file') == path
+    assert len(calls) == 1
+    assert (cache_root / 'digests').is_dir()
+
+    # re-verify each time
+    cache = DigestCache(temp_repo / 'digests', repo.storage.algorithm, interval=0)
+    cache.get(path)
+    cache.get(path)
+    assert len(calls) == 3
+
+
+def test_resolve_pack(temp_dir, cache_root):
+    (temp_dir / 'pack').mkdir()
+    root = temp_dir / 'repo'
+    root.mkdir()
+    (root / '.bev.yml').write_text(f'main: {{storage: {{pack: {temp_dir / "pack"}}}}}\nmeta: {{hash: sha256}}')
+    repo = Repository(root, version=Local, check=True)
+    broken = hashlib.sha256(b'expected').digest()
+    with Pack(temp_dir / 'pack').write(broken, BytesIO(b'actual'), None):
+        pass
+    create_structure(root, {'file.hash': repo.storage.write(b'value').hex(), 'broken.hash': broken.hex()})
+
+    # the values must be copied to files
+    path = repo.resolve('file')
+    assert path.read_bytes() == b'value' and is_relative_to(path, cache_root)
+    assert repo.resolve('file') == path
+    with pytest.raises(InconsistentHash):
+        repo.resolve('broken')
+
+
+def test_resolve_cache_size(temp_dir, cache_root):
+    (temp_dir / 'pack').mkdir()
+    root = temp_dir / 'repo'
+    root.mkdir()
+    (root / '.bev.yml').write_text(
+        f'main: {{storage: {{pack: {temp_dir / "pack"}}}}}\nmeta: {{hash: sha256, files_cache_size: 15}}'
+    )
+    repo = Repository(root, version=Local)
+    create_structure(root, {
+        f'{i}.hash': repo.storage.write(str(i).encode() * 10).hex() for i in range(3)
+    })
+
+    # only the last copy fits, the older ones are removed
+    paths = [repo.resolve(f'{i}') for i in range(3)]
+    assert [path.exists() for path in paths] == [False, False, True]
+    assert repo.resolve('0').read_bytes() == b'0' * 10
+    assert not paths[2].exists()
+
+
+def test_resolve_memory(temp_dir, cache_root):
+    init_storage(StorageConfig(hash='sha256', levels=[1, 31]), temp_dir / 'disk')
+    root = temp_dir / 'repo'
+    root.mkdir()
+    (root / '.bev.yml').write_text(
+        f'main: {{storage: {{levels: [{{location: {{memory: 1K}}, write: false}}, {temp_dir / "disk"}]}}}}'
+    )
+    repo = Repository(root, version=Local, check=True)
+    create_structure(root, {'file.hash': repo.storage.write(b'value').hex()})
+
+    # the memory level keeps the value after the first read, but the file on disk is returned
+    for _ in range(2):
+        path = repo.resolve('file')
+        assert path.read_bytes() == b'value' and is_relative_to(path, temp_dir / 'disk')
+    assert not (cache_root / 'values').exists()
+
+
+def test_resolve_compressed(temp_dir, cache_root):
+    init_storage(StorageConfig(hash='sha256', levels=[1, 31]), temp_dir / 'disk')
+    root = temp_dir / 'repo'
+    root.mkdir()
+    (root / '.bev.yml').write_text(f'main: {{storage: {{compressed: {{location: {temp_dir / "disk"}}}}}}}')
+    repo = Repository(root, version=Local, check=True)
+    value = b'value' * 1000
+    create_structure(root, {'file.hash': repo.storage.write(value).hex()})
+
+    # the file on disk holds the compressed bytes, so it's never returned
+    path = repo.resolve('file')
+    assert path.read_bytes() == value and not is_relative_to(path, temp_dir / 'disk')
+
+
+def test_iter_shards_from_remote(temp_dir):
+    for name in ['local', 'remote']:
+        init_storage(StorageConfig(hash='sha256', levels=[1, 31]), temp_dir / name)
+    root = temp_dir / 'repo'
+    root.mkdir()
+    (root / '.bev.yml').write_text(
+        f'main: {{storage: {temp_dir / "local"}}}\nbackup: {{storage: {{remote: {temp_dir / "remote"}}}}}\n'
+        'meta: {hash: sha256, fallback: main}'
+    )
+    repo = Repository(root, version=Local)
+    remote = HashKeyStorage(DiskDict(temp_dir / 'remote'))
+    files = {f'{i}.txt': f'content {i}'.encode() for i in range(10)}
+    tree = tree_to_hash({name: remote.write(value).hex() for name, value in files.items()}, repo.storage)
+    index = write_shards(
+        tree, [(name, remote.write(value).hex()) for name, value in files.items()], remote, repo.trees, 50
+    )
+    create_structure(root, {'folder.hash': tree, 'folder.shards': index})
+    shards = {bytes.fromhex(shard['key']) for shard in read_shards(index, repo.trees)['shards']}
+
+    assert dict(repo.iter_files('folder', keep_shards=False)) == files
+    assert present_keys(repo.local, shards) == set()
+    assert dict(repo.iter_files('folder')) == files
+    assert present_keys(repo.local, shards) == shards
+
+
 def is_relative_to(this, *other):
     # copied from pathlib, for <py3.9 support
     try:
@@ -0,0 +1,289 @@
+import os
+from io import BytesIO
+
+import pytest
+
+from tarn import DiskDict, HashKeyStorage, Level
+from tarn.config import StorageConfig as TarnStorageConfig, init_storage
+from tarn.utils import value_to_buffer
+
+import bev.location.pruned
+from bev.config import StorageConfig
+from bev.config.compat import model_validate
+from bev.config.location import CompressedConfig, from_special
+from bev.location import (
+    BloomFilter, Compressed, Fanout, Levels, Manifested, Memory, Pack, Pruned, leaf_locations, present_keys, prune,
+)
+
+
+def write(location, value: bytes, key: bytes, time=None):
+    with location.write(key, BytesIO(value), None) as path:
+        assert path is not None
+    if time is not None:
+        os.utime(path, (time, time))
+
+
+def exists(location, key):
+    with location.read(key, False) as value:
+        return value is not None
+
+
+def test_prune(temp_dir):
+    local, remote = DiskDict(temp_dir / 'local'), DiskDict(temp_dir / 'remote')
+    keys = [bytes([i]) * 32 for i in range(4)]
+    for i, key in enumerate(keys):
+        write(local, b'0' * 100, key, 1000 + i)
+    # the oldest value exists only locally
+    for key in keys[1:]:
+        write(remote, b'0' * 100, key)
+
+    assert prune(local, remote, 250, dry_run=True) == (2, 200)
+    assert all(exists(local, key) for key in keys)
+    assert prune(local, None, 250) == (0, 0)
+
+    assert prune(local, remote, 250) == (2, 200)
+    assert [exists(local, key) for key in keys] == [True, False, False, True]
+    assert prune(local, remote, 0) == (1, 100)
+    assert [exists(local, key) for key in keys] == [True, False, False, False]
+
+
+def test_pruned(temp_dir, monkeypatch):
+    remote = DiskDict(temp_dir / 'remote')
+    local = Pruned(DiskDict(temp_dir / 'local'), remote, 1000)
+    keys = [bytes([i]) * 32 for i in range(20)]
+    for i, key in enumerate(keys):
+        write(remote, b'0' * 100, key)
+        write(local, b'0' * 100, key, 1000 + i)
+
+    present = [exists(local, key) for key in keys]
+    assert sum(present) <= 10
+    # the most recent values are kept
+    assert present[-1]
+
+    # the other processes reuse the computed size instead of scanning the storage
+    scans = []
+    original = bev.location.pruned._disk_entries
+    monkeypatch.setattr(
+        bev.location.pruned, '_disk_entries', lambda location: scans.append(location) or original(location)
+    )
+    other = Pruned(DiskDict(temp_dir / 'local'), remote, 1000)
+    write(other, b'1' * 100, bytes([20]) * 32)
+    assert scans == []
+    write(Pruned(DiskDict(temp_dir / 'local'), remote, 1000, rescan_interval=0), b'2' * 100, bytes([21]) * 32)
+    assert len(scans) == 1
+
+
+def test_max_size_config():
+    assert model_validate(StorageConfig, {'local': '/some/path', 'max_size': '1K'}).max_size == 1000
+    assert model_validate(StorageConfig, '/some/path').max_size is None
+
+
+def read(location, key):
+    with location.read(key, False) as value, value_to_buffer(value) as buffer:
+        return buffer.read()
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'bz2', 'lzma'])
+def test_compressed(temp_dir, codec):
+    disk = DiskDict(temp_dir)
+    location = Compressed(disk, codec)
+    text, noise = b'some text ' * 1000, os.urandom(1000)
+    write(location, text, b'\0' * 32)
+    write(location, noise, b'\1' * 32)
+    # the values written before compression was enabled
+    write(disk, b'raw', b'\2' * 32)
+
+    assert read(location, b'\0' * 32) == text
+    assert read(location, b'\1' * 32) == noise
+    assert read(location, b'\2' * 32) == b'raw'
+    assert not exists(location, b'\3' * 32)
+    with location.read(b'\0' * 32, True) as (value, labels):
+        assert value.read() == text
+
+    # the disk contains the compressed value, and the incompressible one is stored as is
+    with disk.read(b'\0' * 32, False) as path:
+        assert os.path.getsize(path) < len(text) // 10
+    with disk.read(b'\1' * 32, False) as path:
+        assert open(path, 'rb').read() == noise
+
+
+def test_compressed_config(temp_dir):
+    config = from_special({'compressed': {'location': str(temp_dir), 'codec': 'lzma', 'level': 9}})
+    assert isinstance(config, CompressedConfig)
+    location = config.build()
+    assert isinstance(location, Compressed)
+    assert (location.codec, location.level) == ('lzma', 9)
+    with pytest.raises(ValueError):
+        from_special({'compressed': {'location': str(temp_dir), 'codec': 'zip'}})
+
+
+def test_pack(temp_dir):
+    pack = Pack(temp_dir, max_pack_size=250)
+    keys = [bytes([i]) * 32 for i in range(10)]
+    for i, key in enumerate(keys):
+        write(pack, bytes([i]) * 100, key)
+    assert len(list(temp_dir.glob('*.pack'))) == 5
+
+    # another process sees the new values
+    other = Pack(temp_dir)
+    assert all(read(other, key) == bytes([i]) * 100 for i, key in enumerate(keys))
+    assert not exists(other, b'\xff' * 32)
+    assert {key for key, _, _ in other.contents()} == set(keys)
+    # the index is loaded, but the packs are not opened yet
+    stale = Pack(temp_dir)
+    assert stale.touch(keys[1])
+
+    assert all(pack.delete(key) for key in keys[::2])
+    assert not pack.delete(keys[0])
+    assert not exists(pack, keys[0])
+    assert pack.compact() == (5, 500)
+    assert len(list(temp_dir.glob('*.pack'))) == 3
+    # the removed packs are closed, so their space is actually freed
+    assert read(pack, keys[1]) == bytes([1]) * 100
+    assert [generation for generation, _ in pack._files] == [1]
+    # the old packs are gone, but the readers notice it
+    other = Pack(temp_dir)
+    assert read(stale, keys[1]) == bytes([1]) * 100
+    assert [exists(other, key) for key in keys] == [False, True] * 5
+    assert read(other, keys[1]) == bytes([1]) * 100
+
+    write(other, b'new', keys[0])
+    assert read(pack, keys[0]) == b'new'
+
+
+def test_pack_levels(temp_dir):
+    (temp_dir / 'pack').mkdir()
+    config = from_special({'levels': [{'pack': {'root': str(temp_dir / 'pack'), 'max_pack_size': '1M'}}]})
+    storage = HashKeyStorage(config.build(), algorithm='sha256')
+    key = storage.write(b'small value').hex()
+    assert storage.read(lambda value: value.read(), key) == b'small value'
+    assert (temp_dir / 'pack/0-0.pack').read_bytes() == b'small value'
+
+
+def test_memory():
+    memory = Memory(250, max_value_size=250)
+    keys = [bytes([i]) * 32 for i in range(4)]
+    for i, key in enumerate(keys[:2]):
+        write(memory, bytes([i]) * 100, key)
+    assert exists(memory, keys[0])
+    # the least recently used value is evicted
+    write(memory, b'2' * 100, keys[2])
+    assert [exists(memory, key) for key in keys] == [True, False, True, False]
+    # too large
+    with memory.write(keys[3], BytesIO(b'3' * 251), None) as value:
+        assert value is None
+
+    stats = memory.stats
+    assert (stats.hits, stats.misses, stats.evictions, stats.count, stats.size) == (3, 2, 1, 2, 200)
+    assert stats.hit_rate == 0.6
+    assert memory.delete(keys[0])
+    assert memory.stats.size == 100
+
+
+def test_memory_levels(temp_dir):
+    init_storage(TarnStorageConfig(hash='sha256', levels=[1, 31]), temp_dir / 'disk')
+    config = from_special({'levels': [{'location': {'memory': '1K'}, 'write': False}, str(temp_dir / 'disk')]})
+    assert isinstance(config.build().locations[0], Memory)
+
+    memory = Memory(1024)
+    storage = HashKeyStorage(Levels(Level(memory, write=False), DiskDict(temp_dir / 'disk')))
+    key = storage.write(b'value').hex()
+    assert memory.stats.count == 0
+
+    for _ in range(3):
+        assert storage.read(lambda value: value.read(), key) == b'value'
+    assert (memory.stats.hits, memory.stats.count) == (2, 1)
+
+
+def test_bloom_filter():
+    keys = [os.urandom(32) for _ in range(1000)]
+    bloom = BloomFilter(1000, 0.01)
+    bloom.update(keys)
+    assert all(key in bloom for key in keys)
+    assert sum(os.urandom(32) in bloom for _ in range(1000)) < 50
+
+    restored = BloomFilter.from_bytes(bloom.to_bytes())
+    assert all(key in restored for key in keys)
+    with pytest.raises(ValueError):
+        BloomFilter.from_bytes(bloom.to_bytes()[:-1])
+
+
+def test_manifested(temp_dir):
+    class Counting(DiskDict):
+        reads = 0
+
+        def read(self, key, return_labels):
+            Counting.reads += 1
+            return super().read(key, return_labels)
+
+    init_storage(TarnStorageConfig(hash='sha256', levels=[1, 31]), temp_dir / 'remote')
+    remote = Counting(temp_dir / 'remote')
+    present, missing = b'1' * 32, b'2' * 32
+    # no manifest yet - all the requests go through
+    location = Manifested(remote)
+    write(location, b'old value', present)
+    assert not exists(location, missing)
+    assert not location.publish()
+    # the keys are listed by the location
+    assert location.rebuild([], 32) == 1
+    assert [key for key, _, _ in location.contents()] == [present]
+
+    client = Manifested(Counting(temp_dir / 'remote'))
+    reads = Counting.reads
+    assert not exists(client, missing)
+    assert exists(client, present)
+    # the manifest, the first free slot and the present value
+    assert Counting.reads == reads + 3
+
+    # the new values become visible after publishing
+    write(location, b'new value', missing)
+    assert location.publish()
+    assert not exists(client, missing)
+    client.max_age = 0
+    assert exists(client, missing)
+
+    # concurrent publishers don't overwrite each other's keys
+    class Late(Manifested):
+        stale = False
+
+        def _load(self, size):
+            # pretend that the other publisher took the slot right after it was checked
+            if self.stale:
+                self.stale = False
+                return
+            super()._load(size)
+
+    first, second = Manifested(DiskDict(temp_dir / 'remote')), Late(DiskDict(temp_dir / 'remote'))
+    keys = b'3' * 32, b'4' * 32
+    assert exists(first, present) and exists(second, present)
+    write(first, b'first', keys[0])
+    write(second, b'second', keys[1])
+    second.stale = True
+    assert first.publish() and second.publish()
+    assert exists(client, keys[0]) and exists(client, keys[1])
+
+    # the slots are merged by a rebuild
+    assert location.rebuild([], 32) == 4
+    assert not exists(DiskDict(temp_dir / 'remote'), bytes(24) + (1).to_bytes(8, 'big'))
+    assert exists(client, keys[0]) and exists(client, keys[1])
+
+
+def test_manifest_read_only():
+    with pytest.raises(ValueError, match='read-only'):
+        from_special({'manifest': {'location': {'nginx': 'http://localhost'}}})
+
+
+def test_present_keys(temp_dir):
+    init_storage(TarnStorageConfig(hash='sha256', levels=[1, 1, 30]), temp_dir / 'disk')
+    (temp_dir / 'pack').mkdir()
+    disk, pack = DiskDict(temp_dir / 'disk'), Pack(temp_dir / 'pack')
+    keys = [bytes([i]) * 32 for i in range(4)]
+    write(disk, b'0', keys[0])
+    write(pack, b'1', keys[1])
+
+    assert present_keys(disk, keys) == {keys[0]}
+    assert present_keys(from_special([str(temp_dir / 'disk'), {'pack': str(temp_dir / 'pack')}]).build(), keys) == {
+        keys[0], keys[1]
+    }
+    assert present_keys(Pruned(disk, None, 100), keys[1:]) == set()
+    assert list(leaf_locations(Levels(Pruned(disk, None, 100), Fanout(pack)))) == [disk, pack]
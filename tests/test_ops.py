@@ -1,8 +1,18 @@
+import io
+import os
+import random
+from pathlib import Path
+
 import pytest
+from tarn import DiskDict
 
-from bev import Repository
-from bev.hash import tree_to_hash
-from bev.ops import gather
+import bev.digests
+from bev import Local, Repository
+from bev.chunking import iter_chunks, read_manifest
+from bev.exceptions import HashError
+from bev.hash import is_chunked, load_tree, normalize_tree, read_tree, strip_tree, tree_to_hash
+from bev.location import Manifested
+from bev.ops import folder_status, gather, gather_hash, push_keys, reachable_keys, verify_keys
 from bev.testing import create_structure
 
 
@@ -72,6 +82,257 @@ def test_gather_nested_hash(tmpdir, temp_repo, tests_root, sha256empty):
     }
 
 
+def test_gather_conflicts(tmpdir, temp_repo, sha256empty):
+    storage = Repository(temp_repo).storage
+    tmpdir = create_structure(tmpdir, {
+        'a.txt': None,
+        'b.hash': tree_to_hash({'f.txt': storage.write(__file__).hex()}, storage),
+        'b/f.txt': None,
+    })
+    for func in [gather, gather_hash]:
+        with pytest.raises(ValueError):
+            func(tmpdir, storage)
+
+    # the symlinks to folders are skipped
+    (tmpdir / 'b.hash').unlink()
+    (tmpdir / 'b/cycle').symlink_to(tmpdir, target_is_directory=True)
+    assert gather(tmpdir, storage) == {'a.txt': sha256empty, 'b/f.txt': sha256empty}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 100])
+def test_gather_hash(tmpdir, temp_repo, chunk_size):
+    storage = Repository(temp_repo).storage
+    tmpdir = create_structure(tmpdir, {
+        'a.json': 'a',
+        'b.hash': tree_to_hash({
+            'c.txt': storage.write(b'c').hex(),
+            'd/e.txt': storage.write(b'e').hex(),
+        }, storage),
+        'b/f.txt': 'f',
+        'b.txt': 'b',
+        'b-g.png.hash': storage.write(b'g').hex(),
+        'nested/deep/h.npy': 'h',
+        'nested/i.npy': 'i',
+    })
+
+    key = gather_hash(tmpdir, storage, chunk_size=chunk_size)
+    assert key == tree_to_hash(gather(tmpdir, storage), storage)
+    assert gather_hash(tmpdir / 'a.json', storage) == gather(tmpdir / 'a.json', storage)
+    assert gather_hash(tmpdir / 'b.hash', storage) == tree_to_hash(gather(tmpdir / 'b.hash', storage), storage)
+
+
+@pytest.mark.parametrize('nested', [False, True])
+def test_gather_hash_conflict(tmpdir, temp_repo, nested):
+    storage = Repository(temp_repo).storage
+    # "x" is both a file and a folder
+    tmpdir = create_structure(tmpdir, {'x.hash': storage.write(b'x').hex(), 'x/y.txt': 'y', 'x-z.txt': 'z'})
+
+    with pytest.raises(HashError, match='is used both by a file and a folder'):
+        gather_hash(tmpdir, storage, nested=nested)
+    with pytest.raises(HashError, match='is used both by a file and a folder'):
+        tree_to_hash(gather(tmpdir, storage), storage, nested=nested)
+
+
 def test_gather_missing():
     with pytest.raises(FileNotFoundError):
         gather('/tmp/missing', None)
+
+
+def test_normalize_tree(sha256empty):
+    other = '1' * 64
+    # already normalized
+    flat = {'a.txt': sha256empty, 'folder/b.txt': other, '.hidden/..c': other}
+    assert normalize_tree(flat, 32) == flat
+    # nested and denormalized
+    for tree in [
+        {'./a.txt': sha256empty, 'folder/': {'b.txt': other}, '.hidden//..c': other},
+        {Path('a.txt'): sha256empty, 'folder': {Path('b.txt'): other}, '.hidden': {'./..c': other}},
+    ]:
+        assert normalize_tree(tree, 32) == flat
+
+    with pytest.raises(ValueError):
+        normalize_tree({'a': 'short'}, 32)
+    with pytest.raises(ValueError):
+        normalize_tree({'a': sha256empty, './a': other}, 32)
+
+
+def test_nested_tree(temp_repo, sha256empty):
+    storage = Repository(temp_repo).storage
+    other = storage.write(b'other').hex()
+    tree = {
+        'a.txt': sha256empty,
+        'a/b.txt': other,
+        'a/c/d.txt': sha256empty,
+        'a/c/e.txt': other,
+        'a-f/g.txt': other,
+        'h.txt': other,
+    }
+    flat, nested = tree_to_hash(tree, storage), tree_to_hash(tree, storage, nested=True)
+    assert flat != nested
+    assert read_tree(flat, storage) == read_tree(nested, storage) == tree
+
+    root = storage.read(load_tree, strip_tree(nested))
+    assert set(root) == {'a.txt', 'a', 'a-f', 'h.txt'}
+    assert storage.read(load_tree, strip_tree(root['a']))['c'] == tree_to_hash({
+        'd.txt': sha256empty, 'e.txt': other,
+    }, storage)
+
+    # a change inside a folder doesn't affect its siblings
+    changed = tree_to_hash({**tree, 'a/c/e.txt': sha256empty}, storage, nested=True)
+    changed_root = storage.read(load_tree, strip_tree(changed))
+    assert changed_root['a-f'] == root['a-f']
+    assert changed_root['a'] != root['a']
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_verify(temp_repo, tests_root, workers):
+    repo = Repository(temp_repo, version=Local, fetch=False)
+    storage = repo.storage
+    a = storage.write(tests_root / 'conftest.py').hex()
+    b = storage.write(tests_root / 'requirements.txt').hex()
+    missing = '1' * 64
+    tree = tree_to_hash({'a': a, 'nested/b': b, 'nested/c': missing}, storage, nested=True)
+    create_structure(temp_repo, {
+        'data.hash': tree,
+        'folder/file.hash': a,
+    })
+
+    keys = reachable_keys(repo)
+    # the trees are also reachable
+    assert {a, b, missing, strip_tree(tree)} < keys
+    assert len(keys) == 5
+    assert reachable_keys(repo, ['folder']) == {a}
+    assert reachable_keys(repo, ['folder/file']) == {a}
+    assert verify_keys(repo, keys, workers) == ({missing}, set())
+
+    path = repo.resolve('data/nested/b')
+    os.chmod(path, 0o777)
+    with open(path, 'w') as file:
+        file.write('!')
+    assert verify_keys(repo, keys, workers) == ({missing}, {b})
+
+
+def test_push(temp_repo, temp_dir, tests_root):
+    repo = Repository(temp_repo)
+    a = repo.storage.write(tests_root / 'conftest.py').hex()
+    b = repo.storage.write(tests_root / 'requirements.txt').hex()
+    missing = '1' * 64
+    first, second = DiskDict(temp_dir / 'first'), DiskDict(temp_dir / 'second')
+    with first.write(bytes.fromhex(a), tests_root / 'conftest.py', None):
+        pass
+
+    assert push_keys(repo, [a, b], [first, second], workers=2) == ({a, b}, set(), set())
+    # can be restarted
+    assert push_keys(repo, [a, b, missing], [first, second], workers=2) == (set(), {a, b}, {missing})
+    for location in [first, second]:
+        for key in [a, b]:
+            with location.read(bytes.fromhex(key), False) as value:
+                assert value is not None
+
+
+def test_push_presence(temp_repo, temp_dir, tests_root):
+    class Counted(DiskDict):
+        def read(self, key, return_labels):
+            reads.append(key)
+            return super().read(key, return_labels)
+
+    repo = Repository(temp_repo)
+    a = repo.storage.write(tests_root / 'conftest.py').hex()
+    b = repo.storage.write(tests_root / 'requirements.txt').hex()
+    reads = []
+    disk, remote = Counted(temp_dir / 'disk'), Counted(temp_dir / 'remote')
+    assert push_keys(repo, [a], [disk], workers=2) == ({a}, set(), set())
+    assert push_keys(repo, [a, b], [disk], workers=2) == ({b}, {a}, set())
+    # the disk is listed instead
+    assert reads == []
+
+    manifested = Manifested(remote)
+    manifested.rebuild([], repo.storage.digest_size)
+    reads.clear()
+    assert push_keys(repo, [a, b], [manifested], workers=2) == ({a, b}, set(), set())
+    # the keys are missing from the manifest, so they are not checked
+    assert not [key for key in reads if key in {bytes.fromhex(a), bytes.fromhex(b)}]
+
+
+def test_chunks():
+    data = random.Random(0).getrandbits(8 * 2 ** 20).to_bytes(2 ** 20, 'little')
+    chunks = list(iter_chunks(io.BytesIO(data), 4096))
+    assert b''.join(chunks) == data
+    assert all(1024 <= len(chunk) <= 4096 * 8 for chunk in chunks[:-1])
+    assert 100 < len(chunks) < 1000
+
+    # an insertion changes only the chunks around it
+    changed = list(iter_chunks(io.BytesIO(data[:500_000] + b'inserted' + data[500_000:]), 4096))
+    assert len(set(changed) - set(chunks)) <= 2
+    assert list(iter_chunks(io.BytesIO(b''))) == []
+
+
+def test_chunks_structured():
+    rng = random.Random(0)
+    data = ''.join(f'{i},name{i % 97},{rng.random():.6f}\n' for i in range(40_000)).encode()
+    chunks = list(iter_chunks(io.BytesIO(data), 4096))
+    assert b''.join(chunks) == data
+    assert 100 < len(chunks) < 1000
+
+    # text has no long runs of random bytes, but the boundaries still survive an insertion
+    middle = len(data) // 2
+    changed = list(iter_chunks(io.BytesIO(data[:middle] + b'x' + data[middle:]), 4096))
+    assert len(set(changed) - set(chunks)) <= 2
+    assert len(set(changed) & set(chunks)) >= len(chunks) - 2
+    # repeated data is split into identical chunks of the maximal size
+    assert {len(chunk) for chunk in iter_chunks(io.BytesIO(bytes(10 * 4096 * 8)), 4096)} == {4096 * 8}
+
+
+def test_gather_chunked(temp_repo, cache_root):
+    repo = Repository(temp_repo, version=Local)
+    data = os.urandom(3 * 2 ** 20)
+    create_structure(temp_repo, {'folder/small.txt': None})
+    (temp_repo / 'folder/large.bin').write_bytes(data)
+
+    tree = gather(temp_repo / 'folder', repo, chunk_threshold=2 ** 20)
+    assert not is_chunked(tree['small.txt'])
+    assert is_chunked(tree['large.bin'])
+    manifest = read_manifest(tree['large.bin'], repo.storage)
+    assert manifest['size'] == len(data)
+    # the whole file is not stored, only its chunks
+    with repo.storage.read(manifest['digest'], fetch=False, error=False) as value:
+        assert value is None
+
+    key = gather_hash(temp_repo / 'folder', repo, chunk_threshold=2 ** 20)
+    assert read_tree(key, repo.storage) == tree
+    (temp_repo / 'folder/large.bin').unlink()
+    (temp_repo / 'folder/small.txt').unlink()
+    (temp_repo / 'folder').rmdir()
+    (temp_repo / 'folder.hash').write_text(key)
+
+    path = repo.resolve('folder/large.bin')
+    assert path.read_bytes() == data and path.parent.parent == cache_root / 'values'
+    # the assembled file is not stored either
+    with repo.storage.read(manifest['digest'], fetch=False, error=False) as value:
+        assert value is None
+    assert repo.get_key('folder/large.bin') == tree['large.bin']
+    keys = reachable_keys(repo, ['folder'])
+    assert {chunk for chunk, _ in manifest['chunks']} < keys
+    assert manifest['digest'] not in keys
+
+
+def test_folder_status(temp_repo, monkeypatch):
+    repo = Repository(temp_repo, version=Local)
+    create_structure(temp_repo, {
+        'folder/a.txt': 'a', 'folder/b.txt': 'b', 'folder/c.txt': 'c', 'folder/nested/d.txt': 'd',
+    })
+    (temp_repo / 'folder.hash').write_text(gather_hash(temp_repo / 'folder', repo))
+    assert folder_status(repo, temp_repo / 'folder') == ([], [], [])
+
+    (temp_repo / 'folder/a.txt').unlink()
+    (temp_repo / 'folder/b.txt').write_text('B')
+    (temp_repo / 'folder/c.txt').write_text('longer')
+    (temp_repo / 'folder/e.txt').write_text('e')
+    assert folder_status(repo, temp_repo / 'folder.hash') == (['e.txt'], ['a.txt'], ['b.txt', 'c.txt'])
+
+    # the unchanged files are not hashed again
+    digests = []
+    original = bev.digests.digest_value
+    monkeypatch.setattr(bev.digests, 'digest_value', lambda *args: digests.append(args) or original(*args))
+    folder_status(repo, temp_repo / 'folder')
+    assert digests == []
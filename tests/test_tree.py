@@ -0,0 +1,73 @@
+import os
+
+from bev.tree import TreeChange, TreeNode, diff_trees
+
+
+def test_tree_node(sha256empty):
+    other = '1' * 64
+    flat = {
+        'a.txt': sha256empty,
+        os.path.join('folder', 'b.txt'): other,
+        os.path.join('folder', 'nested', 'c.txt'): sha256empty,
+        os.path.join('folder', 'nested', 'd.txt'): other,
+        'e.txt': other,
+    }
+    tree = TreeNode.from_flat(flat)
+    assert tree.to_flat() == flat
+    assert len(tree) == 3
+
+    assert tree.get('a.txt') == sha256empty
+    assert tree.get(os.path.join('folder', 'nested', 'd.txt')) == other
+    assert isinstance(tree.get('folder'), TreeNode)
+    assert isinstance(tree.get(os.path.join('folder', 'nested')), TreeNode)
+    assert tree.get('missing') is None
+    assert tree.get(os.path.join('folder', 'missing', 'c.txt')) is None
+    assert tree.get(os.path.join('a.txt', 'inside')) is None
+
+    folder = tree.get('folder')
+    assert {name: isinstance(value, TreeNode) for name, value in folder.items()} == {'b.txt': False, 'nested': True}
+
+    # the older trees might have both a file and a folder with the same name
+    legacy = {'a': sha256empty, os.path.join('a', 'b'): other}
+    for flat in [legacy, dict(reversed(legacy.items()))]:
+        tree = TreeNode.from_flat(flat)
+        assert tree.get('a') == sha256empty and tree.get(os.path.join('a', 'b')) == other
+        assert tree.to_flat() == legacy
+
+
+def test_diff_trees(sha256empty):
+    other = '1' * 64
+    old = TreeNode.from_flat({
+        'a.txt': sha256empty,
+        'b.txt': sha256empty,
+        os.path.join('folder', 'c.txt'): sha256empty,
+        os.path.join('folder', 'd.txt'): sha256empty,
+        'file': sha256empty,
+    })
+    new = TreeNode.from_flat({
+        'a.txt': sha256empty,
+        'b.txt': other,
+        os.path.join('folder', 'd.txt'): sha256empty,
+        os.path.join('file', 'e.txt'): other,
+        'new.txt': other,
+    })
+    assert list(diff_trees(old, new)) == [
+        TreeChange('b.txt', sha256empty, other),
+        TreeChange('file', sha256empty, None),
+        TreeChange(os.path.join('file', 'e.txt'), None, other),
+        TreeChange(os.path.join('folder', 'c.txt'), sha256empty, None),
+        TreeChange('new.txt', None, other),
+    ]
+    assert list(diff_trees(old, old)) == []
+    assert list(diff_trees(None, old.get('folder'))) == [
+        TreeChange('c.txt', None, sha256empty), TreeChange('d.txt', None, sha256empty),
+    ]
+    assert list(diff_trees(sha256empty, other)) == [TreeChange('.', sha256empty, other)]
+
+    # identical nested trees are never loaded
+    def load(key):
+        raise AssertionError(key)
+
+    assert list(diff_trees(
+        TreeNode.from_flat({'a': 'T:' + other}, load), TreeNode.from_flat({'a': 'T:' + other}, load)
+    )) == []
@@ -39,6 +39,38 @@ def test_subprocess_git(temp_dir):
         vc.list_dir('missing', 'v1')
 
 
+def test_get_history(temp_dir):
+    def commit(message):
+        subprocess.check_call(['git', 'add', '.'], cwd=temp_dir)
+        subprocess.check_call(['git', 'commit', '-m', message], cwd=temp_dir)
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=temp_dir).decode().strip()
+
+    subprocess.check_call(['git', 'init'], cwd=temp_dir)
+    root = temp_dir / 'root'
+    root.mkdir()
+    file = root / 'file.hash'
+    file.write_text('first')
+    first = commit('first')
+    (root / 'other').touch()
+    other = commit('other')
+    file.write_text('second')
+    second = commit('second')
+    file.unlink()
+    third = commit('third')
+
+    vc = SubprocessGit(root)
+    assert [(version, content) for version, _, content in vc.get_history('file.hash')] == [
+        (third, None), (second, 'second'), (first, 'first'),
+    ]
+    assert list(vc.get_history('missing')) == []
+    assert vc.get_versions(['file.hash', 'other', '.', 'missing']) == {
+        'file.hash': third, 'other': other, '.': third, 'missing': None,
+    }
+    assert vc.read_files(other, '.hash') == {'file.hash': 'first'}
+    assert vc.read_files(third) == {'other': ''}
+    assert len(vc.list_refs()) == 1
+
+
 # @pytest.mark.xfail
 # @pytest.mark.parametrize('version', [
 #     '03b5b303e7a9e01e8023d2213cd53cccdca3b0c8',